@@ -0,0 +1,24 @@
+import argparse
+parser = argparse.ArgumentParser()
+
+from lib.arbitrage import ArbitrageEngine, MarketDistances
+
+
+parser.add_argument("origin", help="market the load starts from")
+parser.add_argument("grade", help="grade of the load")
+parser.add_argument("--commodity", default='Kinnow', help="commodity to rank markets for")
+parser.add_argument("--top", type=int, default=10, help="number of markets to show")
+parser.add_argument("--forecast", action='store_true', help="rank by forecast rather than latest prices")
+parser.add_argument("--cost-per-km", type=float, default=0.35, help="transport cost in Rs per quintal per km")
+parser.add_argument("--distances", default='data/market_distances.csv', help="market distance csv")
+
+
+def main():
+    args = parser.parse_args()
+    ae = ArbitrageEngine(args.commodity, MarketDistances.load(args.distances), args.cost_per_km)
+    ae.refresh()
+    print(ae.rank(args.origin, args.grade, args.top, args.forecast).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,24 @@
+import argparse
+parser = argparse.ArgumentParser()
+
+from lib.batch import DashboardBatch
+
+
+parser.add_argument("commodities", nargs='+', help="commodities to render dashboards for")
+parser.add_argument("--start", default='2015-10-01', help="start of the availability window")
+parser.add_argument("--end", help="last date to include; defaults to today")
+parser.add_argument("--days", type=int, default=92, help="window for current market and trend views")
+parser.add_argument("--processes", type=int, help="worker processes; defaults to the number of cores")
+parser.add_argument("--outdir", default='data/dashboards/', help="output directory")
+parser.add_argument("--format", default='json', choices=['json', 'html'], help="figure output format")
+
+
+def main():
+    args = parser.parse_args()
+    b = DashboardBatch(args.commodities, args.start, args.end, args.days, args.processes,
+                       args.outdir, args.format)
+    b.run()
+
+
+if __name__ == "__main__":
+    main()
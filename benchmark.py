@@ -0,0 +1,35 @@
+import sys
+import argparse
+parser = argparse.ArgumentParser()
+
+from lib.benchmarks import BenchmarkSuite, compare
+
+
+parser.add_argument("--commodities", type=int, default=1, help="number of commodities")
+parser.add_argument("--states", type=int, default=4, help="number of states")
+parser.add_argument("--markets", type=int, default=20, help="markets per state")
+parser.add_argument("--years", type=int, default=3, help="years of history")
+parser.add_argument("--repeats", type=int, default=3, help="runs per benchmark")
+parser.add_argument("--db", default='sqlite:///data/benchmark.sqlite',
+                    help="sqlalchemy url to benchmark writes against")
+parser.add_argument("--out", help="results file; defaults to benchmarks/results/<time>_<commit>.json")
+parser.add_argument("--compare", help="earlier results file to compare against")
+parser.add_argument("--threshold", type=float, default=0.1,
+                    help="slowdown ratio that counts as a regression")
+
+
+def main():
+    args = parser.parse_args()
+    bs = BenchmarkSuite(args.commodities, args.states, args.markets, args.years,
+                        args.repeats, args.db)
+    bs.run()
+    path = bs.save(args.out)
+    if args.compare:
+        regressions = compare(args.compare, path, args.threshold)
+        if regressions:
+            print('Regressions: {}'.format(', '.join(regressions)))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
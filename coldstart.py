@@ -0,0 +1,31 @@
+import sys
+import json
+import argparse
+parser = argparse.ArgumentParser()
+
+from lib.coldstart import ColdStartBenchmark
+
+
+parser.add_argument("--module", default='lambda_function', help="entry point module")
+parser.add_argument("--budget-ms", type=float, default=150, help="import-time budget in ms")
+parser.add_argument("--repeats", type=int, default=5, help="fresh interpreters per measurement")
+parser.add_argument("--image", help="docker image to measure in, e.g. public.ecr.aws/lambda/python:3.8")
+parser.add_argument("--memory", default='1024m', help="container memory limit")
+parser.add_argument("--event", help="event json file; also times a full cold invocation")
+parser.add_argument("--out", help="results file; defaults to benchmarks/results/<time>_coldstart.json")
+
+
+def main():
+    args = parser.parse_args()
+    csb = ColdStartBenchmark(args.module, args.budget_ms, args.repeats, args.image, args.memory,
+                             args.event)
+    print(json.dumps(csb.run(), indent=2))
+    csb.save(args.out)
+    problems = csb.check()
+    if problems:
+        print('\n'.join(problems))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
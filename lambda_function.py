@@ -0,0 +1,56 @@
+"""
+lambda_function.py:
+    AWS Lambda entry point for the scrapers. Only the scraper module and the
+    standard library load during init; Selenium, pandas, and SQLAlchemy are
+    imported on first use inside the handler. Each invocation logs whether it
+    was a cold start and how long init took
+
+    Event:
+        {"datatype": "prices", "commodity": "Kinnow", "state": "Punjab",
+         "start": "2018-12-01", "end": "2018-12-10"}
+        datatype defaults to prices, commodity to Kinnow, and dates to today
+
+    Check the init cost with `python coldstart.py`
+"""
+
+import time
+_init_start = time.perf_counter()
+
+import logging
+
+from lib import scrapers as s
+from lib.checkpoint import Checkpoint
+from lib.metrics import METRICS
+
+logging.getLogger('agmarknet').setLevel(logging.INFO)
+
+INIT_SECONDS = time.perf_counter() - _init_start
+CHECKPOINT_DIR = '/tmp/checkpoints/'
+_cold = True
+
+
+def lambda_handler(event, context):
+    global _cold
+    cold, _cold = _cold, False
+    start = time.perf_counter()
+    METRICS.reset()
+    datatype = event.get('datatype', 'prices')
+    args = (event.get('commodity', 'Kinnow'), event['state'], event.get('start'), event.get('end'))
+    if datatype == 'prices':
+        scraper = s.MandiPriceScraper(*args, serverless=True)
+    else:
+        scraper = s.MandiQuantityScraper(*args, serverless=True)
+    # /var/task is read-only; /tmp survives between warm invocations
+    scraper.checkpoint = Checkpoint(scraper.checkpoint.job, CHECKPOINT_DIR)
+    scraper.run()
+    result = {
+        'datatype': datatype,
+        'state': event['state'],
+        'cold': cold,
+        'init_seconds': round(INIT_SECONDS, 4),
+        'seconds': round(time.perf_counter() - start, 3),
+        'rows': METRICS.total('rows'),
+        'pages': METRICS.total('pages'),
+        }
+    METRICS.log('lambda_invoke', **result)
+    return result
@@ -0,0 +1,205 @@
+"""
+anomalies.py:
+    Flags prices and arrivals that are far out of line with their market's
+    recent history - agmarknet's numbers are sometimes simply wrong, and a
+    modal price off by a factor of ten skews every chart it's in
+
+    Each series - a market's modal price for a grade, or its arrivals -
+    keeps its last WINDOW values by date in anomaly_state, with the median
+    and median absolute deviation (MAD) of their logs. A new row's robust
+    z-score is 0.6745 * (log value - median) / MAD, so it measures ratios:
+    a price ten times the usual stands out, arrivals climbing at the start
+    of a season don't. The MAD is floored at MIN_MAD so flat series don't
+    flag every small move; rows scoring beyond THRESHOLD in a series with
+    MIN_HISTORY values are recorded in the anomalies table. Rows are
+    scored against the statistics as they stood before their batch, then
+    merged into each series' window by date, so each write costs the rows
+    written, not the series' history. Date chunks can land in any order:
+    the windows end up the same, and a rewritten row replaces its old value
+
+    Flagged rows stay in prices and arrivals; dashboards exclude or
+    highlight them (see Trends in lib/plotters.py)
+
+    AnomalyDetector (cls): Scores new rows and keeps per-series statistics
+    exclude (func): Drops flagged rows from prices or arrivals
+"""
+
+import json
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text, bindparam
+
+import lib.helpers as h
+from lib.metrics import METRICS, timed
+
+WINDOW = 30
+THRESHOLD = 3.5       # the usual cutoff for robust z-scores (Iglewicz and Hoaglin)
+MIN_HISTORY = 10
+VALUES = {'prices': 'modal_price', 'arrivals': 'quantity'}
+SERIES = ['commodity', 'state', 'district', 'market', 'grade']
+ROW = SERIES + ['date', 'variety']
+# smallest MAD of log values used for scoring - about a 10% spread
+MIN_MAD = 0.1
+
+
+def exclude(df, anomalies, datatype):
+    """Rows of prices or arrivals df that aren't flagged in anomalies"""
+    flagged = anomalies[anomalies['datatype'] == datatype]
+    if df.empty or flagged.empty:
+        return df
+    keys = ROW if datatype == 'prices' else ['commodity', 'date', 'state', 'district', 'market']
+    rows = pd.MultiIndex.from_frame(df[keys].assign(date=pd.to_datetime(df['date'])))
+    flagged = pd.MultiIndex.from_frame(flagged[keys].assign(date=pd.to_datetime(flagged['date'])))
+    return df[~rows.isin(flagged)]
+
+
+
+class AnomalyDetector(object):
+    """
+    Scores new rows and keeps per-series statistics
+
+    Args:
+        engine (engine): [Optional] SQLAlchemy engine; defaults to helpers.db_connect()
+        window (int): Values kept per series
+        threshold (float): Robust z-score beyond which a row is flagged
+        min_history (int): Values a series needs before its rows are scored
+
+    Usage:
+        ad = AnomalyDetector()
+        ad.rebuild('Kinnow')                # once, from raw history
+        ad.update('prices', rows)           # as rows are written
+    """
+    def __init__(self, engine=None, window=WINDOW, threshold=THRESHOLD, min_history=MIN_HISTORY):
+        self.engine = engine
+        self.window = window
+        self.threshold = threshold
+        self.min_history = min_history
+        self.STATETABLE = 'anomaly_state'
+        self.DBTABLE = 'anomalies'
+
+
+    def connect(self):
+        if not self.engine:
+            self.engine = h.db_connect()
+
+
+    def frame(self, datatype, rows):
+        """Rows as a frame of series keys, date, variety, and value; arrivals get an empty grade and variety"""
+        df = pd.DataFrame(rows)
+        if datatype == 'arrivals':
+            df = df.assign(grade='', variety='')
+        df = df.assign(date=pd.to_datetime(df['date']), value=pd.to_numeric(df[VALUES[datatype]]))
+        return df[ROW + ['value']].dropna(subset=['value'])
+
+
+    def load_state(self, datatype, df):
+        """Statistics of the series in df"""
+        stmt = text('select * from {} where datatype = :datatype and commodity in :commodities '
+                    'and state in :states'.format(self.STATETABLE))
+        stmt = stmt.bindparams(bindparam('commodities', expanding=True), bindparam('states', expanding=True))
+        with self.engine.connect() as conn:
+            state = pd.read_sql(stmt, con=conn, params=dict(datatype=datatype,
+                                                            commodities=list(df['commodity'].unique()),
+                                                            states=list(df['state'].unique())))
+        return state.assign(last_date=pd.to_datetime(state['last_date'])).drop(columns='datatype')
+
+
+    def score(self, datatype, df, state):
+        """df with each row's series median, MAD, score, and whether it's flagged"""
+        stats = state[SERIES + ['median', 'mad', 'n']].astype({'median': float, 'mad': float, 'n': float})
+        scored = df.merge(stats, on=SERIES, how='left')
+        spread = np.maximum(scored['mad'], MIN_MAD)
+        scored['score'] = 0.6745 * (np.log1p(scored['value']) - scored['median']) / spread
+        scored['flag'] = (scored['n'] >= self.min_history) & (scored['score'].abs() > self.threshold)
+        return scored
+
+
+    def advance(self, df, state):
+        """
+        Statistics of the series in df once its rows are merged into each
+        series' window by date - chunks can be written in any order. A row
+        already in the window, e.g. from a rerun, replaces its old value.
+        Series whose windows don't change are left out
+        """
+        keys = SERIES + ['date', 'variety']
+        touched = state.merge(df[SERIES].drop_duplicates(), on=SERIES)
+        windows = zip(touched[SERIES].itertuples(index=False, name=None), touched['recent'])
+        old = pd.DataFrame([key + tuple(entry) for key, recent in windows for entry in json.loads(recent)],
+                           columns=keys + ['value'])
+        values = pd.concat([old.assign(date=pd.to_datetime(old['date'])), df[keys + ['value']]],
+                           ignore_index=True, sort=False)
+        values = values.drop_duplicates(keys, keep='last').sort_values(keys, kind='mergesort')
+        values = values.groupby(SERIES, sort=False).tail(self.window)
+        values['value'] = values['value'].astype(float).round(2)
+        values['log'] = np.log1p(values['value'])
+        grouped = values.groupby(SERIES, sort=False)['log']
+        values['deviation'] = (values['log'] - grouped.transform('median')).abs()
+        values['entry'] = list(zip(values['date'].dt.strftime('%Y-%m-%d'), values['variety'], values['value']))
+        advanced = grouped.agg(['median', 'size']).rename(columns={'size': 'n'})
+        advanced['mad'] = values.groupby(SERIES, sort=False)['deviation'].median()
+        advanced['recent'] = values.groupby(SERIES, sort=False)['entry'].agg(lambda e: json.dumps(list(e)))
+        advanced['last_date'] = values.groupby(SERIES, sort=False)['date'].max()
+        advanced = advanced.reset_index()
+        same = advanced.merge(touched[SERIES + ['recent']], on=SERIES + ['recent'], how='left', indicator=True)
+        return advanced[(same['_merge'] == 'left_only').values]
+
+
+    def flagged(self, datatype, scored):
+        flags = scored[scored['flag']]
+        # median back on the value's own scale, as the series' usual value
+        flags = flags[ROW + ['value', 'score']].assign(
+            datatype=datatype, date=flags['date'].dt.date, median=np.expm1(flags['median']).round(2),
+            flagged=pd.Timestamp.now().to_pydatetime())
+        return flags
+
+
+    def write(self, datatype, flags, advanced):
+        if len(advanced):
+            h.upsert_rows(self.engine, self.STATETABLE, advanced.assign(
+                datatype=datatype, last_date=pd.to_datetime(advanced['last_date']).dt.date).to_dict('records'))
+        if len(flags):
+            h.upsert_rows(self.engine, self.DBTABLE, flags.to_dict('records'))
+            METRICS.incr('anomalies', len(flags), table=datatype)
+            print('Flagged {} {} rows'.format(len(flags), datatype))
+
+
+    @timed('update_anomalies')
+    def update(self, datatype, rows):
+        """Scores rows against their series and adds them to its statistics"""
+        if not len(rows):
+            return
+        self.connect()
+        df = self.frame(datatype, rows)
+        names = ('{}|{}|{}'.format(self.STATETABLE, datatype, c) for c in df['commodity'].unique())
+        with h.locked(self.engine, *names):
+            state = self.load_state(datatype, df)
+            scored = self.score(datatype, df, state)
+            self.write(datatype, self.flagged(datatype, scored), self.advance(df, state))
+
+
+    def rebuild(self, commodity, step=7):
+        """
+        Rebuilds a commodity's statistics and flags from raw history, step
+        days at a time, holding the statistics in memory until the end
+        """
+        self.connect()
+        for datatype in ['prices', 'arrivals']:
+            with self.engine.begin() as conn:
+                for table in [self.STATETABLE, self.DBTABLE]:
+                    conn.execute(text('delete from {} where datatype = :datatype and commodity = :commodity'
+                                      .format(table)), datatype=datatype, commodity=commodity)
+            with self.engine.connect() as conn:
+                history = pd.read_sql(text('select * from {} where commodity = :commodity order by date'
+                                           .format(datatype)), con=conn, params=dict(commodity=commodity))
+            if history.empty:
+                continue
+            df = self.frame(datatype, history)
+            state = pd.DataFrame(columns=SERIES + ['recent', 'median', 'mad', 'n', 'last_date'])
+            flags = []
+            days = (df['date'] - df['date'].min()).dt.days // step
+            for _, batch in df.groupby(days):
+                flags.append(self.flagged(datatype, self.score(datatype, batch, state)))
+                advanced = self.advance(batch, state)
+                state = pd.concat([state, advanced], ignore_index=True).drop_duplicates(SERIES, keep='last')
+            self.write(datatype, pd.concat(flags, ignore_index=True), state)
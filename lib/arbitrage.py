@@ -0,0 +1,311 @@
+"""
+arbitrage.py:
+    Ranks markets by the net price a farmer can expect for a load sent from
+    their local market - the "where should I send my fruit" query. The
+    expected price at each market is its latest rolling modal price, or its
+    forecast, adjusted for arrival pressure: arrivals above the market's
+    recent norm push the expected price down. Transport to the market, at a
+    per-km cost, is then subtracted
+
+    Everything a query needs is prepared once per data version - the latest
+    price date, row count, forecast issue date, and today's date, which
+    moves the recency window - and per set of the engine's parameters and
+    distances, as per-grade arrays aligned with a dense distance matrix.
+    A query is a single vectorised
+    pass over all markets, so answers take milliseconds. Prepared tables are
+    also cached on disk, so a restarted service doesn't rebuild them
+
+    Distances are read from a local csv of (origin, destination, km); build
+    one from market coordinates with MarketDistances.from_coordinates. Any
+    market in it can be an origin, whether or not it has a recent price
+
+    MarketDistances (cls): Market-to-market road distances
+    ArbitrageEngine (cls): Ranks markets by expected net price
+"""
+
+import os
+import re
+import json
+import time
+import pickle
+import hashlib
+import pathlib
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+import lib.helpers as h
+from lib.metrics import METRICS, timed
+from lib.plotters import CurrentMarketProcessor
+
+# layout of prepared tables; cached tables of another layout are rebuilt
+TABLES = 2
+COLUMNS = ['market', 'state', 'district', 'price', 'expected_price', 'km', 'transport_cost',
+           'net_price', 'arrival_pressure', 'price_date']
+
+
+class MarketDistances(object):
+    """
+    Market-to-market road distances
+
+    Args:
+        distances (df): origin, destination, km; each pair is needed in one direction only
+
+    Usage:
+        md = MarketDistances.load('data/market_distances.csv')
+        md.matrix(['Abohar', 'Azadpur'])
+        md.matrix(['Abohar', 'Azadpur'], origins=md.markets())
+    """
+    def __init__(self, distances, path=None):
+        self.distances = distances
+        self.path = path
+        self.mtime = os.path.getmtime(path) if path else None
+
+
+    @classmethod
+    def load(cls, path='data/market_distances.csv'):
+        return cls(pd.read_csv(path), path)
+
+
+    def reload(self):
+        """Re-reads the csv the distances came from if it's changed since"""
+        if self.path and os.path.getmtime(self.path) != self.mtime:
+            self.distances = pd.read_csv(self.path)
+            self.mtime = os.path.getmtime(self.path)
+
+
+    def digest(self):
+        return '{:016x}'.format(int(pd.util.hash_pandas_object(self.distances, index=False).values.sum()))
+
+
+    @classmethod
+    def from_coordinates(cls, coords, road_factor=1.3):
+        """
+        Estimates road distances from market, lat, lon as great-circle distance
+        times road_factor
+        """
+        lat, lon = np.radians(coords['lat'].values), np.radians(coords['lon'].values)
+        a = (np.sin((lat[:, None] - lat[None, :]) / 2) ** 2 +
+             np.cos(lat[:, None]) * np.cos(lat[None, :]) * np.sin((lon[:, None] - lon[None, :]) / 2) ** 2)
+        km = 2 * 6371 * np.arcsin(np.sqrt(a)) * road_factor
+        markets = coords['market'].values
+        distances = pd.DataFrame(km.round(1), index=pd.Index(markets, name='origin'),
+                                 columns=pd.Index(markets, name='destination'))
+        return cls(distances.stack().rename('km').reset_index())
+
+
+    def save(self, path='data/market_distances.csv'):
+        pathlib.Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.distances.to_csv(path, index=False)
+
+
+    def markets(self):
+        return sorted(set(self.distances['origin']) | set(self.distances['destination']))
+
+
+    def matrix(self, markets, origins=None):
+        """(origins x markets) km, NaN where the distance is unknown; origins default to markets"""
+        cols = pd.Index(markets)
+        rows = cols if origins is None else pd.Index(origins)
+        km = np.full((len(rows), len(cols)), np.nan)
+        d = self.distances
+        for a, b in [('origin', 'destination'), ('destination', 'origin')]:
+            i, j = rows.get_indexer(d[a]), cols.get_indexer(d[b])
+            known = (i >= 0) & (j >= 0)
+            km[i[known], j[known]] = d['km'].values[known]
+        i = rows.get_indexer(cols)
+        km[i[i >= 0], np.flatnonzero(i >= 0)] = 0
+        return km
+
+
+
+class ArbitrageEngine(object):
+    """
+    Ranks markets by expected net price for a load from an origin market
+
+    Args:
+        commodity (str): Commodity to rank markets for
+        distances (MarketDistances): [Optional] Defaults to data/market_distances.csv
+        cost_per_km (float): Transport cost, in Rs per quintal per km
+        elasticity (float): Expected price change per unit of log arrival pressure
+        qcutoff (int): Minimum arrival tonnage for market inclusion
+        tcutoff (int): Recency cutoff in days
+        period (int): Rolling average window in days
+        engine (engine): [Optional] SQLAlchemy engine; defaults to helpers.db_connect()
+        frames (tuple): [Optional] (prices, arrivals, forecasts) to use instead of the DB
+
+    Usage:
+        ae = ArbitrageEngine('Kinnow', cost_per_km=0.35)
+        ae.refresh()                        # nightly, or at startup; a no-op if the data hasn't changed
+        ae.rank('Abohar', 'Large', top=5)
+        ae.rank('Abohar', 'Large', forecast=True)
+    """
+    def __init__(self, commodity, distances=None, cost_per_km=0.35, elasticity=0.1, qcutoff=3,
+                 tcutoff=7, period=3, engine=None, frames=None):
+        self.commodity = commodity
+        self.distances = distances
+        self.cost_per_km = cost_per_km
+        self.elasticity = elasticity
+        self.qcutoff = qcutoff
+        self.tcutoff = tcutoff
+        self.period = period
+        self.engine = engine
+        self.frames = frames
+        self.version = None
+        self.tables = {}
+        self.ROOTDIR = 'data/arbitrage/'
+
+
+    def connect(self):
+        if not self.engine:
+            self.engine = h.db_connect()
+
+
+    def query(self, sql, **params):
+        with self.engine.connect() as conn:
+            return pd.read_sql(text(sql), con=conn, params=dict(commodity=self.commodity, **params))
+
+
+    def settings(self):
+        """Short hash of what prepared tables depend on besides the data"""
+        if self.distances is None:
+            self.distances = MarketDistances.load()
+        self.distances.reload()
+        key = json.dumps([self.elasticity, self.qcutoff, self.tcutoff, self.period, self.distances.digest()])
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()[:12]
+
+
+    def data_version(self):
+        """
+        Changes whenever a nightly scrape or forecast lands, the day turns
+        over, or a setting the tables depend on changes
+        """
+        today = pd.to_datetime('today').date()
+        if self.frames:
+            prices, _, forecasts = self.frames
+            issued = forecasts['issued'].max() if len(forecasts) else None
+            return '{}_{}_{}_{}_{}'.format(pd.to_datetime(prices['date']).max().date(), len(prices), issued,
+                                           today, self.settings())
+        self.connect()
+        p = self.query('select max(date) as latest, count(*) as n from prices where commodity = :commodity')
+        f = self.query('select max(issued) as issued from forecasts where commodity = :commodity')
+        return '{}_{}_{}_{}_{}'.format(p['latest'][0], p['n'][0], f['issued'][0], today, self.settings())
+
+
+    def load(self):
+        if self.frames:
+            return self.frames
+        since = str((pd.to_datetime('today') - pd.Timedelta(days=self.tcutoff)).date())
+        prices = self.query('select * from prices where commodity = :commodity and date > :since', since=since)
+        arrivals = self.query('select * from arrivals where commodity = :commodity and date > :since',
+                              since=since)
+        forecasts = self.query('select * from forecasts where commodity = :commodity and issued = '
+                               '(select max(issued) from forecasts where commodity = :commodity)')
+        return prices, arrivals, forecasts
+
+
+    def pressure(self, cmp):
+        """Latest rolling arrivals relative to each market's average over the recency window"""
+        norm = cmp.recent_a.groupby('market')['quantity'].mean()
+        latest = cmp.latest_a.set_index('market')['r_quantity']
+        return (latest / norm.reindex(latest.index)).clip(0.5, 2)
+
+
+    @timed('prepare_arbitrage')
+    def prepare(self):
+        """Per-grade arrays aligned with the distance matrix's columns"""
+        prices, arrivals, forecasts = self.load()
+        cmp = CurrentMarketProcessor(prices.copy(), arrivals.copy(), self.qcutoff, self.tcutoff, self.period)
+        latest_p, _ = cmp.prep_data()
+        pressure = self.pressure(cmp)
+        if len(forecasts):
+            # first forecast day: what a load sent today would sell at
+            forecasts = forecasts[forecasts['horizon'] == forecasts['horizon'].min()]
+        forecast = forecasts.set_index(['market', 'grade'])['forecast_price'] if len(forecasts) else pd.Series(dtype=float)
+        if self.distances is None:
+            self.distances = MarketDistances.load()
+        markets = sorted(latest_p['market'].unique())
+        # origins needn't have a recent price, only a distance
+        origins = sorted(set(self.distances.markets()) | set(markets))
+        tables = {'origins': np.array(origins), 'markets': np.array(markets),
+                  'km': self.distances.matrix(markets, origins), 'grades': {}}
+        for grade, g in latest_p.groupby('grade'):
+            g = g.set_index('market').reindex(markets)
+            p = pressure.reindex(markets).fillna(1).values
+            tables['grades'][grade] = {
+                'state': g['state'].values,
+                'district': g['district'].values,
+                'date': g['date'].values,
+                'price': g['r_modal_price'].values,
+                'forecast': forecast.reindex(pd.MultiIndex.from_product([markets, [grade]])).values,
+                'pressure': p,
+                'adjustment': 1 - self.elasticity * np.log(p),
+                }
+        return tables
+
+
+    def cache_path(self, version):
+        return pathlib.Path(self.ROOTDIR)/'{}_{}_v{}.pkl'.format(self.commodity, re.sub(r'[^\w-]+', '-', version),
+                                                                TABLES)
+
+
+    def refresh(self):
+        """Prepares tables for the current data version, from the disk cache if it's there"""
+        version = self.data_version()
+        if version == self.version:
+            return False
+        path = self.cache_path(version)
+        if path.exists():
+            with open(path, 'rb') as infile:
+                self.tables = pickle.load(infile)
+        else:
+            self.tables = self.prepare()
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with open(path, 'wb') as outfile:
+                pickle.dump(self.tables, outfile, protocol=pickle.HIGHEST_PROTOCOL)
+        self.version = version
+        print('Arbitrage tables ready for {} ({})'.format(self.commodity, version))
+        return True
+
+
+    def rank(self, origin, grade, top=None, forecast=False):
+        """
+        Markets reachable from origin, by expected net price per quintal
+
+        Args:
+            origin (str): Market the load starts from
+            grade (str): Grade of the load
+            top (int): [Optional] Number of markets to return
+            forecast (bool): Use forecast prices, where available, instead of the latest
+        """
+        if not self.tables:
+            self.refresh()
+        start = time.perf_counter()
+        markets, t = self.tables['markets'], self.tables['grades'].get(grade)
+        origins = np.flatnonzero(self.tables['origins'] == origin)
+        if t is None or not len(origins):
+            return pd.DataFrame(columns=COLUMNS)
+        km = self.tables['km'][origins[0]]
+        price = t['price']
+        if forecast:
+            price = np.where(np.isnan(t['forecast']), price, t['forecast'])
+        expected = price * t['adjustment']
+        cost = km * self.cost_per_km
+        net = expected - cost
+        keep = np.flatnonzero(~np.isnan(net))
+        order = keep[np.argsort(-net[keep], kind='stable')][:top]
+        ranked = pd.DataFrame({
+            'market': markets[order],
+            'state': t['state'][order],
+            'district': t['district'][order],
+            'price': price[order],
+            'expected_price': expected[order].round(),
+            'km': km[order],
+            'transport_cost': cost[order].round(),
+            'net_price': net[order].round(),
+            'arrival_pressure': t['pressure'][order].round(2),
+            'price_date': t['date'][order],
+            })
+        METRICS.observe('arbitrage_query', time.perf_counter() - start)
+        return ranked
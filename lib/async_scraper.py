@@ -0,0 +1,298 @@
+"""
+async_scraper.py:
+    Runs scrape jobs concurrently. Selenium is blocking, so every browser
+    session runs in a worker thread while asyncio fans jobs out under a
+    semaphore. Scraped batches stream through an async queue to a single
+    DB writer, so a run takes roughly as long as its slowest request chain
+    rather than the sum of all of them
+
+    Independent units of work are:
+        - prices: each (commodity, state, date range), optionally split into
+          date-range chunks by a ChunkPlanner (see lib/planner.py), or into
+          page ranges that are scraped by separate browsers
+        - arrivals: each (commodity, state, day)
+
+    Jobs run under a JobSupervisor (see lib/resilience.py) - with timeouts,
+    retries, a circuit breaker, and a queue of failed jobs that later runs
+    start with. Given a Catalog (see lib/catalog.py), the runner skips jobs
+    for pairs known to be empty, queued ones included, and notes each price
+    job's page count
+
+    ScrapeJob (cls): A single unit of scrape work
+    AsyncScrapeRunner (cls): Runs jobs concurrently and writes results as they arrive
+    plan_jobs (func): Splits jobs into independent units of work
+"""
+
+import asyncio
+import concurrent.futures
+
+import pandas as pd
+
+import lib.helpers as h
+from lib import scrapers as s
+from lib.pipeline import CallbackSink, DBSink
+from lib.resilience import JobSupervisor
+
+
+class ScrapeJob(object):
+    """
+    A single unit of scrape work
+
+    Args:
+        datatype (str): 'prices' or 'arrivals'
+        commodity (str): Commodity to scrape data for
+        state (str): State to scrape data for
+        start (str): Start of period to scrape data for
+        end (str): End of period to scrape data for
+        pages (tuple): [Optional] (first, last) page range - prices only
+    """
+    def __init__(self, datatype, commodity, state, start, end, pages=None):
+        self.datatype = datatype
+        self.commodity = commodity
+        self.state = state
+        self.start = start
+        self.end = end
+        self.pages = pages
+        self.scraper = None
+
+
+    def __repr__(self):
+        key = '{} {} {} {} - {}'.format(self.datatype, self.commodity, self.state, self.start, self.end)
+        if self.pages:
+            key = key + ' pages {}-{}'.format(*self.pages)
+        return key
+
+
+    def split_days(self):
+        dr = pd.date_range(self.start, self.end, freq='D')
+        return [ScrapeJob(self.datatype, self.commodity, self.state, str(d.date()), str(d.date()))
+                for d in dr]
+
+
+    def to_dict(self):
+        return {'datatype': self.datatype, 'commodity': self.commodity, 'state': self.state,
+                'start': self.start, 'end': self.end, 'pages': self.pages}
+
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(d['datatype'], d['commodity'], d['state'], d['start'], d['end'],
+                   tuple(d['pages']) if d.get('pages') else None)
+
+
+    def run(self, serverless=True, url=None, fetcher=None, catalog=None):
+        """
+        Scrapes the job start to finish with a scraper of its own, writing
+        to the DB. A price job's page count is noted in catalog, if given
+        (see lib/catalog.py)
+        """
+        if self.datatype == 'prices':
+            self.scraper = s.MandiPriceScraper(self.commodity, self.state, self.start, self.end, serverless,
+                                               pages=self.pages, url=url, fetcher=fetcher)
+        else:
+            self.scraper = s.MandiQuantityScraper(self.commodity, self.state, self.start, self.end, serverless,
+                                                  url=url, fetcher=fetcher)
+        self.scraper.run()
+        if catalog is not None and self.datatype == 'prices':
+            catalog.observe_scraper(self.scraper)
+
+
+    def cancel(self):
+        """Closes the job's browser, so a call stuck in it errors out"""
+        if self.scraper is not None:
+            self.scraper.close()
+
+
+
+def plan_jobs(jobs, planner=None):
+    """Splits jobs into units of work: price jobs by planner if given, arrivals into single days"""
+    if planner:
+        return planner.plan(jobs)
+    planned = []
+    for job in jobs:
+        if job.datatype == 'arrivals':
+            planned.extend(job.split_days())
+        else:
+            planned.append(job)
+    return planned
+
+
+
+class AsyncScrapeRunner(object):
+    """
+    Runs scrape jobs concurrently and writes results as they arrive
+
+    Args:
+        jobs (list): ScrapeJobs to run
+        concurrency (int): Maximum number of simultaneous browser sessions
+        serverless (bool): Lambda execution flag
+        writetodb (bool): Flag for inserting into db or saving json
+        split_pages (int): [Optional] Price jobs with more pages than this are
+            split into page ranges of this size, each scraped by its own browser
+        url (str): [Optional] Site to scrape; defaults to agmarknet
+        engine (engine): [Optional] SQLAlchemy engine to write to; defaults to helpers.db_connect()
+        planner (ChunkPlanner): [Optional] Splits price jobs into date-range chunks
+        fetcher (str): [Optional] 'selenium' or 'http' - see lib/pipeline.py
+        supervisor (JobSupervisor): [Optional] Timeouts, retries, and failed-job queue;
+            defaults to retries and a circuit breaker only
+        catalog (Catalog): [Optional] Skips jobs for pairs known to be empty, and notes
+            price jobs' page counts
+
+    Usage:
+        jobs = [ScrapeJob('prices', 'Kinnow', st, '2018-12-01', '2018-12-10')
+                for st in ['Punjab', 'Haryana']]
+        runner = AsyncScrapeRunner(jobs, concurrency=4, serverless=False)
+        runner.run()
+        runner.failed       # [(job, exception), ...] - after retries
+    """
+    def __init__(self, jobs, concurrency=4, serverless=True, writetodb=True, split_pages=None,
+                 url=None, engine=None, planner=None, fetcher=None, supervisor=None, catalog=None):
+        self.jobs = jobs
+        self.concurrency = concurrency
+        self.serverless = serverless
+        self.writetodb = writetodb
+        self.split_pages = split_pages
+        self.url = url
+        self.engine = engine
+        self.planner = planner
+        self.fetcher = fetcher
+        self.supervisor = supervisor or JobSupervisor()
+        self.catalog = catalog
+        self.failed = []
+
+
+    def create_engine(self):
+        if not self.engine:
+            self.engine = h.db_connect()
+        conn = self.engine.connect()
+        self.lm = pd.read_sql('select * from location_map', con=conn)
+        conn.close()
+
+
+    def plan(self):
+        """Queued jobs from earlier runs, then this run's jobs, less those for pairs known to be empty"""
+        if self.planner:
+            self.planner.engine = self.planner.engine or self.engine
+        jobs = self.supervisor.schedule(plan_jobs(self.jobs, self.planner))
+        if self.catalog is not None:
+            jobs = self.catalog.filter(jobs)
+        return jobs
+
+
+    ## Blocking - runs in scraper threads
+
+    def write_batch(self, table, rows):
+        """Hands a batch to the writer and blocks until it has been committed"""
+        done = concurrent.futures.Future()
+        asyncio.run_coroutine_threadsafe(self.queue.put((table, rows, done)), self.loop).result()
+        done.result()
+
+
+    def scrape_prices(self, job):
+        mps = s.MandiPriceScraper(job.commodity, job.state, job.start, job.end,
+                                  self.serverless, self.writetodb, job.pages, self.url, self.fetcher)
+        if self.writetodb:
+            mps.sink = CallbackSink(self.write_batch)
+            mps.engine = self.engine
+        job.scraper = mps
+        mps.setup_driver()
+        try:
+            mps.open_page()
+            mps.populate_dropdowns()
+            mps.get_pagecount()
+            if mps.data == 'Yes':
+                if not job.pages and self.split_pages and mps.page_count > self.split_pages:
+                    ranges = [(i, min(i + self.split_pages - 1, mps.page_count))
+                              for i in range(1, mps.page_count + 1, self.split_pages)]
+                    mps.set_pages(ranges[0])
+                    # a retry of this job covers its own range only
+                    job.pages = ranges[0]
+                    subjobs = [ScrapeJob(job.datatype, job.commodity, job.state, job.start, job.end, r)
+                               for r in ranges[1:]]
+                    for subjob in subjobs:
+                        self.submit(subjob)
+                mps.scrape_prices()
+        finally:
+            mps.close()
+
+
+    def scrape_arrivals(self, job):
+        mqs = s.MandiQuantityScraper(job.commodity, job.state, job.start, job.end,
+                                     self.serverless, self.writetodb, self.url, self.fetcher)
+        if self.writetodb:
+            mqs.sink = CallbackSink(self.write_batch)
+        mqs.engine, mqs.lm = self.engine, self.lm
+        job.scraper = mqs
+        mqs.get_timeperiods()
+        mqs.scrape()
+
+
+    def run_job(self, job):
+        print('Starting {}'.format(job))
+        if job.datatype == 'prices':
+            self.scrape_prices(job)
+            if self.catalog is not None:
+                self.catalog.observe_scraper(job.scraper)
+        else:
+            self.scrape_arrivals(job)
+        print('Finished {}'.format(job))
+
+
+    ## Async
+
+    def submit(self, job):
+        """Schedules a job; safe to call from scraper threads"""
+        self.loop.call_soon_threadsafe(self.start_task, job)
+
+
+    def start_task(self, job):
+        self.tasks.add(asyncio.ensure_future(self.run_task(job)))
+
+
+    async def run_task(self, job):
+        async with self.semaphore:
+            e = await self.loop.run_in_executor(self.scrape_executor, self.supervisor.run,
+                                                job, self.run_job, ScrapeJob.cancel)
+            if e is not None:
+                print('{} failed: {}'.format(job, e))
+                self.failed.append((job, e))
+
+
+    async def write_results(self):
+        while True:
+            table, rows, done = await self.queue.get()
+            try:
+                await self.loop.run_in_executor(self.write_executor, DBSink(self.engine).write, table, rows)
+                done.set_result(len(rows))
+            except Exception as e:
+                done.set_exception(e)
+            self.queue.task_done()
+
+
+    async def main(self):
+        self.loop = asyncio.get_event_loop()
+        self.queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        self.scrape_executor = concurrent.futures.ThreadPoolExecutor(self.concurrency)
+        self.write_executor = concurrent.futures.ThreadPoolExecutor(1)
+        self.tasks = set()
+        writer = asyncio.ensure_future(self.write_results())
+        for job in self.plan():
+            self.start_task(job)
+        while self.tasks:
+            done, _ = await asyncio.wait(self.tasks)
+            self.tasks -= done
+        await self.queue.join()
+        writer.cancel()
+        self.scrape_executor.shutdown()
+        self.write_executor.shutdown()
+
+
+    def run(self):
+        self.create_engine()
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(self.main())
+        finally:
+            loop.close()
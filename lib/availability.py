@@ -0,0 +1,167 @@
+"""
+availability.py:
+    Compact index of which days have data, maintained as rows are written.
+    For each (commodity, datatype, level, region, year) the index stores a
+    bitmap of the days of that year with at least one row - 46 bytes, hex
+    encoded - at state, district, and market level. Coverage charts read a
+    few rows per region instead of scanning raw history
+
+    AvailabilityIndex (cls): Updates and rebuilds the availability table
+    intervals (func): Converts bitmaps into (region, start, finish) intervals for plotting
+    merge_intervals (func): Joins intervals separated by short gaps
+"""
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+import lib.helpers as h
+from lib.metrics import timed
+
+BITS = 368
+LEVELS = ['state', 'district', 'market']
+KEYS = ['commodity', 'datatype', 'level', 'region', 'year']
+
+
+def encode(days):
+    bits = np.zeros(BITS, dtype=bool)
+    bits[np.asarray(days, dtype=int)] = True
+    return np.packbits(bits, bitorder='little').tobytes().hex()
+
+
+def decode(days):
+    return np.unpackbits(np.frombuffer(bytes.fromhex(days), dtype=np.uint8), bitorder='little').astype(bool)
+
+
+def merge(a, b):
+    return encode(np.flatnonzero(decode(a) | decode(b)))
+
+
+def intervals(availability, datatype, level, start=None, end=None):
+    """
+    Runs of consecutive days with data, per region, as the Task / Start /
+    Finish / Resource frame DataAvailabilityPlotter draws. Every bitmap is
+    decoded in one pass, so all of India's districts take a fraction of a second
+    """
+    av = availability[(availability['datatype'] == datatype) & (availability['level'] == level)]
+    columns = ['Task', 'Start', 'Finish', 'state', 'Resource']
+    if av.empty:
+        return pd.DataFrame(columns=columns)
+    bits = np.frombuffer(bytes.fromhex(''.join(av['days'])), dtype=np.uint8).reshape(len(av), -1)
+    rows, day = np.nonzero(np.unpackbits(bits, axis=1, bitorder='little'))
+    years = (av['year'].values.astype(int) - 1970).astype('datetime64[Y]').astype('datetime64[D]').astype(np.int64)
+    day = years[rows] + day
+    keep = np.ones(len(day), dtype=bool)
+    if start:
+        keep &= day >= np.datetime64(pd.to_datetime(start).date(), 'D').astype(np.int64)
+    if end:
+        keep &= day <= np.datetime64(pd.to_datetime(end).date(), 'D').astype(np.int64)
+    codes, regions = pd.factorize(av['region'], sort=True)
+    # one sortable integer per (region, day): sorts by region then day, and dedupes overlapping years
+    keys = np.unique((codes[rows[keep]].astype(np.int64) << 32) + day[keep] + (1 << 31))
+    if not len(keys):
+        return pd.DataFrame(columns=columns)
+    task, day = keys >> 32, (keys & 0xFFFFFFFF) - (1 << 31)
+    new = np.r_[True, (task[1:] != task[:-1]) | (np.diff(day) > 1)]
+    first, last = np.flatnonzero(new), np.r_[np.flatnonzero(new)[1:] - 1, len(day) - 1]
+    processed = pd.DataFrame({'Task': regions[task[first]], 'Start': day[first].astype('datetime64[D]'),
+                              'Finish': day[last].astype('datetime64[D]')})
+    processed['state'] = processed['Task'].map(av.groupby('region')['state'].first())
+    processed['Resource'] = 'Available'
+    return processed[columns]
+
+
+def merge_intervals(processed, min_gap=1):
+    """
+    Joins each task's intervals separated by fewer than min_gap days without
+    data, so short gaps don't split a chart into thousands of slivers
+    """
+    if min_gap <= 1 or processed.empty:
+        return processed
+    df = processed.sort_values(['Task', 'Start'])
+    finish = df.groupby('Task')['Finish'].shift()
+    new = finish.isnull() | ((pd.to_datetime(df['Start']) - pd.to_datetime(finish)).dt.days - 1 >= min_gap)
+    agg = {col: 'first' for col in df.columns if col not in ['Start', 'Finish']}
+    agg.update(Start='min', Finish='max')
+    return df.groupby(new.cumsum().values).agg(agg)[list(df.columns)].reset_index(drop=True)
+
+
+
+class AvailabilityIndex(object):
+    """
+    Updates and rebuilds the availability table
+
+    Args:
+        engine (engine): [Optional] SQLAlchemy engine; defaults to helpers.db_connect()
+
+    Usage:
+        ai = AvailabilityIndex()
+        ai.rebuild('Kinnow')                # once, from raw history
+        ai.update('prices', rows)           # as rows are written
+    """
+    def __init__(self, engine=None):
+        self.engine = engine
+        self.DBTABLE = 'availability'
+
+
+    def connect(self):
+        if not self.engine:
+            self.engine = h.db_connect()
+
+
+    def bitmaps(self, df, datatype):
+        """Bitmaps for every level, region, and year in df"""
+        df = df.assign(date=pd.to_datetime(df['date']))
+        df = df.assign(year=df['date'].dt.year, day=df['date'].dt.dayofyear - 1)
+        rows = []
+        for level in LEVELS:
+            for (commodity, region, year), g in df.dropna(subset=[level]).groupby(['commodity', level, 'year']):
+                rows.append({'commodity': commodity, 'datatype': datatype, 'level': level,
+                             'region': region, 'year': int(year), 'state': g['state'].iloc[0],
+                             'days': encode(g['day'].unique())})
+        return pd.DataFrame(rows, columns=KEYS + ['state', 'days'])
+
+
+    def load(self, commodities, datatype, years):
+        query = text('select * from {} where datatype = :datatype and commodity in ({}) and year in ({})'
+                     .format(self.DBTABLE, ', '.join("'{}'".format(c) for c in commodities),
+                             ', '.join(str(int(y)) for y in years)))
+        with self.engine.connect() as conn:
+            return pd.read_sql(query, con=conn, params=dict(datatype=datatype))
+
+
+    def write(self, bitmaps):
+        h.upsert_rows(self.engine, self.DBTABLE, bitmaps.to_dict('records'))
+
+
+    @timed('index_availability')
+    def update(self, datatype, rows):
+        """ORs the days in rows into the stored bitmaps"""
+        if not len(rows):
+            return
+        self.connect()
+        new = self.bitmaps(pd.DataFrame(rows), datatype)
+        commodities = new['commodity'].unique()
+        # another writer's days could otherwise be lost between our load and write
+        with h.locked(self.engine, *('{}|{}|{}'.format(self.DBTABLE, datatype, c) for c in commodities)):
+            old = self.load(commodities, datatype, new['year'].unique())
+            merged = new.merge(old[KEYS + ['days']], on=KEYS, how='left', suffixes=('', '_old'))
+            stored = merged['days_old'].notnull()
+            merged.loc[stored, 'days'] = [merge(a, b) for a, b in merged.loc[stored, ['days', 'days_old']].values]
+            changed = ~stored | (merged['days'] != merged['days_old'])
+            self.write(merged.loc[changed, KEYS + ['state', 'days']])
+
+
+    def rebuild(self, commodity):
+        """Rebuilds a commodity's bitmaps from raw prices and arrivals"""
+        self.connect()
+        for datatype in ['prices', 'arrivals']:
+            query = text('select distinct commodity, state, district, market, date from {} '
+                         'where commodity = :commodity'.format(datatype))
+            with self.engine.connect() as conn:
+                df = pd.read_sql(query, con=conn, params=dict(commodity=commodity))
+            if df.empty:
+                continue
+            bitmaps = self.bitmaps(df, datatype)
+            self.write(bitmaps)
+            print('Indexed {} {} bitmaps'.format(len(bitmaps), datatype))
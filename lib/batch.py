@@ -0,0 +1,347 @@
+"""
+batch.py:
+    Nightly generation of every dashboard view for many commodities. Prices,
+    arrivals, and location mappings are pulled once for all commodities,
+    split per commodity, and published to shared memory as Arrow IPC
+    streams (pickles if pyarrow isn't installed). Before Python 3.8, which
+    has no multiprocessing.shared_memory, the streams go to temp files that
+    workers read through the page cache instead. A process pool attaches to
+    the shared frames once per worker and renders views independently, so
+    total time scales with cores rather than with the number of commodities.
+    Figures are written by the workers as they are rendered, and a manifest
+    of every output is written at the end
+
+    Views, per commodity:
+        availability: prices and arrivals by state, and by district for each state
+        current: overview, overview_alt, and price_var for each grade
+        trends: all markets, each state, and each market, for each grade
+
+    SharedFrames (cls): Publishes dataframes to shared memory for worker processes
+    DashboardBatch (cls): Pulls data once, renders every view in parallel, and writes outputs
+"""
+
+import io
+import re
+import json
+import time
+import shutil
+import pickle
+import pathlib
+import tempfile
+import multiprocessing
+
+import pandas as pd
+import plotly
+from plotly.offline import plot
+
+from lib import plotters as p
+import lib.db_puller as db
+from lib.metrics import METRICS
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+CURRENT_PLOTS = ['overview', 'overview_alt', 'price_var']
+
+
+class SharedFrames(object):
+    """
+    Publishes dataframes to shared memory, or to temp files where there's
+    no shared_memory, so worker processes read them without each receiving
+    a pickled copy
+
+    Args:
+        frames (dict): name -> dataframe
+
+    Usage:
+        sf = SharedFrames({'prices': prices})
+        handles = sf.publish()
+        ...                         # in a worker
+        SharedFrames.read(handles['prices'])
+        sf.close()
+    """
+    def __init__(self, frames):
+        self.frames = frames
+        self.blocks = []
+        self.tmpdir = None
+
+
+    @staticmethod
+    def serialise(df):
+        if pa is None:
+            return 'pickle', pickle.dumps(df, protocol=pickle.HIGHEST_PROTOCOL)
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return 'arrow', sink.getvalue().to_pybytes()
+
+
+    def publish(self):
+        handles = {}
+        for i, (name, df) in enumerate(self.frames.items()):
+            fmt, data = self.serialise(df)
+            if shared_memory is None:
+                self.tmpdir = self.tmpdir or tempfile.mkdtemp(prefix='frames_')
+                path = str(pathlib.Path(self.tmpdir, '{}.{}'.format(i, fmt)))
+                with open(path, 'wb') as outfile:
+                    outfile.write(data)
+                handles[name] = (path, len(data), fmt)
+                continue
+            block = shared_memory.SharedMemory(create=True, size=max(len(data), 1))
+            block.buf[:len(data)] = data
+            self.blocks.append(block)
+            handles[name] = (block.name, len(data), fmt)
+        return handles
+
+
+    @staticmethod
+    def load(data, fmt):
+        if fmt == 'pickle':
+            return pickle.load(data)
+        return pa.ipc.open_stream(data).read_all().to_pandas()
+
+
+    @staticmethod
+    def read(handle):
+        name, size, fmt = handle
+        if shared_memory is None:
+            with open(name, 'rb') as infile:
+                return SharedFrames.load(io.BytesIO(infile.read(size)), fmt)
+        block = shared_memory.SharedMemory(name=name)
+        try:
+            return SharedFrames.load(io.BytesIO(block.buf[:size]), fmt)
+        finally:
+            block.close()
+
+
+    def close(self):
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+        if self.tmpdir:
+            shutil.rmtree(self.tmpdir, ignore_errors=True)
+            self.tmpdir = None
+
+
+
+## --------------------------
+## Workers
+## --------------------------
+
+_handles = {}
+_frames = {}
+
+
+def _attach(handles):
+    global _handles
+    _handles = handles
+    _frames.clear()
+
+
+def _frame(name):
+    if name not in _frames:
+        _frames[name] = SharedFrames.read(_handles[name]) if name in _handles else None
+    return _frames[name]
+
+
+def slug(*parts):
+    return '_'.join(re.sub(r'[^A-Za-z0-9]+', '-', str(part)).strip('-') for part in parts if part)
+
+
+def write_figure(fig, path, fmt):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if fmt == 'html':
+        plot(fig, filename=str(path), auto_open=False, include_plotlyjs='cdn')
+    else:
+        with open(path, 'w') as outfile:
+            json.dump(fig, outfile, cls=plotly.utils.PlotlyJSONEncoder)
+    return str(path)
+
+
+def render_availability(commodity, prices, arrivals, lm, datatype, col):
+    df = prices if datatype == 'Prices' else arrivals
+    dap = p.DataAvailabilityPlotter(datatype, df, lm, col)
+    if col == 'state':
+        yield slug(datatype, col), dap.plot(asFigure=True)
+        return
+    processed = dap.prep_data()
+    for state in sorted(processed['state'].dropna().unique()):
+        dap.state = state
+        dap.processed = processed[processed['state'] == state].reset_index(drop=True)
+        yield slug(datatype, col, state), dap.plotter(asFigure=True)
+
+
+def render_current(commodity, prices, arrivals, lm, qcutoff=3, tcutoff=7, period=3):
+    cmp = p.CurrentMarketPlotter(commodity, prices, arrivals, qcutoff, tcutoff, period)
+    plotters = {'overview': cmp.plot_mkt_overview,
+                'overview_alt': cmp.plot_mkt_overview_alt,
+                'price_var': cmp.plot_price_variation}
+    for grade in sorted(cmp.latest_p['grade'].unique()):
+        for plottype in CURRENT_PLOTS:
+            yield slug(plottype, grade), plotters[plottype](grade, asFigure=True)
+
+
+def render_trends(commodity, prices, arrivals, lm, state):
+    markets = [] if state == 'Combined' else sorted(prices.loc[prices['state'] == state, 'market'].unique())
+    for grade in sorted(prices['grade'].unique()):
+        yield slug(state, grade), p.TrendPlotter(commodity, prices, arrivals, state, None, grade).plotter(True)
+        for market in markets:
+            if not ((prices['market'] == market) & (prices['grade'] == grade)).any():
+                continue
+            tp = p.TrendPlotter(commodity, prices, arrivals, state, market, grade)
+            yield slug(state, market, grade), tp.plotter(True)
+
+
+RENDERERS = {
+    'availability': render_availability,
+    'current': render_current,
+    'trends': render_trends,
+    }
+
+
+def render(task):
+    """Renders and writes every figure of one task; runs in a worker process"""
+    commodity, view, kwargs, recent, outdir, fmt = task
+    start = time.perf_counter()
+    result = dict(commodity=commodity, view=view, args=kwargs, outputs=[])
+    try:
+        prices = _frame('prices/{}'.format(commodity))
+        arrivals = _frame('arrivals/{}'.format(commodity))
+        if view != 'availability':
+            prices = prices[prices['date'] >= recent].copy()
+            arrivals = arrivals[arrivals['date'] >= recent].copy()
+        figures = RENDERERS[view](commodity, prices, arrivals, _frame('lm'), **kwargs)
+        for name, fig in figures:
+            path = pathlib.Path(outdir, slug(commodity), view, '{}.{}'.format(name, fmt))
+            result['outputs'].append(write_figure(fig, path, fmt))
+    except Exception as e:
+        result['error'] = '{}: {}'.format(type(e).__name__, e)
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+
+
+## --------------------------
+## Batch
+## --------------------------
+
+class DashboardBatch(object):
+    """
+    Pulls data once for all commodities, renders every view in a process
+    pool, and writes the figures plus a manifest
+
+    Args:
+        commodities (list): Commodities to render
+        start (str): Start of the availability window; defaults to Oct 2015
+        end (str): Last date to include; defaults to today
+        days (int): Window for current market and trend views
+        processes (int): Worker processes; defaults to the number of cores
+        outdir (str): Output directory; figures go to <outdir>/<commodity>/<view>/
+        fmt (str): 'json' (plotly figure json) or 'html' (standalone pages)
+        frames (tuple): [Optional] (prices, arrivals, lm) to render instead of pulling from the DB
+
+    Usage:
+        b = DashboardBatch(['Kinnow', 'Apple'], processes=8)
+        b.run()
+        b.manifest['errors']
+    """
+    def __init__(self, commodities, start='2015-10-01', end=None, days=92, processes=None,
+                 outdir='data/dashboards/', fmt='json', frames=None):
+        self.commodities = commodities
+        self.start = start
+        self.end = end or str(pd.to_datetime('today').date())
+        self.days = days
+        self.processes = processes or multiprocessing.cpu_count()
+        self.outdir = outdir
+        self.fmt = fmt
+        self.frames = frames
+
+
+    def get_data(self):
+        if self.frames:
+            prices, arrivals, lm = self.frames
+        else:
+            d = db.DBPuller(self.commodities, self.start, self.end)
+            d.get_data()
+            prices, arrivals, lm = d.prices, d.arrivals, d.lm
+        self.prices = prices.assign(date=pd.to_datetime(prices['date']))
+        self.arrivals = arrivals.assign(date=pd.to_datetime(arrivals['date']))
+        self.lm = lm
+
+
+    def split(self):
+        """Per-commodity frames, so each worker only deserialises what its tasks need"""
+        frames = {'lm': self.lm}
+        for name, df in [('prices', self.prices), ('arrivals', self.arrivals)]:
+            for commodity, g in df.groupby('commodity'):
+                frames['{}/{}'.format(name, commodity)] = g.reset_index(drop=True)
+        return frames
+
+
+    def plan(self):
+        """Tasks, largest first so long ones don't trail at the end"""
+        recent = pd.to_datetime(self.end) - pd.Timedelta(days=self.days)
+        tasks = []
+        for commodity in self.commodities:
+            if not (self.prices['commodity'] == commodity).any():
+                print('No prices for {}, skipping'.format(commodity))
+                continue
+            views = [('availability', dict(datatype=dt, col=col))
+                     for col in ['district', 'state'] for dt in ['Prices', 'Arrivals']]
+            views.append(('current', {}))
+            states = self.prices.loc[self.prices['commodity'] == commodity, 'state'].unique()
+            views += [('trends', dict(state=state)) for state in sorted(states)]
+            views.append(('trends', dict(state='Combined')))
+            tasks += [(commodity, view, kwargs, recent, self.outdir, self.fmt) for view, kwargs in views]
+        return tasks
+
+
+    def write_manifest(self, results, elapsed):
+        self.manifest = {
+            'generated': str(pd.Timestamp.now()),
+            'commodities': self.commodities,
+            'start': self.start,
+            'end': self.end,
+            'processes': self.processes,
+            'seconds': elapsed,
+            'outputs': [o for r in results for o in r['outputs']],
+            'errors': [r for r in results if 'error' in r],
+            }
+        path = pathlib.Path(self.outdir, 'manifest.json')
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'w') as outfile:
+            json.dump(self.manifest, outfile, indent=2, default=str)
+
+
+    def run(self):
+        start = time.perf_counter()
+        with METRICS.timer('batch_load'):
+            self.get_data()
+        tasks = self.plan()
+        shared = SharedFrames(self.split())
+        results = []
+        try:
+            handles = shared.publish()
+            with multiprocessing.Pool(self.processes, initializer=_attach, initargs=(handles,)) as pool:
+                for result in pool.imap_unordered(render, tasks):
+                    METRICS.observe('batch_render', result['seconds'], view=result['view'])
+                    if 'error' in result:
+                        METRICS.incr('errors', stage='batch_render', view=result['view'])
+                        print('Failed {} {} {}: {}'.format(result['commodity'], result['view'],
+                                                          result['args'], result['error']))
+                    results.append(result)
+        finally:
+            shared.close()
+        self.write_manifest(results, time.perf_counter() - start)
+        print('Written {} figures for {} commodities'.format(len(self.manifest['outputs']),
+                                                              len(self.commodities)))
+        return self.manifest
@@ -0,0 +1,245 @@
+"""
+benchmarks.py:
+    Reproducible benchmarks for the analytic and write paths, run against
+    synthetic agmarknet data. Results are saved as json so runs can be
+    compared across commits
+
+    Processors are timed on a single commodity, the way dashboards use them;
+    dedup, arrival processing, and DB writes are timed on every generated row.
+    Parsers are timed on a month of result pages rendered by the fixture server
+
+    BenchmarkSuite (cls): Generates data, times each case, and saves results
+    compare (func): Compares two result files and reports regressions
+"""
+
+import json
+import time
+import pathlib
+import platform
+import subprocess
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine
+
+import lib.helpers as h
+from lib import plotters as p
+from lib import scrapers as s
+from lib import pipeline as pl
+from lib.fixture_server import FixtureServer
+from lib.synthetic import SyntheticAgmarknet
+from lib.tablecreator import create_tables
+
+
+class BenchmarkSuite(object):
+    """
+    Generates data, times each case, and saves results
+
+    Args:
+        commodities (int): Number of commodities to generate
+        states (int): Number of states to generate
+        markets (int): Markets per state
+        years (int): Years of history
+        repeats (int): Runs per case; best and median are reported
+        dburl (str): SQLAlchemy url for write benchmarks; defaults to a local sqlite file
+        seed (int): Random seed for the synthetic data
+
+    Usage:
+        bs = BenchmarkSuite(commodities=2, states=4, markets=50, years=5)
+        bs.run()
+        bs.save()
+    """
+    def __init__(self, commodities=1, states=4, markets=20, years=3, repeats=3,
+                 dburl='sqlite:///data/benchmark.sqlite', seed=0):
+        self.scale = dict(commodities=commodities, states=states, markets=markets, years=years)
+        self.repeats = repeats
+        self.dburl = dburl
+        self.seed = seed
+        self.ROOTDIR = 'benchmarks/results/'
+
+
+    def setup(self):
+        sa = SyntheticAgmarknet(seed=self.seed, **self.scale)
+        self.prices, self.arrivals, self.lm = sa.generate()
+        commodity = sa.commodities[0]
+        self.cp = self.prices[self.prices['commodity'] == commodity]
+        self.ca = self.arrivals[self.arrivals['commodity'] == commodity]
+        self.market = self.cp['market'].iloc[0]
+        self.state = self.cp['state'].iloc[0]
+        if self.dburl.startswith('sqlite:///'):
+            pathlib.Path(self.dburl[len('sqlite:///'):]).parent.mkdir(parents=True, exist_ok=True)
+        self.engine = create_engine(self.dburl)
+        create_tables(self.engine)
+
+
+    ## Cases
+
+    def availability(self, col):
+        return p.DataAvailabilityProcessor(self.cp.copy(), col, self.lm).prep_data()
+
+
+    def current_markets(self):
+        return p.CurrentMarketProcessor(self.cp.copy(), self.ca.copy(), 3, 7, 3).prep_data()
+
+
+    def trends(self, state='Combined', market=None):
+        return p.TrendProcessor(self.cp, self.ca, state, market, 'Medium').prep_data()
+
+
+    def dedupe_records(self):
+        records = self.prices.to_dict('records')
+        dupes = records[::10]
+        return records + dupes
+
+
+    def dedupe(self, records):
+        mps = s.MandiPriceScraper(records[0]['commodity'], records[0]['state'], '2018-12-01', '2018-12-01')
+        return mps.dedupe(records)
+
+
+    def daily_arrivals(self):
+        daily = []
+        for (commodity, state, date), g in self.arrivals.groupby(['commodity', 'state', 'date']):
+            daily.append({
+                'commodity': commodity,
+                'date': date.strftime('%d-%b-%Y'),
+                'state': state,
+                'Arrivals': list(zip(g['market'], g['quantity'].astype(str)))
+                })
+        return daily
+
+
+    def process_arrivals(self, daily):
+        mqs = s.MandiQuantityScraper(daily[0]['commodity'], daily[0]['state'], '2018-12-01', '2018-12-01')
+        mqs.daily_arrivals, mqs.lm = daily, self.lm
+        mqs.process()
+        return mqs.arrivals
+
+
+    def result_pages(self, days=30):
+        """Every price results page, and each day's expanded arrivals page, for a month of one state"""
+        fs = FixtureServer(self.cp, self.ca)
+        end = self.cp['date'].max()
+        query = {'Tx_Commodity': self.cp['commodity'].iloc[0], 'Tx_State': self.state,
+                 'Tx_FromDate': str((end - pd.Timedelta(days=days - 1)).date()), 'Tx_ToDate': str(end.date())}
+        first = fs.prices_page(query)
+        count = int(pl.parse_heading(first).split(' ')[-1] or 0) if 'Total' in first else 0
+        pages = [first] + [fs.prices_page(dict(query, page=str(n)))
+                           for n in range(2, -(-count // fs.rows_per_page) + 1)]
+        days = [fs.arrivals_page({'Tx_Trend': 'Arrival', 'Tx_Commodity': query['Tx_Commodity'],
+                                  'Tx_State': self.state, 'Tx_FromDate': str(d.date()), 'expanded': '1000'})
+                for d in pd.date_range(query['Tx_FromDate'], end)]
+        return pages, days
+
+
+    def parse_pages(self, parser, pages):
+        query = {'commodity': self.cp['commodity'].iloc[0], 'state': self.state, 'start': '', 'end': ''}
+        return [parser.parse(source, query) for source in pages]
+
+
+    def clear_table(self, table):
+        with self.engine.begin() as conn:
+            conn.execute('delete from {}'.format(table))
+
+
+    def write_db(self, table, rows):
+        h.insert_rows(self.engine, table, rows)
+
+
+    def cases(self):
+        records = self.dedupe_records()
+        daily = self.daily_arrivals()
+        price_rows = self.prices.to_dict('records')
+        arrival_rows = self.arrivals.to_dict('records')
+        price_pages, arrival_pages = self.result_pages()
+        return [
+            ('availability.state', lambda: self.availability('state'), None),
+            ('availability.district', lambda: self.availability('district'), None),
+            ('current_markets', self.current_markets, None),
+            ('trends.combined', self.trends, None),
+            ('trends.state', lambda: self.trends(self.state), None),
+            ('trends.market', lambda: self.trends(market=self.market), None),
+            ('scrape.dedupe', lambda: self.dedupe(records), None),
+            ('arrivals.process', lambda: self.process_arrivals(daily), None),
+            ('parse.prices', lambda: self.parse_pages(pl.PriceTableParser(), price_pages), None),
+            ('parse.arrivals', lambda: self.parse_pages(pl.ArrivalsParser(), arrival_pages), None),
+            ('write_db.prices', lambda: self.write_db('prices', price_rows),
+                lambda: self.clear_table('prices')),
+            ('write_db.arrivals', lambda: self.write_db('arrivals', arrival_rows),
+                lambda: self.clear_table('arrivals')),
+            ]
+
+
+    def time_case(self, func, setup=None):
+        runs = []
+        for _ in range(self.repeats):
+            if setup:
+                setup()
+            start = time.perf_counter()
+            func()
+            runs.append(time.perf_counter() - start)
+        return {'best': min(runs), 'median': float(np.median(runs)), 'runs': runs}
+
+
+    def run(self):
+        self.setup()
+        results = {}
+        for name, func, setup in self.cases():
+            results[name] = self.time_case(func, setup)
+            print('{:<24} best {:>9.4f}s   median {:>9.4f}s'.format(
+                name, results[name]['best'], results[name]['median']))
+        self.results = {
+            'commit': git_commit(),
+            'timestamp': str(pd.Timestamp.now()),
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'dburl': self.dburl,
+            'scale': self.scale,
+            'rows': {'prices': len(self.prices), 'arrivals': len(self.arrivals)},
+            'repeats': self.repeats,
+            'cases': results
+            }
+        return self.results
+
+
+    def save(self, path=None):
+        if not path:
+            root = pathlib.Path(self.ROOTDIR)
+            root.mkdir(parents=True, exist_ok=True)
+            path = root/'{}_{}.json'.format(
+                pd.Timestamp.now().strftime('%Y%m%dT%H%M%S'), self.results['commit'])
+        with open(path, 'w') as outfile:
+            json.dump(self.results, outfile, indent=2)
+        print('Saved {}'.format(path))
+        return path
+
+
+def git_commit():
+    try:
+        out = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL)
+        return out.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def compare(old_path, new_path, threshold=0.1):
+    """
+    Compares median timings of two result files. Returns the cases that got
+    slower by more than threshold (0.1 = 10%)
+    """
+    old = json.load(open(old_path))
+    new = json.load(open(new_path))
+    if old['scale'] != new['scale']:
+        print('Warning: comparing different scales {} vs {}'.format(old['scale'], new['scale']))
+    regressions = []
+    for name, result in sorted(new['cases'].items()):
+        if name not in old['cases']:
+            continue
+        before, after = old['cases'][name]['median'], result['median']
+        ratio = after / before if before else float('inf')
+        flag = ''
+        if ratio > 1 + threshold:
+            regressions.append(name)
+            flag = '  <-- regression'
+        print('{:<24} {:>9.4f}s -> {:>9.4f}s  x{:.2f}{}'.format(name, before, after, ratio, flag))
+    return regressions
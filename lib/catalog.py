@@ -0,0 +1,229 @@
+"""
+catalog.py:
+    What there is to scrape. The site's commodity, state, and market
+    dropdowns are read once and cached in a json file for ttl days, and
+    every price query's page count is noted against its (commodity, state)
+    pair. A pair whose queries have covered quiet_days without a single row
+    since it last had data is skipped, so scraping hundreds of commodities
+    doesn't spend a browser session on each of the many pairs the site has
+    nothing for. Skipped pairs are queried again after recheck days, in
+    case they've started reporting
+
+    probe() fills in pairs that haven't been queried yet with one search
+    each - no result pages are read - over a single browser session
+
+    Catalog (cls): Caches the site's option lists and which pairs have data
+
+Usage:
+    python -m lib.catalog                  # refreshes the option lists and probes unchecked pairs
+"""
+
+import os
+import json
+import pathlib
+import datetime
+import threading
+
+from lib.metrics import METRICS
+
+# dropdowns read into the catalog; markets are only listed where the page lists them
+FIELDS = {'commodities': 'ddlCommodity', 'states': 'ddlState', 'markets': 'ddlMarket'}
+
+
+def now():
+    return datetime.datetime.now().replace(microsecond=0)
+
+
+def is_placeholder(label):
+    return not label or label.startswith('--')
+
+
+
+class Catalog(object):
+    """
+    Caches the site's option lists and which (commodity, state) pairs have data
+
+    Args:
+        path (str): Cache file
+        ttl (float): Days the option lists are kept before they're read again
+        quiet_days (int): Days a pair's queries must cover without data before it's skipped
+        recheck (float): Days a skipped pair stays skipped before it's queried again
+
+    Usage:
+        cat = Catalog()
+        cat.refresh()                                       # reads the dropdowns if the cache is stale
+        cat.probe(days=365)                                 # one search per unchecked pair
+        cat.pairs()                                         # (commodity, state) pairs worth scraping
+        cat.observe('Kinnow', 'Goa', '2018-12-01', '2018-12-31', pages=0)
+        cat.filter(jobs)                                    # jobs whose pairs aren't known to be empty
+    """
+    def __init__(self, path='data/catalog.json', ttl=7, quiet_days=60, recheck=30):
+        self.path = pathlib.Path(path)
+        self.ttl = datetime.timedelta(days=ttl)
+        self.quiet_days = quiet_days
+        self.recheck = datetime.timedelta(days=recheck)
+        self.lock = threading.Lock()
+        self.data = self.load()
+
+
+    def load(self):
+        if not self.path.exists():
+            return {'refreshed': None, 'commodities': [], 'states': [], 'markets': [], 'pairs': {}}
+        with open(self.path) as infile:
+            return json.load(infile)
+
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix('.tmp')
+        with open(tmp, 'w') as outfile:
+            json.dump(self.data, outfile, indent=1, default=str)
+        os.replace(tmp, self.path)
+
+
+    @property
+    def commodities(self):
+        return self.data['commodities']
+
+
+    @property
+    def states(self):
+        return self.data['states']
+
+
+    def stale(self):
+        refreshed = self.data['refreshed']
+        return refreshed is None or now() - datetime.datetime.fromisoformat(refreshed) > self.ttl
+
+
+    def refresh(self, fetcher=None, url=None, serverless=False, force=False):
+        """Reads the option lists from the site's search page, unless the cache is fresh"""
+        if not force and not self.stale():
+            return False
+        from lib.scrapers import MandiScraper
+        ms = MandiScraper(None, None, serverless=serverless, writetodb=False, url=url, fetcher=fetcher)
+        ms.setup_driver()
+        try:
+            ms.open_page()
+            lists = {name: [o for o in ms.fetcher.options(field_id) if not is_placeholder(o)]
+                     for name, field_id in FIELDS.items()}
+        finally:
+            ms.close()
+        if not lists['commodities'] or not lists['states']:
+            raise ValueError('No commodity or state options at {}'.format(ms.URL))
+        with self.lock:
+            self.data.update(lists, refreshed=now().isoformat())
+            self.save()
+        print('Catalog: {} commodities, {} states, {} markets'.format(
+            *(len(lists[name]) for name in ['commodities', 'states', 'markets'])))
+        return True
+
+
+    def key(self, commodity, state):
+        return '{}|{}'.format(commodity, state)
+
+
+    def observe(self, commodity, state, start, end, pages):
+        """
+        Notes a price query's page count; 0 pages means the site had no data
+        for it. A pair's quiet days run from the earliest quiet query since
+        its last data to the latest, so a range queried again isn't counted
+        twice
+        """
+        start, end = str(start)[:10], str(end)[:10]
+        with self.lock:
+            entry = self.data['pairs'].setdefault(self.key(commodity, state),
+                                                  {'last_data': None, 'quiet_days': 0, 'pages': 0})
+            since, until = entry.get('quiet_since'), entry.get('quiet_until')
+            if pages:
+                entry['last_data'] = max(end, entry['last_data'] or end)
+                # only quiet days after the data still count
+                if until and until > entry['last_data']:
+                    since = max(since, entry['last_data'])
+                else:
+                    since = until = None
+            elif entry['last_data'] is None or end > entry['last_data']:
+                # a quiet stretch older than the pair's last data says nothing about it now
+                first = max(start, entry['last_data']) if entry['last_data'] else start
+                since, until = min(first, since or first), max(end, until or end)
+            quiet = 0
+            if since:
+                quiet = (datetime.date.fromisoformat(until) - datetime.date.fromisoformat(since)).days + 1
+            entry.update(quiet_since=since, quiet_until=until, quiet_days=quiet, pages=pages,
+                         checked=now().isoformat())
+            self.save()
+
+
+    def observe_scraper(self, scraper):
+        """Notes a price scraper's page count once get_pagecount has run"""
+        pages = scraper.page_count if getattr(scraper, 'data', None) == 'Yes' else 0
+        self.observe(scraper.commodity, scraper.state, scraper.start, scraper.end, pages)
+
+
+    def empty(self, commodity, state):
+        entry = self.data['pairs'].get(self.key(commodity, state))
+        if entry is None or entry['quiet_days'] < self.quiet_days:
+            return False
+        return now() - datetime.datetime.fromisoformat(entry['checked']) < self.recheck
+
+
+    def pairs(self, commodities=None, states=None):
+        """(commodity, state) pairs, from the catalog or the lists given, that aren't known to be empty"""
+        candidates = [(c, s) for c in commodities or self.commodities for s in states or self.states]
+        keep = [(c, s) for c, s in candidates if not self.empty(c, s)]
+        skipped = len(candidates) - len(keep)
+        if skipped:
+            print('Skipping {} of {} pairs with no recent data'.format(skipped, len(candidates)))
+            METRICS.incr('pairs_skipped', skipped)
+        return keep
+
+
+    def filter(self, jobs):
+        """Jobs whose (commodity, state) pairs aren't known to be empty"""
+        keep = [job for job in jobs if not self.empty(job.commodity, job.state)]
+        if len(keep) < len(jobs):
+            print('Skipping {} of {} jobs with no recent data'.format(len(jobs) - len(keep), len(jobs)))
+            METRICS.incr('jobs_skipped', len(jobs) - len(keep))
+        return keep
+
+
+    def unchecked(self):
+        return [(c, s) for c in self.commodities for s in self.states if self.key(c, s) not in self.data['pairs']]
+
+
+    def probe(self, pairs=None, days=365, fetcher=None, url=None, serverless=False):
+        """
+        Searches each pair's prices over the last days once and notes its
+        page count, sharing one fetcher across every search
+
+        Args:
+            pairs (list): [Optional] (commodity, state) pairs; defaults to unchecked pairs
+            days (int): Days each search covers
+        """
+        from lib.scrapers import MandiScraper, MandiPriceScraper
+        pairs = self.unchecked() if pairs is None else pairs
+        if not pairs:
+            return 0
+        end = datetime.date.today()
+        start = end - datetime.timedelta(days=days - 1)
+        session = MandiScraper(None, None, serverless=serverless, writetodb=False, url=url, fetcher=fetcher)
+        session.setup_driver()
+        try:
+            for commodity, state in pairs:
+                mps = MandiPriceScraper(commodity, state, str(start), str(end), serverless, writetodb=False,
+                                        url=url, fetcher=session.fetcher)
+                mps.open_page()
+                mps.populate_dropdowns()
+                mps.get_pagecount()
+                self.observe_scraper(mps)
+                METRICS.incr('pairs_probed')
+        finally:
+            session.close()
+        print('Probed {} pairs'.format(len(pairs)))
+        return len(pairs)
+
+
+if __name__ == "__main__":
+    cat = Catalog()
+    cat.refresh()
+    cat.probe()
@@ -0,0 +1,52 @@
+"""
+checkpoint.py:
+    Records scrape progress so that an interrupted job can resume from the
+    last committed page or date instead of starting over
+
+    Checkpoint (cls): Reads, saves, and clears a job's progress marker
+"""
+
+import os
+import json
+import pathlib
+
+
+class Checkpoint(object):
+    """
+    Reads, saves, and clears a job's progress marker. Each job gets a small
+    json file under rootdir, rewritten atomically after every committed batch
+
+    Args:
+        job (str): Unique job key, e.g. 'prices_Kinnow_Punjab_2018-12-01_2018-12-10'
+        rootdir (str): Directory checkpoints are kept in
+
+    Usage:
+        cp = Checkpoint('prices_Kinnow_Punjab_2018-12-01_2018-12-10')
+        cp.save(done=[1, 2, 3, 4], record_count=480)
+        cp.load()           # {'done': [1, 2, 3, 4], 'record_count': 480}
+        cp.clear()
+    """
+    def __init__(self, job, rootdir='data/checkpoints/'):
+        self.job = job
+        self.rootdir = rootdir
+        self.path = pathlib.Path(rootdir)/'{}.json'.format(job.replace(' ', '_'))
+
+
+    def load(self):
+        if not self.path.exists():
+            return None
+        with open(self.path) as infile:
+            return json.load(infile)
+
+
+    def save(self, **progress):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix('.tmp')
+        with open(tmp, 'w') as outfile:
+            json.dump(progress, outfile, default=str)
+        os.replace(tmp, self.path)
+
+
+    def clear(self):
+        if self.path.exists():
+            self.path.unlink()
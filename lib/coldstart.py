@@ -0,0 +1,162 @@
+"""
+coldstart.py:
+    Measures the cold start of the Lambda entry point (lambda_function.py).
+    Every measurement runs in a fresh interpreter, optionally inside a
+    Lambda-like container, so warm module caches never hide import costs.
+    Also checks the entry point against an import-time budget, and checks
+    that the heavy dependencies stay deferred
+
+    ColdStartBenchmark (cls): Times interpreter start, handler import, deferred imports, and invocation
+    import_profile (func): Slowest modules imported by a module, from python -X importtime
+"""
+
+import os
+import sys
+import json
+import time
+import pathlib
+import platform
+import statistics
+import subprocess
+
+ROOT = str(pathlib.Path(__file__).resolve().parent.parent)
+HEAVY = ['pandas', 'sqlalchemy', 'selenium']
+DEFERRED = 'import pandas, numpy, sqlalchemy.orm, selenium.webdriver'
+
+IMPORT = """
+import sys, json, time
+start = time.perf_counter()
+import {module}
+print(json.dumps({{'seconds': time.perf_counter() - start,
+                  'loaded': [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+INVOKE = """
+import json, time
+start = time.perf_counter()
+import {module}
+result = {module}.lambda_handler(json.load(open({event!r})), None)
+print(json.dumps({{'seconds': time.perf_counter() - start, 'result': result}}, default=str))
+"""
+
+
+def import_profile(module, top=10, python=None):
+    """(cumulative ms, module) for the slowest imports pulled in by module"""
+    out = subprocess.run([python or sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+                         cwd=ROOT, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    rows = []
+    for line in out.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        rows.append((int(cumulative) / 1000, name.strip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+
+class ColdStartBenchmark(object):
+    """
+    Times the Lambda entry point from a fresh interpreter
+
+    Args:
+        module (str): Entry point module
+        budget_ms (float): Import-time budget for the entry point, in ms
+        repeats (int): Fresh interpreters per measurement; medians are reported
+        image (str): [Optional] Docker image to run in, e.g. 'public.ecr.aws/lambda/python:3.8'
+        memory (str): Container memory limit; Lambda allocates CPU in proportion to memory
+        event (str): [Optional] Event json file; also times a full cold invocation
+
+    Usage:
+        csb = ColdStartBenchmark(budget_ms=150)
+        csb.run()
+        csb.check()         # [] if within budget
+        csb.save()
+    """
+    def __init__(self, module='lambda_function', budget_ms=150, repeats=5, image=None,
+                 memory='1024m', event=None):
+        self.module = module
+        self.budget_ms = budget_ms
+        self.repeats = repeats
+        self.image = image
+        self.memory = memory
+        self.event = event
+        self.ROOTDIR = 'benchmarks/results/'
+
+
+    def command(self, code):
+        if not self.image:
+            return [sys.executable, '-c', code]
+        return ['docker', 'run', '--rm', '--memory', self.memory, '-v', '{}:/var/task'.format(ROOT),
+                '-w', '/var/task', '--entrypoint', 'python3', self.image, '-c', code]
+
+
+    def execute(self, code):
+        """Wall time of a fresh process running code, and the json it printed last"""
+        start = time.perf_counter()
+        out = subprocess.run(self.command(code), cwd=ROOT, stdout=subprocess.PIPE,
+                             universal_newlines=True, check=True)
+        wall = time.perf_counter() - start
+        lines = out.stdout.strip().splitlines()
+        return wall, json.loads(lines[-1]) if lines else {}
+
+
+    def median(self, code, key=None):
+        runs = [self.execute(code) for _ in range(self.repeats)]
+        walls = [w for w, _ in runs]
+        inner = [r[key] for _, r in runs] if key else []
+        return statistics.median(walls), (statistics.median(inner) if inner else None), runs[-1][1]
+
+
+    def run(self):
+        empty, _, _ = self.median('pass')
+        wall, seconds, last = self.median(IMPORT.format(module=self.module, heavy=HEAVY), 'seconds')
+        try:
+            _, deferred, _ = self.median(IMPORT.format(module=self.module + '; ' + DEFERRED, heavy=HEAVY),
+                                         'seconds')
+        except subprocess.CalledProcessError:
+            # dependencies aren't installed where we're measuring
+            deferred = None
+        self.results = {
+            'module': self.module,
+            'image': self.image or 'local',
+            'memory': self.memory if self.image else None,
+            'python': platform.python_version(),
+            'repeats': self.repeats,
+            'interpreter_seconds': empty,
+            'process_seconds': wall,
+            'import_seconds': seconds,
+            'deferred_import_seconds': deferred - seconds if deferred else None,
+            'loaded_at_import': last['loaded'],
+            'budget_ms': self.budget_ms,
+            'slowest_imports': [] if self.image else import_profile(self.module),
+            }
+        if self.event:
+            code = INVOKE.format(module=self.module, event=os.path.relpath(self.event, ROOT))
+            wall, seconds, last = self.median(code, 'seconds')
+            self.results.update(invoke_process_seconds=wall, invoke_seconds=seconds,
+                                invoke_result=last['result'])
+        return self.results
+
+
+    def check(self):
+        """Budget violations, if any"""
+        problems = []
+        if self.results['import_seconds'] * 1000 > self.budget_ms:
+            problems.append('{} imports in {:.0f}ms, budget is {}ms'.format(
+                self.module, self.results['import_seconds'] * 1000, self.budget_ms))
+        if self.results['loaded_at_import']:
+            problems.append('{} loads {} at import'.format(
+                self.module, ', '.join(self.results['loaded_at_import'])))
+        return problems
+
+
+    def save(self, path=None):
+        if not path:
+            stamp = time.strftime('%Y%m%d-%H%M%S')
+            path = pathlib.Path(self.ROOTDIR)/'{}_coldstart.json'.format(stamp)
+        path = pathlib.Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'w') as outfile:
+            json.dump(self.results, outfile, indent=2)
+        print('Saved {}'.format(path))
+        return str(path)
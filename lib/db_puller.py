@@ -1,29 +1,136 @@
+import os
+
 import pandas as pd
 import lib.helpers as h
+from lib.metrics import METRICS
+
+PARQUET = os.environ.get('AGMARKNET_PARQUET')
 
 
 class DBPuller(object):
     """
-    Pulls price, arrival, and location data from postgres RDS instance
+    Pulls price, arrival, and location data from postgres RDS instance, or
+    from a local Parquet store (see lib/parquet_store.py) - pass store, or set
+    AGMARKNET_PARQUET to the store's directory. Forecasts, season
+    aggregates, and anomaly flags are only in the DB
     
     Args:
-        commodity (str): Commodity to pull
+        commodity (str or list): Commodity, or list of commodities, to pull
         start (str): Start date of pull
         end (str): End date of pull
+        store (ParquetStore): [Optional] Store to read prices, arrivals, and locations from
     """
-    def __init__(self, commodity, start, end=None):
+    def __init__(self, commodity, start, end=None, store=None):
         self.commodity = commodity
         self.start = start
         self.end = end
+        self.store = store
         if not self.end:
             self.end = str(pd.to_datetime('today').date())
+        if self.store is None and PARQUET:
+            from lib.parquet_store import ParquetStore
+            self.store = ParquetStore(PARQUET)
         
     
+    def commodity_list(self):
+        return [self.commodity] if isinstance(self.commodity, str) else list(self.commodity)
+
+
+    def commodities(self):
+        return ', '.join("'{}'".format(c) for c in self.commodity_list())
+
+
+    def read_store(self, columns=None):
+        """Prices, arrivals, and locations from the Parquet store, pruned to the commodities and dates pulled"""
+        for table in ['prices', 'arrivals']:
+            df = self.store.read(table, self.commodity_list(), self.start, self.end, columns=columns)
+            setattr(self, table, df.assign(date=pd.to_datetime(df['date'])))
+        self.lm = self.store.read('location_map')
+
+
     def get_data(self):
+        if self.store is not None:
+            self.read_store()
+            return
+        engine = h.db_connect()
+        conn = engine.connect()
+        query = "select * from {} where commodity in ({}) and date BETWEEN '{}' and '{}'"
+        with METRICS.timer('db_query', table='prices'):
+            self.prices = pd.read_sql(query.format('prices', self.commodities(), self.start, self.end), con=conn)
+        with METRICS.timer('db_query', table='arrivals'):
+            self.arrivals = pd.read_sql(query.format('arrivals', self.commodities(), self.start, self.end), con=conn)
+        with METRICS.timer('db_query', table='location_map'):
+            self.lm = pd.read_sql("select * from location_map", con=conn)
+        conn.close()
+
+
+    def get_season_aggregates(self, level, region, grade, seasons, state=None, district=None):
+        """Precomputed season-aligned series - see lib/seasons.py; a market's narrowed by state and district"""
+        engine = h.db_connect()
+        conn = engine.connect()
+        query = ("select * from season_aggregates where commodity = '{}' and level = '{}' "
+                 "and region = '{}' and grade in ('{}', 'All') and season in ({})")
+        query += ''.join(" and {} = '{}'".format(col, value)
+                         for col, value in [('state', state), ('district', district)] if value)
+        with METRICS.timer('db_query', table='season_aggregates'):
+            self.season_aggregates = pd.read_sql(query.format(self.commodity, level, region, grade,
+                                                 ','.join(str(s) for s in seasons)), con=conn)
+        conn.close()
+
+
+    def get_availability(self, levels=('state', 'district')):
+        """Day bitmaps from the availability index - see lib/availability.py"""
+        if self.store is not None:
+            self.availability = self.store_availability(levels)
+            return
+        engine = h.db_connect()
+        conn = engine.connect()
+        query = ("select * from availability where commodity in ({}) and level in ({}) "
+                 "and year between {} and {}")
+        with METRICS.timer('db_query', table='availability'):
+            self.availability = pd.read_sql(query.format(
+                self.commodities(), ', '.join("'{}'".format(l) for l in levels),
+                pd.to_datetime(self.start).year, pd.to_datetime(self.end).year), con=conn)
+        conn.close()
+
+
+    def get_snapshot(self):
+        """Latest rolling averages per market - see lib/snapshot.py"""
+        engine = h.db_connect()
+        conn = engine.connect()
+        query = "select * from {} where commodity in ({})"
+        with METRICS.timer('db_query', table='latest_prices'):
+            self.snapshot_p = pd.read_sql(query.format('latest_prices', self.commodities()), con=conn)
+        with METRICS.timer('db_query', table='latest_arrivals'):
+            self.snapshot_a = pd.read_sql(query.format('latest_arrivals', self.commodities()), con=conn)
+        conn.close()
+
+
+    def get_anomalies(self):
+        """Flagged prices and arrivals - see lib/anomalies.py"""
+        engine = h.db_connect()
+        conn = engine.connect()
+        query = "select * from anomalies where commodity in ({}) and date BETWEEN '{}' and '{}'"
+        with METRICS.timer('db_query', table='anomalies'):
+            self.anomalies = pd.read_sql(query.format(self.commodities(), self.start, self.end), con=conn)
+        conn.close()
+        self.anomalies['date'] = pd.to_datetime(self.anomalies['date'])
+
+
+    def store_availability(self, levels):
+        """Bitmaps computed from the store; only the location and date columns are read"""
+        from lib.availability import AvailabilityIndex
+        ai = AvailabilityIndex()
+        self.read_store(columns=['commodity', 'state', 'district', 'market', 'date'])
+        availability = pd.concat([ai.bitmaps(self.prices, 'prices'), ai.bitmaps(self.arrivals, 'arrivals')],
+                                 ignore_index=True)
+        return availability[availability['level'].isin(levels)]
+
+
+    def get_forecasts(self):
         engine = h.db_connect()
         conn = engine.connect()
-        query = "select * from {} where commodity = '{}' and date BETWEEN '{}' and '{}'"
-        self.prices = pd.read_sql(query.format('prices', self.commodity, self.start, self.end), con=conn)
-        self.arrivals = pd.read_sql(query.format('arrivals', self.commodity, self.start, self.end), con=conn)
-        self.lm = pd.read_sql("select * from location_map", con=conn)
+        query = "select * from forecasts where commodity = '{}' and date >= '{}'"
+        with METRICS.timer('db_query', table='forecasts'):
+            self.forecasts = pd.read_sql(query.format(self.commodity, self.end), con=conn)
         conn.close()
\ No newline at end of file
@@ -0,0 +1,231 @@
+"""
+fingerprints.py:
+    Remembers what a commodity's prices in a state looked like on each
+    date, so a re-scrape can tell what's changed whichever query it comes
+    from - tonight's trailing window, a backfill chunk - not only when the
+    same query is run again
+
+    Each (commodity, state, date) keeps a digest of its rows and how many
+    there are. The digest is a sum of row hashes, so it doesn't depend on
+    the order the site serves rows in or which pages they fall on, and it
+    builds up as pages are parsed. Once every page of a query has been
+    read, the digest of every date it covers is stored - dates without rows
+    as empty. There's one row per date, however many queries cover it
+
+    The sums built up so far go into a job's checkpoint, so a resumed job
+    stores its dates too. A job split into page ranges stores each range's
+    sums as a part in fingerprint_parts, and whichever range completes the
+    set merges them into the dates
+
+    A query's leading stored dates can be confirmed without reading their
+    pages: the site lists rows by date, so they fill its first pages, and
+    the page where they end shows whether they still do (see
+    MandiPriceScraper.skip_known). Confirmed dates keep their fingerprints
+
+    Fingerprints live in the date_fingerprints table, so they survive
+    between Lambda containers
+
+    DateFingerprints (cls): Loads, builds up, and stores the fingerprints of a query's dates
+    fingerprint (func): Short stable hash of content
+    digest (func): Order-independent digest of price rows, with their count
+"""
+
+import json
+import hashlib
+import datetime
+
+import lib.helpers as h
+
+ROW = ['commodity', 'date', 'state', 'district', 'market', 'grade', 'variety', 'min_price', 'max_price',
+       'modal_price']
+EMPTY = '0' * 16
+
+
+def fingerprint(content):
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+def day(value):
+    return str(value)[:10]
+
+
+def to_date(value):
+    return datetime.datetime.strptime(day(value), '%Y-%m-%d').date()
+
+
+def date_range(start, end):
+    first, last = to_date(start), to_date(end)
+    return [str(first + datetime.timedelta(days=i)) for i in range((last - first).days + 1)]
+
+
+def row_hash(record):
+    key = '|'.join(day(record[k]) if k == 'date' else str(record[k]) for k in ROW)
+    return int(fingerprint(key)[:16], 16)
+
+
+def digest(records):
+    """(digest, count) of records; the same for the same rows in any order"""
+    return '{:016x}'.format(sum(row_hash(r) for r in records) % 2**64), len(records)
+
+
+def by_date(records):
+    dates = {}
+    for record in records:
+        dates.setdefault(day(record['date']), []).append(record)
+    return dates
+
+
+
+class DateFingerprints(object):
+    """
+    Loads, builds up, and stores the fingerprints of a query's dates
+
+    Args:
+        engine (engine): SQLAlchemy engine
+        commodity (str): Commodity the query is for
+        state (str): State the query is for
+        start (str): First date the query covers
+        end (str): Last date the query covers
+
+    Usage:
+        df = DateFingerprints(engine, 'Kinnow', 'Punjab', '2018-12-01', '2018-12-10')
+        df.load()                   # {'2018-12-01': ('a9f..', 212), ...}
+        df.prefix()                 # (['2018-12-01', ..., '2018-12-09'], 2418) - leading stored dates, rows
+        df.confirm(dates)           # stored dates checked against the site
+        df.unchanged(records)       # records already stored as they are
+        df.add(records)             # as pages are committed
+        df.progress()               # for the checkpoint; restore() reads it back
+        df.save_part(1, 5, 12, 590) # once pages 1-5 of 12 have been
+    """
+    def __init__(self, engine, commodity, state, start, end):
+        self.engine = engine
+        self.commodity = commodity
+        self.state = state
+        self.start = day(start)
+        self.end = day(end)
+        self.dates = date_range(start, end)
+        self.stored = {}
+        self.sums = {}
+        self.counts = {}
+        self.confirmed = set()
+        self.DBTABLE = 'date_fingerprints'
+        self.PARTS = 'fingerprint_parts'
+
+
+    def load(self):
+        from sqlalchemy import text
+        query = text('select date, fingerprint, row_count from {} where commodity = :commodity and state = :state '
+                     'and date >= :start and date <= :end'.format(self.DBTABLE))
+        with self.engine.connect() as conn:
+            rows = conn.execute(query, commodity=self.commodity, state=self.state,
+                                start=self.start, end=self.end).fetchall()
+        self.stored = {day(d): (f, n) for d, f, n in rows}
+        return self.stored
+
+
+    def prefix(self):
+        """The query's dates up to its first unstored one, and their stored rows"""
+        dates = []
+        for date in self.dates:
+            if date not in self.stored:
+                break
+            dates.append(date)
+        return dates, sum(self.stored[d][1] for d in dates)
+
+
+    def confirm(self, dates):
+        self.confirmed.update(dates)
+
+
+    def unchanged(self, records):
+        """
+        Records of confirmed dates, and of dates whose stored rows all
+        appear among records and match them - rows already stored as they are
+        """
+        same = []
+        for date, group in by_date(records).items():
+            if date in self.confirmed or self.stored.get(date) == digest(group):
+                same.extend(group)
+        return same
+
+
+    def add(self, records):
+        for record in records:
+            date = day(record['date'])
+            if date in self.confirmed:
+                continue
+            self.sums[date] = (self.sums.get(date, 0) + row_hash(record)) % 2**64
+            self.counts[date] = self.counts.get(date, 0) + 1
+
+
+    def progress(self):
+        return {'sums': {d: [self.sums[d], self.counts[d]] for d in self.sums},
+                'confirmed': sorted(self.confirmed)}
+
+
+    def restore(self, progress):
+        self.sums = {d: s for d, (s, n) in progress['sums'].items()}
+        self.counts = {d: n for d, (s, n) in progress['sums'].items()}
+        self.confirmed = set(progress['confirmed'])
+
+
+    def merge(self, progress):
+        for date, (total, count) in progress['sums'].items():
+            self.sums[date] = (self.sums.get(date, 0) + total) % 2**64
+            self.counts[date] = self.counts.get(date, 0) + count
+        self.confirmed.update(progress['confirmed'])
+
+
+    def save(self):
+        """Stores every date of the query, from the rows added and the dates confirmed"""
+        updated = datetime.datetime.utcnow()
+        rows = []
+        for d in self.dates:
+            if d in self.confirmed and d in self.stored:
+                value, count = self.stored[d]
+            else:
+                value = '{:016x}'.format(self.sums[d]) if d in self.sums else EMPTY
+                count = self.counts.get(d, 0)
+            rows.append({'commodity': self.commodity, 'state': self.state, 'date': to_date(d),
+                         'fingerprint': value, 'row_count': count, 'updated': updated})
+        h.upsert_rows(self.engine, self.DBTABLE, rows)
+
+
+    def save_part(self, first, last, page_count, record_count):
+        """
+        Stores pages first to last of the query's page_count. A page range
+        short of the whole query is kept as a part until the query's other
+        ranges, read at the same record count, are in too
+
+        Returns:
+            True if the query's dates were stored
+        """
+        if (first, last) == (1, page_count):
+            self.save()
+            return True
+        from sqlalchemy import text
+        key = {'commodity': self.commodity, 'state': self.state, 'start': self.start, 'end': self.end}
+        where = 'commodity = :commodity and state = :state and start = :start and "end" = :end'
+        with h.locked(self.engine, '{}|{}|{}|{}|{}'.format(self.PARTS, *key.values())):
+            h.upsert_rows(self.engine, self.PARTS, [dict(key, first_page=first, last_page=last,
+                                                         page_count=page_count, record_count=record_count,
+                                                         sums=json.dumps(self.progress()),
+                                                         updated=datetime.datetime.utcnow())])
+            with self.engine.connect() as conn:
+                parts = conn.execute(text('select first_page, last_page, sums from {} where {} and '
+                                          'record_count = :record_count'.format(self.PARTS, where)),
+                                     record_count=record_count, **key).fetchall()
+            covered = 0
+            for first_page, last_page, _ in sorted(parts):
+                if first_page > covered + 1:
+                    break
+                covered = max(covered, last_page)
+            if covered < page_count:
+                return False
+            self.sums, self.counts, self.confirmed = {}, {}, set()
+            for _, _, sums in parts:
+                self.merge(json.loads(sums))
+            self.save()
+            with self.engine.begin() as conn:
+                conn.execute(text('delete from {} where {}'.format(self.PARTS, where)), **key)
+        return True
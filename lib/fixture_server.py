@@ -0,0 +1,279 @@
+"""
+fixture_server.py:
+    Local stand-in for agmarknet's search form, so scrapers can be tested and
+    benchmarked without touching the public site. Mimics the parts of the
+    form flow the scrapers rely on:
+        - ddlArrivalPrice, ddlCommodity, ddlState, txtDate, txtDateTo inputs
+        - the cphBody_LabComName heading with the total record count
+        - paginated tableagmark_new results with a Next.png pager, and
+          optionally a numbered GridView pager that posts back 'Page$<n>'
+        - arrivals grouped by district behind plus.png expanders
+
+    Latency and failures can be injected per request, and price pages can
+    be served with rows missing to exercise the scrapers' re-fetching
+
+    FixtureServer (cls): Serves synthetic (or supplied) data over HTTP
+"""
+
+import time
+import html
+import random
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+import pandas as pd
+
+from lib.synthetic import SyntheticAgmarknet
+
+
+FORM = """<html><body>
+<form method="get" action="/SearchCmmMkt.aspx">
+<select id="ddlArrivalPrice" name="Tx_Trend">{types}</select>
+<select id="ddlCommodity" name="Tx_Commodity">{commodities}</select>
+<select id="ddlState" name="Tx_State">{states}</select>
+<input type="text" id="txtDate" name="Tx_FromDate">
+<input type="text" id="txtDateTo" name="Tx_ToDate">
+<input type="submit" id="btnGo" value="Go">
+</form>
+</body></html>"""
+
+RESULTS = """<html><body>
+<span id="cphBody_LabComName">{heading}</span>
+<form id="form1" method="get" action="/SearchCmmMkt.aspx">
+{hidden}
+<input type="hidden" id="__EVENTARGUMENT" name="{argname}" value="">
+{body}
+</form>
+<script>
+function __doPostBack(target, arg) {{
+    document.getElementById('__EVENTARGUMENT').value = arg.split('$').pop();
+    document.getElementById('form1').submit();
+}}
+</script>
+</body></html>"""
+
+PAGER = 'ctl00$cphBody$GridPriceData'
+PRICE_COLUMNS = ['district', 'market', 'commodity', 'variety', 'grade',
+                 'min_price', 'max_price', 'modal_price', 'date']
+
+
+class ThreadingServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+
+    def respond(self, body, status=200):
+        body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def do_GET(self):
+        fixture = self.server.fixture
+        url = urllib.parse.urlparse(self.path)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        if not fixture.inject():
+            self.respond('Service Unavailable', fixture.failure_status)
+            return
+        if url.path.endswith('.png'):
+            self.respond('')
+        elif url.path == '/SearchCmmMkt.aspx':
+            if query.get('Tx_Trend') == 'Arrival':
+                self.respond(fixture.arrivals_page(query))
+            else:
+                self.respond(fixture.prices_page(query))
+        else:
+            self.respond(fixture.form_page())
+
+
+
+class FixtureServer(object):
+    """
+    Serves synthetic (or supplied) data over HTTP in a background thread
+
+    Args:
+        prices (df): [Optional] Prices to serve; defaults to synthetic data
+        arrivals (df): [Optional] Arrivals to serve; defaults to synthetic data
+        latency (float): Seconds added to every response
+        jitter (float): Extra random latency, up to this many seconds
+        failure_rate (float): Share of requests answered with failure_status
+        failure_status (int): HTTP status of injected failures
+        short_rate (float): Share of price pages served with a row missing
+        rows_per_page (int): Price rows per results page
+        numbered_pager (bool): Show a numbered pager, with the current page as a span, as well as Next
+        port (int): Port to listen on; 0 picks a free one
+        seed (int): Seed for injected latency and failures
+
+    Usage:
+        with FixtureServer(latency=0.2, failure_rate=0.05) as fs:
+            mps = MandiPriceScraper('Kinnow', 'Punjab', '2018-12-01', '2018-12-10',
+                                    serverless=False, url=fs.url)
+            mps.run()
+            fs.stats    # {'requests': .., 'failures': .., 'pages': ..}
+    """
+    def __init__(self, prices=None, arrivals=None, latency=0, jitter=0, failure_rate=0,
+                 failure_status=503, short_rate=0, rows_per_page=50, numbered_pager=True, port=0, seed=0):
+        if prices is None or arrivals is None:
+            prices, arrivals, _ = SyntheticAgmarknet(seed=seed).generate()
+        self.prices = prices.assign(date=pd.to_datetime(prices['date']))
+        self.arrivals = arrivals.assign(date=pd.to_datetime(arrivals['date']))
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.failure_status = failure_status
+        self.short_rate = short_rate
+        self.rows_per_page = rows_per_page
+        self.numbered_pager = numbered_pager
+        self.port = port
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'failures': 0, 'pages': 0, 'short_pages': 0}
+
+
+    def start(self):
+        self.server = ThreadingServer(('127.0.0.1', self.port), FixtureHandler)
+        self.server.fixture = self
+        self.url = 'http://127.0.0.1:{}/'.format(self.server.server_address[1])
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+    def __enter__(self):
+        return self.start()
+
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+    def inject(self):
+        """Applies latency, and returns False if this request should fail"""
+        with self.lock:
+            self.stats['requests'] += 1
+            delay = self.latency + self.rng.uniform(0, self.jitter)
+            fail = self.rng.random() < self.failure_rate
+            if fail:
+                self.stats['failures'] += 1
+        if delay:
+            time.sleep(delay)
+        return not fail
+
+
+    ## Pages
+
+    def options(self, values):
+        return ''.join('<option value="{0}">{0}</option>'.format(html.escape(v)) for v in values)
+
+
+    def form_page(self):
+        commodities = sorted(set(self.prices['commodity']) | set(self.arrivals['commodity']))
+        states = sorted(set(self.prices['state']) | set(self.arrivals['state']))
+        return FORM.format(types=self.options(['Price', 'Arrival']),
+                           commodities=self.options(commodities),
+                           states=self.options(states))
+
+
+    def select(self, df, query):
+        start = pd.to_datetime(query.get('Tx_FromDate'))
+        end = pd.to_datetime(query.get('Tx_ToDate') or query.get('Tx_FromDate'))
+        mask = ((df['commodity'] == query.get('Tx_Commodity')) &
+                (df['state'] == query.get('Tx_State')) &
+                (df['date'] >= start) & (df['date'] <= end))
+        return df[mask]
+
+
+    def hidden(self, query, skip):
+        return ''.join('<input type="hidden" name="{}" value="{}">'.format(k, html.escape(v))
+                       for k, v in query.items() if k not in skip)
+
+
+    def pager_row(self, page, page_count):
+        """GridView's pager: ten pages around the current one, which is a span rather than a link"""
+        first = max(1, min(page - 5, page_count - 9))
+        cells = []
+        for n in range(first, min(first + 10, page_count + 1)):
+            if n == page:
+                cells.append('<td><span>{}</span></td>'.format(n))
+            else:
+                cells.append('<td><a href="javascript:__doPostBack(&#39;{}&#39;,&#39;Page${}&#39;)">{}</a></td>'
+                             .format(PAGER, n, n))
+        return '<tr><td colspan="{}"><table><tr>{}</tr></table></td></tr>'.format(len(PRICE_COLUMNS), ''.join(cells))
+
+
+    def prices_page(self, query):
+        rows = self.select(self.prices, query).sort_values(['date', 'district', 'market', 'grade'])
+        hidden = self.hidden(query, ['page', 'x', 'y'])
+        if rows.empty:
+            return RESULTS.format(heading='No Data Found', hidden=hidden, argname='page', body='')
+        # a pager postback sends 'Page$<n>'
+        page = int(str(query.get('page') or 1).split('$')[-1])
+        page_count = -(-len(rows) // self.rows_per_page)
+        heading = '{} Prices in {} from {} to {} - Total Records: {}'.format(
+            query.get('Tx_Commodity'), query.get('Tx_State'),
+            query.get('Tx_FromDate'), query.get('Tx_ToDate'), len(rows))
+        pagerows = rows.iloc[(page - 1)*self.rows_per_page:page*self.rows_per_page]
+        with self.lock:
+            short = self.rng.random() < self.short_rate
+            if short:
+                self.stats['short_pages'] += 1
+        if short:
+            pagerows = pagerows.iloc[:-1]
+        body = ['<table class="tableagmark_new"><tr>' +
+                ''.join('<th>{}</th>'.format(c) for c in PRICE_COLUMNS) + '</tr>']
+        for r in pagerows.itertuples(index=False):
+            r = r._asdict()
+            r['date'] = r['date'].strftime('%d %b %Y')
+            body.append('<tr>' + ''.join('<td><span>{}</span></td>'.format(html.escape(str(r[c])))
+                                         for c in PRICE_COLUMNS) + '</tr>')
+        if self.numbered_pager and page_count > 1:
+            body.append(self.pager_row(page, page_count))
+        body.append('</table>')
+        if page < page_count:
+            body.append('<input type="image" src="/images/Next.png" '
+                        'onclick="document.getElementById(\'__EVENTARGUMENT\').value={}">'.format(page + 1))
+        with self.lock:
+            self.stats['pages'] += 1
+        return RESULTS.format(heading=heading, hidden=hidden, argname='page', body='\n'.join(body))
+
+
+    def arrivals_page(self, query):
+        rows = self.select(self.arrivals, query)
+        hidden = self.hidden(query, ['expanded', 'x', 'y'])
+        if rows.empty:
+            return RESULTS.format(heading='No Data Found', hidden=hidden, argname='expanded', body='')
+        expanded = int(query.get('expanded') or 0)
+        totals = rows.groupby(['district', 'market'])['quantity'].sum().reset_index()
+        body, i = ['<table class="tableagmark_new">'], 0
+        for n, (district, g) in enumerate(totals.groupby('district')):
+            if n >= expanded:
+                body.append('<tr><td><input type="image" src="/images/plus.png" '
+                            'onclick="document.getElementById(\'__EVENTARGUMENT\').value={}">'
+                            '{}</td></tr>'.format(expanded + 1, html.escape(district)))
+                continue
+            for r in g.itertuples(index=False):
+                body.append('<tr><td><span id="cphBody_GridArrivalData_MarketName_{0}">{1}</span></td>'
+                            '<td><span id="cphBody_GridArrivalData_Lab2Arrival_{0}">{2}</span></td></tr>'
+                            .format(i, html.escape(r.market), round(r.quantity, 1)))
+                i += 1
+        body.append('</table>')
+        with self.lock:
+            self.stats['pages'] += 1
+        heading = '{} Arrivals in {} on {}'.format(query.get('Tx_Commodity'), query.get('Tx_State'),
+                                                   query.get('Tx_FromDate'))
+        return RESULTS.format(heading=heading, hidden=hidden, argname='expanded', body='\n'.join(body))
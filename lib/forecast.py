@@ -0,0 +1,237 @@
+"""
+forecast.py:
+    Short-term price forecasts for every (market, grade) series of a
+    commodity - the "expected prices for the coming week" service
+
+    Each series is modelled with damped-trend exponential smoothing. All
+    series are fitted together: modal prices are pivoted into a
+    (days x series) matrix and the smoothing recursion runs once per day over
+    whole rows, so fitting thousands of series costs little more than
+    fitting one. Large fits can also be split across processes. A seasonal
+    baseline - the same week's average in earlier years - is stored next to
+    each forecast
+
+    Model state is saved per series in forecast_state, so the nightly update
+    only feeds in days after the last fit. Backfilled history needs a refit
+
+    PriceForecaster (cls): Fits, updates, and stores forecasts
+    smooth (func): Vectorised damped-trend exponential smoothing
+"""
+
+import multiprocessing
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+import lib.helpers as h
+from lib.metrics import timed
+
+KEYS = ['commodity', 'state', 'district', 'market', 'grade']
+
+
+def smooth(y, level, trend, alpha, beta, phi):
+    """
+    Runs damped-trend exponential smoothing over y (days x series), starting
+    from level and trend (NaN for series with no history yet). Days without
+    an observation carry the damped trend forward. alpha broadcasts against
+    the series axis, so a (grid x 1) alpha fits every grid value at once.
+    Returns final level and trend, plus the one-step squared error and
+    observation count used to pick alpha
+    """
+    level, trend, _ = [np.array(a, dtype=float) for a in np.broadcast_arrays(level, trend, alpha)]
+    sse = np.zeros(level.shape)
+    count = np.zeros(level.shape)
+    with np.errstate(invalid='ignore'):
+        for obs in y:
+            pred = level + phi*trend
+            seen = ~np.isnan(obs)
+            fresh = seen & np.isnan(level)
+            known = seen & ~fresh
+            err = np.where(known, obs - pred, 0)
+            sse += err**2
+            count += known
+            new_level = np.where(fresh, obs, pred + alpha*err)
+            trend = np.where(known, beta*(new_level - level) + (1 - beta)*phi*trend,
+                             np.where(fresh, 0, phi*trend))
+            level = new_level
+    return level, trend, sse, count
+
+
+def fit_block(y, level, trend, alpha, beta, phi):
+    """Fits one block of series. A 2-d alpha is a grid to choose from per series"""
+    if alpha.ndim == 1:
+        level, trend, _, _ = smooth(y, level, trend, alpha, beta, phi)
+        return level, trend, alpha
+    lv, tr, sse, count = smooth(y, level, trend, alpha, beta, phi)
+    mse = np.where(count > 0, sse / np.maximum(count, 1), np.inf)
+    best = np.argmin(mse, axis=0)
+    cols = np.arange(y.shape[1])
+    return lv[best, cols], tr[best, cols], alpha[best, 0]
+
+
+
+class PriceForecaster(object):
+    """
+    Fits, updates, and stores forecasts for every (state, district, market,
+    grade) series of a commodity
+
+    Args:
+        commodity (str): Commodity to forecast
+        horizon (int): Days ahead to forecast
+        alphas (tuple): Level smoothing values to choose from, per series, on refit
+        beta (float): Trend smoothing
+        phi (float): Trend damping
+        max_age (int): Series without an observation in this many days aren't forecast
+        processes (int): Worker processes for fitting; 1 fits in-process
+        engine (engine): [Optional] SQLAlchemy engine; defaults to helpers.db_connect()
+
+    Usage:
+        pf = PriceForecaster('Kinnow')
+        pf.refit()          # full history, picks alpha per series
+        pf.update()         # nightly - only days since the last fit
+    """
+    def __init__(self, commodity, horizon=7, alphas=(0.1, 0.3, 0.5, 0.7), beta=0.1, phi=0.9,
+                 max_age=14, processes=1, engine=None):
+        self.commodity = commodity
+        self.horizon = horizon
+        self.alphas = alphas
+        self.beta = beta
+        self.phi = phi
+        self.max_age = max_age
+        self.processes = processes
+        self.engine = engine
+        self.STATETABLE = 'forecast_state'
+        self.DBTABLE = 'forecasts'
+
+
+    def connect(self):
+        if not self.engine:
+            self.engine = h.db_connect()
+
+
+    def load_prices(self, start, end):
+        query = text('select commodity, state, district, market, grade, date, modal_price from prices '
+                     'where commodity = :commodity and date between :start and :end')
+        params = dict(commodity=self.commodity, start=str(start.date()), end=str(end.date()))
+        with self.engine.connect() as conn:
+            prices = pd.read_sql(query, con=conn, params=params)
+        prices['date'] = pd.to_datetime(prices['date'])
+        return prices
+
+
+    def load_state(self):
+        query = text('select * from {} where commodity = :commodity'.format(self.STATETABLE))
+        with self.engine.connect() as conn:
+            state = pd.read_sql(query, con=conn, params=dict(commodity=self.commodity))
+        for col in ['last_date', 'last_seen']:
+            state[col] = pd.to_datetime(state[col])
+        return state.set_index(KEYS)
+
+
+    def pivot(self, prices, start, end):
+        daily = prices.groupby(KEYS + ['date'])['modal_price'].mean().unstack(KEYS)
+        return daily.reindex(pd.date_range(start, end, freq='D'))
+
+
+    @timed('forecast_fit')
+    def fit(self, y, level, trend, alpha):
+        if self.processes <= 1 or y.shape[1] < 2*self.processes:
+            return fit_block(y, level, trend, alpha, self.beta, self.phi)
+        blocks = np.array_split(np.arange(y.shape[1]), self.processes)
+        args = [(y[:, b], level[b], trend[b], alpha if alpha.ndim == 2 else alpha[b],
+                 self.beta, self.phi) for b in blocks]
+        with multiprocessing.Pool(self.processes) as pool:
+            results = pool.starmap(fit_block, args)
+        return [np.concatenate(r) for r in zip(*results)]
+
+
+    def run(self, state, start, end, alpha):
+        """Feeds days start..end into the model, on top of any saved state"""
+        prices = self.load_prices(start, end)
+        y = self.pivot(prices, start, end)
+        series = y.columns.union(state.index) if len(state) else y.columns
+        y = y.reindex(columns=series)
+        state = state.reindex(series)
+        if alpha is None:
+            alpha = state['alpha'].fillna(self.alphas[len(self.alphas) // 2]).values
+        level, trend, alpha = self.fit(y.values, state['level'].values, state['trend'].values, alpha)
+        observed = y.notnull().values
+        last_obs = np.where(observed.any(axis=0), y.index.values[::-1][np.argmax(observed[::-1], axis=0)],
+                            np.datetime64('NaT'))
+        last_seen = pd.Series(last_obs, index=series).fillna(state['last_seen'])
+        fitted = pd.DataFrame({'level': level, 'trend': trend, 'alpha': alpha,
+                               'last_date': end, 'last_seen': last_seen.values}, index=series)
+        return fitted[fitted['level'].notnull()]
+
+
+    def forecast(self, fitted, end):
+        active = fitted[fitted['last_seen'] >= end - pd.Timedelta(days=self.max_age)]
+        damp = np.cumsum(self.phi ** np.arange(1, self.horizon + 1))
+        values = active['level'].values[:, None] + damp[None, :]*active['trend'].values[:, None]
+        f = pd.DataFrame(values, index=active.index,
+                         columns=pd.Index(np.arange(1, self.horizon + 1), name='horizon'))
+        f = f.stack().rename('forecast_price').reset_index()
+        f['date'] = end + pd.to_timedelta(f['horizon'], unit='D')
+        f['issued'] = end
+        return f
+
+
+    def baseline(self, forecasts, end, years=3):
+        """Average price in the same week of each of the previous few years"""
+        windows = []
+        for k in range(1, years + 1):
+            start = end + pd.Timedelta(days=1) - pd.DateOffset(years=k)
+            windows.append(self.load_prices(start, start + pd.Timedelta(days=self.horizon - 1)))
+        history = pd.concat(windows)
+        if history.empty:
+            forecasts['baseline_price'] = np.nan
+            return forecasts
+        baseline = history.groupby(KEYS)['modal_price'].mean().rename('baseline_price')
+        return forecasts.merge(baseline.reset_index(), on=KEYS, how='left')
+
+
+    def save_state(self, fitted):
+        rows = fitted.reset_index()
+        rows = rows.astype(object).where(rows.notnull(), None)
+        h.upsert_rows(self.engine, self.STATETABLE, rows.to_dict('records'))
+
+
+    def write(self, forecasts):
+        rows = forecasts[KEYS + ['date', 'horizon', 'forecast_price', 'baseline_price', 'issued']]
+        rows = rows.round({'forecast_price': 0, 'baseline_price': 0})
+        rows = rows.astype(object).where(rows.notnull(), None)
+        h.upsert_rows(self.engine, self.DBTABLE, rows.to_dict('records'))
+        print('Written {} forecasts'.format(len(rows)))
+
+
+    def publish(self, fitted, end):
+        self.save_state(fitted)
+        forecasts = self.baseline(self.forecast(fitted, end), end)
+        self.write(forecasts)
+        self.forecasts = forecasts
+
+
+    def refit(self, start='2015-10-01', end=None):
+        self.connect()
+        end = pd.to_datetime(end or 'today').normalize()
+        state = pd.DataFrame(columns=['level', 'trend', 'alpha', 'last_date', 'last_seen'],
+                             index=pd.MultiIndex.from_tuples([], names=KEYS))
+        alpha = np.array(self.alphas, dtype=float)[:, None]
+        fitted = self.run(state, pd.to_datetime(start), end, alpha)
+        self.publish(fitted, end)
+
+
+    def update(self, end=None):
+        self.connect()
+        end = pd.to_datetime(end or 'today').normalize()
+        state = self.load_state()
+        if state.empty:
+            print('No saved state, refitting')
+            return self.refit(end=end)
+        start = state['last_date'].min() + pd.Timedelta(days=1)
+        if start > end:
+            print('Forecasts up to date')
+            return
+        fitted = self.run(state, start, end, None)
+        self.publish(fitted, end)
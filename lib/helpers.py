@@ -1,6 +1,9 @@
 import os
 import json
-from sqlalchemy import create_engine
+import hashlib
+import threading
+from contextlib import contextmanager
+from lib.metrics import METRICS
 __location__ = os.path.realpath(
     os.path.join(os.getcwd(), os.path.dirname(__file__)))
 
@@ -8,15 +11,143 @@ __location__ = os.path.realpath(
 helpers.py
 
 - a colleciton of functions that are shared between modules
+- sqlalchemy is imported on first use, so scrapers stay cheap to import on Lambda
 
 API:
-function db_connection              - connect to database
+function db_connection              - connect to database: postgres, or an embedded sqlite/duckdb file
+function get_table                  - reflect a db table, cached per engine
+function insert_rows                - bulk insert rows, skipping existing primary keys
+function upsert_rows                - bulk insert rows, replacing existing primary keys
+function locked                     - run a read-modify-write update while other writers of the same rows wait
 
 """
 
-def db_connect():
+_tables = {}
+_engines = {}
+_locks = {}
+_locks_lock = threading.Lock()
+
+
+def db_url():
+    """
+    AGMARKNET_DB, e.g. sqlite:///data/agmarknet.sqlite or
+    duckdb:///data/agmarknet.duckdb; else a url in secrets.json; else the
+    postgres instance secrets.json describes
+    """
+    url = os.environ.get('AGMARKNET_DB')
+    if url:
+        return url
     secrets = json.loads(open(os.path.join(__location__, 'secrets.json')).read())
-    engine = create_engine('postgresql+psycopg2://{}:{}@{}:5432/{}'.
-                format(secrets['username'], secrets['password'], 
-                       secrets['host'], secrets['db']))
-    return engine
\ No newline at end of file
+    return secrets.get('url') or 'postgresql+psycopg2://{}:{}@{}:5432/{}'.format(
+        secrets['username'], secrets['password'], secrets['host'], secrets['db'])
+
+
+def db_connect(url=None):
+    """Engine for url, or db_url(); engines are shared, so embedded files are opened once per process"""
+    url = url or db_url()
+    if url not in _engines:
+        from sqlalchemy import create_engine
+        _engines[url] = create_engine(url)
+    return _engines[url]
+
+
+def get_table(engine, tablename):
+    key = (str(engine.url), tablename)
+    if key not in _tables:
+        from sqlalchemy import MetaData, Table
+        _tables[key] = Table(tablename, MetaData(), autoload=True, autoload_with=engine)
+    return _tables[key]
+
+
+def insert_rows(engine, tablename, rows):
+    """
+    Inserts rows in a single round trip. Rows whose primary key already exists
+    are skipped rather than failing the batch, so re-running a batch after a
+    crash is harmless
+    """
+    if not rows:
+        return
+    with METRICS.timer('write_db', table=tablename):
+        table = get_table(engine, tablename)
+        if engine.dialect.name == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+            stmt = insert(table).on_conflict_do_nothing()
+        else:
+            stmt = table.insert().prefix_with('OR IGNORE')
+        with engine.begin() as conn:
+            conn.execute(stmt, rows)
+
+
+def upsert_rows(engine, tablename, rows):
+    """
+    Inserts rows in a single round trip, overwriting the non-key columns of
+    rows whose primary key already exists
+    """
+    if not rows:
+        return
+    with METRICS.timer('write_db', table=tablename):
+        table = get_table(engine, tablename)
+        if engine.dialect.name == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+            stmt = insert(table)
+            keys = [c.name for c in table.primary_key.columns]
+            updates = {c.name: stmt.excluded[c.name] for c in table.columns if c.name not in keys}
+            stmt = stmt.on_conflict_do_update(index_elements=keys, set_=updates)
+        else:
+            stmt = table.insert().prefix_with('OR REPLACE')
+        with engine.begin() as conn:
+            conn.execute(stmt, rows)
+
+
+def lock_key(name):
+    """Signed 64-bit key for a postgres advisory lock"""
+    return int.from_bytes(hashlib.md5(name.encode('utf-8')).digest()[:8], 'big', signed=True)
+
+
+@contextmanager
+def file_lock(engine):
+    """Exclusive lock on a file beside an embedded database, shared by every process using it"""
+    database = engine.url.database
+    try:
+        import fcntl
+    except ImportError:
+        fcntl = None
+    if fcntl is None or not database or database == ':memory:':
+        yield
+        return
+    with open(database + '.lock', 'a') as lockfile:
+        fcntl.flock(lockfile, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lockfile, fcntl.LOCK_UN)
+
+
+@contextmanager
+def locked(engine, *names):
+    """
+    Holds locks on names while a read-modify-write update runs, so
+    concurrent updates of the same rows - from scraper threads, or queue
+    workers - take turns instead of overwriting each other. Threads wait
+    on a lock per name; on postgres, a transaction-scoped advisory lock per
+    name makes workers on other machines wait too, and embedded databases
+    take a file lock for other processes on the machine
+    """
+    names = sorted(set(names))
+    with _locks_lock:
+        locks = [_locks.setdefault(name, threading.Lock()) for name in names]
+    for lock in locks:
+        lock.acquire()
+    try:
+        if engine.dialect.name == 'postgresql':
+            from sqlalchemy import text
+            with engine.begin() as conn:
+                for name in names:
+                    conn.execute(text('select pg_advisory_xact_lock(:key)'), key=lock_key(name))
+                yield
+        else:
+            with file_lock(engine):
+                yield
+    finally:
+        for lock in reversed(locks):
+            lock.release()
@@ -0,0 +1,278 @@
+"""
+job_queue.py:
+    Spreads scrape jobs over any number of machines through a table in the
+    DB. A coordinator enqueues (commodity, state, datatype, date-chunk) jobs;
+    workers claim them one at a time and run them with the usual scrapers,
+    so throughput grows with the number of workers
+
+    A claim is a lease: the worker holds the job until lease_until and
+    heartbeats to extend it while scraping. If a worker dies, its lease runs
+    out and the job goes to the next worker that asks. On postgres claims
+    use select ... for update skip locked, so workers never wait on each
+    other; on sqlite and duckdb a single conditional update does the same
+    job on one machine
+
+    A job can therefore run twice - e.g. a worker that stalled past its
+    lease and then carried on. Writes are inserts that skip existing
+    primary keys (helpers.insert_rows), so the second run adds nothing:
+    each row is written exactly once. A worker that finds its lease gone
+    closes its browser and leaves the job to its new owner
+
+    JobQueue (cls): Enqueues, claims, and settles jobs in the scrape_jobs table
+    QueueWorker (cls): Claims and runs jobs until the queue is empty
+"""
+
+import time
+import uuid
+import socket
+import datetime
+import threading
+
+import pandas as pd
+from sqlalchemy import text, bindparam
+
+import lib.helpers as h
+from lib.metrics import METRICS
+from lib.async_scraper import ScrapeJob
+from lib.resilience import JobSupervisor, Cancelled
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+def utcnow():
+    return datetime.datetime.utcnow()
+
+
+
+class JobQueue(object):
+    """
+    Enqueues, claims, and settles jobs in the scrape_jobs table
+
+    Args:
+        engine (engine): [Optional] SQLAlchemy engine; defaults to helpers.db_connect()
+        lease (float): Seconds a claim lasts without a heartbeat
+        max_attempts (int): Claims a job gets before it's left failed
+
+    Usage:
+        jq = JobQueue()
+        jq.enqueue(jobs)                    # coordinator; done and failed jobs are queued again
+        claim = jq.claim('worker-1')        # (id, token, ScrapeJob), or None when there's nothing to do
+        jq.heartbeat(claim)                 # False once the lease has gone to another worker
+        jq.complete(claim)
+        jq.counts()                         # {'queued': 12, 'running': 4, 'done': 30}
+    """
+    def __init__(self, engine=None, lease=300, max_attempts=3):
+        self.engine = engine
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.DBTABLE = 'scrape_jobs'
+
+
+    def connect(self):
+        if not self.engine:
+            self.engine = h.db_connect()
+
+
+    def existing(self, keys):
+        """{job: status} for the jobs among keys already in the table"""
+        found = {}
+        stmt = text('select job, status from {} where job in :keys'.format(self.DBTABLE))
+        stmt = stmt.bindparams(bindparam('keys', expanding=True))
+        with self.engine.connect() as conn:
+            for i in range(0, len(keys), 500):
+                found.update(conn.execute(stmt, keys=keys[i:i + 500]).fetchall())
+        return found
+
+
+    def enqueue(self, jobs, requeue=True):
+        """
+        Adds jobs to the queue. Jobs already queued or running are left
+        alone; done and failed ones are queued again unless requeue is False
+        """
+        self.connect()
+        now = utcnow()
+        found = self.existing([repr(job) for job in jobs])
+        rows = [{
+            'job': repr(job),
+            'datatype': job.datatype,
+            'commodity': job.commodity,
+            'state': job.state,
+            'start_date': pd.to_datetime(job.start).date(),
+            'end_date': pd.to_datetime(job.end).date(),
+            'first_page': job.pages[0] if job.pages else None,
+            'last_page': job.pages[1] if job.pages else None,
+            'status': QUEUED,
+            'attempts': 0,
+            'created': now,
+            } for job in jobs if repr(job) not in found]
+        h.insert_rows(self.engine, self.DBTABLE, rows)
+        finished = [job for job, status in found.items() if status in (DONE, FAILED)] if requeue else []
+        stmt = text("update {} set status = '{}', attempts = 0, worker = null, token = null, lease_until = null, "
+                    "heartbeat = null, finished = null, error = null, created = :now "
+                    "where job in :keys and status in ('{}', '{}')".format(self.DBTABLE, QUEUED, DONE, FAILED))
+        stmt = stmt.bindparams(bindparam('keys', expanding=True))
+        with self.engine.begin() as conn:
+            for i in range(0, len(finished), 500):
+                conn.execute(stmt, now=now, keys=finished[i:i + 500])
+        print('Enqueued {} new jobs, requeued {}; {} already queued or running'.format(
+            len(rows), len(finished), len(found) - len(finished)))
+        return len(rows) + len(finished)
+
+
+    def expire(self):
+        """Fails running jobs whose last attempt's lease has run out, which no worker may claim"""
+        sql = text("update {} set status = '{}', error = 'lease expired on the last attempt', lease_until = null "
+                   "where status = '{}' and lease_until < :now and attempts >= :max_attempts"
+                   .format(self.DBTABLE, FAILED, RUNNING))
+        with self.engine.begin() as conn:
+            expired = conn.execute(sql, now=utcnow(), max_attempts=self.max_attempts).rowcount
+        if expired:
+            print('{} jobs failed when their last lease ran out'.format(expired))
+            METRICS.incr('jobs_expired', expired)
+        return expired
+
+
+    def claim(self, worker):
+        """Leases the oldest claimable job to worker"""
+        self.connect()
+        self.expire()
+        token = uuid.uuid4().hex
+        now = utcnow()
+        claimable = ("(status = '{}' or (status = '{}' and lease_until < :now)) and attempts < :max_attempts"
+                     .format(QUEUED, RUNNING))
+        pick = 'select id from {} where {} order by id limit 1'.format(self.DBTABLE, claimable)
+        if self.engine.dialect.name == 'postgresql':
+            where = 'id = ({} for update skip locked)'.format(pick)
+        else:
+            # one statement, so no other claim lands between the pick and the update
+            where = 'id = ({}) and {}'.format(pick, claimable)
+        sql = text("update {} set status = '{}', worker = :worker, token = :token, lease_until = :lease_until, "
+                   "heartbeat = :now, attempts = attempts + 1 where {}".format(self.DBTABLE, RUNNING, where))
+        with self.engine.begin() as conn:
+            claimed = conn.execute(sql, worker=worker, token=token, now=now, max_attempts=self.max_attempts,
+                                   lease_until=now + datetime.timedelta(seconds=self.lease)).rowcount
+        if not claimed:
+            return None
+        with self.engine.connect() as conn:
+            row = conn.execute(text('select * from {} where token = :token'.format(self.DBTABLE)),
+                               token=token).fetchone()
+        pages = (row['first_page'], row['last_page']) if row['first_page'] is not None else None
+        job = ScrapeJob(row['datatype'], row['commodity'], row['state'], str(row['start_date']),
+                        str(row['end_date']), pages)
+        METRICS.incr('jobs_claimed')
+        return row['id'], token, job
+
+
+    def settle(self, claim, **values):
+        """Updates a claimed job, if the claim still holds it"""
+        job_id, token, _ = claim
+        sets = ', '.join('{0} = :{0}'.format(k) for k in values)
+        with self.engine.begin() as conn:
+            return conn.execute(text('update {} set {} where id = :id and token = :token'.format(
+                self.DBTABLE, sets)), id=job_id, token=token, **values).rowcount == 1
+
+
+    def heartbeat(self, claim):
+        now = utcnow()
+        return self.settle(claim, heartbeat=now, lease_until=now + datetime.timedelta(seconds=self.lease))
+
+
+    def complete(self, claim):
+        return self.settle(claim, status=DONE, finished=utcnow(), error=None)
+
+
+    def fail(self, claim, error):
+        """Puts the job back for another worker, or leaves it failed once its attempts are used up"""
+        with self.engine.connect() as conn:
+            attempts = conn.execute(text('select attempts from {} where id = :id'.format(self.DBTABLE)),
+                                    id=claim[0]).scalar()
+        status = FAILED if attempts >= self.max_attempts else QUEUED
+        return self.settle(claim, status=status, error='{}: {}'.format(type(error).__name__, error),
+                           lease_until=None)
+
+
+    def counts(self):
+        self.connect()
+        with self.engine.connect() as conn:
+            df = pd.read_sql('select status, count(*) as n from {} group by status'.format(self.DBTABLE), con=conn)
+        return dict(zip(df['status'], df['n'].astype(int)))
+
+
+
+class QueueWorker(object):
+    """
+    Claims and runs jobs until the queue is empty. Each job runs under a
+    JobSupervisor (see lib/resilience.py) for timeouts and in-process
+    retries; a heartbeat thread keeps its lease alive meanwhile
+
+    Args:
+        queue (JobQueue): Queue to work from
+        name (str): [Optional] Worker name; defaults to host and a random suffix
+        serverless (bool): Lambda execution flag
+        url (str): [Optional] Site to scrape; defaults to agmarknet
+        fetcher (str): [Optional] 'selenium' or 'http' - see lib/pipeline.py
+        supervisor (JobSupervisor): [Optional] Defaults to retries and a circuit breaker only
+        poll (float): [Optional] Seconds to wait for new jobs when the queue is empty;
+            the worker exits when it's empty without
+
+    Usage:
+        QueueWorker(JobQueue()).run()       # on each machine
+    """
+    def __init__(self, queue, name=None, serverless=False, url=None, fetcher=None, supervisor=None, poll=None):
+        self.queue = queue
+        self.name = name or '{}-{}'.format(socket.gethostname(), uuid.uuid4().hex[:6])
+        self.serverless = serverless
+        self.url = url
+        self.fetcher = fetcher
+        self.supervisor = supervisor or JobSupervisor()
+        self.poll = poll
+        self.completed = 0
+
+
+    def keep_alive(self, claim, stop, lost):
+        """Heartbeats until stop is set; if the lease is lost, sets lost and closes the job's browser"""
+        while not stop.wait(self.queue.lease / 3):
+            if not self.queue.heartbeat(claim):
+                print('{} lost its lease on {}'.format(self.name, claim[2]))
+                lost.set()
+                claim[2].cancel()
+                return
+
+
+    def run_claim(self, claim):
+        job = claim[2]
+        stop, lost = threading.Event(), threading.Event()
+        beat = threading.Thread(target=self.keep_alive, args=(claim, stop, lost), daemon=True)
+        beat.start()
+        try:
+            e = self.supervisor.run(job, lambda j: j.run(self.serverless, self.url, self.fetcher), ScrapeJob.cancel,
+                                    cancelled=lost)
+        finally:
+            stop.set()
+            beat.join()
+        if isinstance(e, Cancelled):
+            # the job has a new owner; it's theirs to settle
+            return
+        if e is None:
+            if self.queue.complete(claim):
+                self.completed += 1
+        else:
+            self.queue.fail(claim, e)
+
+
+    def run(self):
+        print('{} started'.format(self.name))
+        while True:
+            claim = self.queue.claim(self.name)
+            if claim is None:
+                if not self.poll:
+                    break
+                time.sleep(self.poll)
+                continue
+            print('{} running {}'.format(self.name, claim[2]))
+            self.run_claim(claim)
+        print('{} finished {} jobs'.format(self.name, self.completed))
+        return self.completed
@@ -0,0 +1,167 @@
+"""
+metrics.py:
+    Timing and counter instrumentation for the scrape and plot pipelines.
+    Every observation is emitted as a json log line on the 'agmarknet'
+    logger; totals can be written out as a Prometheus-style text file
+
+    Metrics (cls): Records stage timings and counters
+    timed (func): Method decorator - times each call as a stage
+    profiled (func): Context manager - optional cProfile hook
+    METRICS: Shared Metrics instance used across modules
+
+Usage:
+    @timed('extract_prices')
+    def extract_prices(self): ...
+
+    with METRICS.timer('write_db', table='prices'):
+        ...
+    METRICS.incr('rows', 50, table='prices')
+    METRICS.write_prometheus('data/metrics.prom')
+"""
+
+import time
+import json
+import logging
+import cProfile
+import functools
+import threading
+import contextlib
+
+logger = logging.getLogger('agmarknet')
+
+
+def _labelkey(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _labelstr(key):
+    if not key:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(k, v) for k, v in key) + '}'
+
+
+class Metrics(object):
+    """
+    Records stage timings and counters
+
+    Args:
+        namespace (str): Prefix for exported metric names
+    """
+    def __init__(self, namespace='agmarknet'):
+        self.namespace = namespace
+        self.lock = threading.Lock()
+        self.reset()
+
+
+    def reset(self):
+        self.started = time.time()
+        self.timings = {}
+        self.counters = {}
+
+
+    def log(self, event, **fields):
+        fields.update(event=event, ts=round(time.time(), 3))
+        logger.info(json.dumps(fields, default=str))
+
+
+    def observe(self, stage, seconds, **labels):
+        key = (stage, _labelkey(labels))
+        with self.lock:
+            count, total, peak = self.timings.get(key, (0, 0.0, 0.0))
+            self.timings[key] = (count + 1, total + seconds, max(peak, seconds))
+        self.log('timing', stage=stage, seconds=round(seconds, 4), **labels)
+
+
+    def incr(self, name, value=1, **labels):
+        key = (name, _labelkey(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+
+    def error(self, stage, exc, **labels):
+        self.incr('errors', stage=stage, error=type(exc).__name__, **labels)
+        self.log('error', stage=stage, error=type(exc).__name__, message=str(exc), **labels)
+
+
+    @contextlib.contextmanager
+    def timer(self, stage, **labels):
+        """
+        Times the enclosed block as stage. An error is recorded by the
+        timer it's raised in; timers it passes through on its way out don't
+        count it again
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            if not getattr(e, '_timed', False):
+                self.error(stage, e, **labels)
+                e._timed = True
+            raise
+        finally:
+            self.observe(stage, time.perf_counter() - start, **labels)
+
+
+    def total(self, name):
+        return sum(v for (n, _), v in self.counters.items() if n == name)
+
+
+    def rates(self):
+        elapsed = max(time.time() - self.started, 1e-9)
+        return {
+            'rows_per_second': self.total('rows') / elapsed,
+            'pages_per_minute': self.total('pages') / elapsed * 60,
+            }
+
+
+    def write_prometheus(self, path):
+        ns = self.namespace
+        lines = []
+        with self.lock:
+            timings = sorted(self.timings.items())
+            counters = sorted(self.counters.items())
+        lines.append('# TYPE {}_stage_seconds summary'.format(ns))
+        for (stage, key), (count, total, peak) in timings:
+            labels = _labelstr((('stage', stage),) + key)
+            lines.append('{}_stage_seconds_count{} {}'.format(ns, labels, count))
+            lines.append('{}_stage_seconds_sum{} {:.6f}'.format(ns, labels, total))
+            lines.append('{}_stage_seconds_max{} {:.6f}'.format(ns, labels, peak))
+        previous = None
+        for (name, key), value in counters:
+            if name != previous:
+                lines.append('# TYPE {}_{}_total counter'.format(ns, name))
+                previous = name
+            lines.append('{}_{}_total{} {}'.format(ns, name, _labelstr(key), value))
+        for name, value in sorted(self.rates().items()):
+            lines.append('# TYPE {}_{} gauge'.format(ns, name))
+            lines.append('{}_{} {:.4f}'.format(ns, name, value))
+        with open(path, 'w') as outfile:
+            outfile.write('\n'.join(lines) + '\n')
+
+
+METRICS = Metrics()
+
+
+def timed(stage, **labels):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with METRICS.timer(stage, **labels):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextlib.contextmanager
+def profiled(path=None):
+    """Profiles the enclosed block with cProfile and dumps stats to path; no-op without a path"""
+    if not path:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
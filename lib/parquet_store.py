@@ -0,0 +1,213 @@
+"""
+parquet_store.py:
+    Local columnar store for scraped rows - the writetodb=False alternative
+    to Postgres. Each table is a hive-partitioned Parquet dataset:
+
+        <rootdir>/<table>/commodity=<commodity>/year=<year>/month=<month>/part-*.parquet
+
+    Every write appends a new part file to each partition it touches;
+    compaction folds a partition's parts into one file, dropping rows whose
+    primary key was already stored, as the DB's insert does. Reads push
+    commodity and date filters down to partition pruning and Parquet
+    row-group statistics, and read only the columns asked for, so a query
+    touches a few files rather than the whole history
+
+    Tables without a date, like location_map, are stored as a single file
+
+    Needs pyarrow
+
+    ParquetStore (cls): Appends, compacts, and reads partitioned tables
+
+Usage:
+    python -m lib.parquet_store data/parquet/          # compacts every partition
+"""
+
+import sys
+import time
+import uuid
+import shutil
+import pathlib
+import urllib.parse
+
+import pandas as pd
+
+from lib.metrics import METRICS, timed
+from lib.validation import KEYS
+
+PARTITIONS = ['commodity', 'year', 'month']
+PARTITION_GLOB = 'commodity=*/year=*/month=*/part-*.parquet'
+
+
+def partition_dir(commodity, year, month):
+    return 'commodity={}/year={}/month={}'.format(urllib.parse.quote(str(commodity), safe=''), year, month)
+
+
+
+class ParquetStore(object):
+    """
+    Appends, compacts, and reads partitioned tables
+
+    Args:
+        rootdir (str): Directory the store lives in
+        max_parts (int): Part files a partition can collect before appends compact it
+
+    Usage:
+        ps = ParquetStore('data/parquet/')
+        ps.append('prices', rows)
+        ps.read('prices', ['Kinnow'], '2018-12-01', '2018-12-31', columns=['date', 'market', 'modal_price'])
+        ps.compact('prices')
+        ps.put('location_map', lm)
+    """
+    def __init__(self, rootdir='data/parquet/', max_parts=20):
+        self.rootdir = pathlib.Path(rootdir)
+        self.max_parts = max_parts
+
+
+    def table_dir(self, table):
+        return self.rootdir/table
+
+
+    @staticmethod
+    def to_arrow(df):
+        import pyarrow as pa
+        if 'date' not in df:
+            return pa.Table.from_pandas(df, preserve_index=False)
+        table = pa.Table.from_pandas(df.assign(date=pd.to_datetime(df['date'])), preserve_index=False)
+        i = table.schema.get_field_index('date')
+        return table.set_column(i, 'date', table['date'].cast(pa.date32()))
+
+
+    def write_part(self, path, df, stamp=None):
+        """Part names sort in write order, so reads see older rows first"""
+        import pyarrow.parquet as pq
+        path.mkdir(parents=True, exist_ok=True)
+        stamp = time.time_ns() if stamp is None else stamp
+        name = 'part-{:020d}-{}.parquet'.format(stamp, uuid.uuid4().hex[:8])
+        pq.write_table(self.to_arrow(df), path/name)
+        return path/name
+
+
+    @timed('parquet_append')
+    def append(self, table, rows):
+        """Appends rows, one new part per partition; compacts partitions with too many parts"""
+        df = pd.DataFrame(rows)
+        if df.empty:
+            return
+        dates = pd.to_datetime(df['date'])
+        df = df.assign(year=dates.dt.year, month=dates.dt.month)
+        for (commodity, year, month), g in df.groupby(PARTITIONS):
+            path = self.table_dir(table)/partition_dir(commodity, year, month)
+            self.write_part(path, g.drop(columns=PARTITIONS))
+            if len(list(path.glob('part-*.parquet'))) > self.max_parts:
+                self.compact_partition(table, path)
+        METRICS.incr('parquet_rows', len(df), table=table)
+
+
+    def compact_partition(self, table, path):
+        """
+        Rewrites a partition's parts as one file, keeping the first row
+        stored for each primary key. The new file is in place before the old
+        parts go, so readers never miss rows
+        """
+        import pyarrow.parquet as pq
+        parts = sorted(path.glob('part-*.parquet'))
+        if len(parts) < 2:
+            return 0
+        df = pd.concat([pq.read_table(p).to_pandas() for p in parts], ignore_index=True)
+        keys = [k for k in KEYS.get(table, []) if k not in PARTITIONS and k in df]
+        if keys:
+            df = df.drop_duplicates(keys, keep='first')
+        df = df.sort_values([k for k in ['date', 'state', 'district', 'market'] if k in df])
+        tmp = path/'.compacting'
+        if tmp.exists():
+            shutil.rmtree(tmp)
+        # stamped 0 so it sorts ahead of parts appended after it
+        new = self.write_part(tmp, df, stamp=0)
+        new.rename(path/new.name)
+        tmp.rmdir()
+        for p in parts:
+            p.unlink()
+        return len(parts)
+
+
+    @timed('parquet_compact')
+    def compact(self, table=None):
+        """Compacts every partition of table, or of every table"""
+        tables = [table] if table else [p.name for p in self.rootdir.iterdir() if p.is_dir()]
+        merged = 0
+        for t in tables:
+            for path in sorted({p.parent for p in self.table_dir(t).glob(PARTITION_GLOB)}):
+                merged += self.compact_partition(t, path)
+        print('Compacted {} part files'.format(merged))
+        return merged
+
+
+    def put(self, table, df):
+        """Stores an unpartitioned table, replacing it"""
+        import pyarrow.parquet as pq
+        path = self.table_dir(table)
+        path.mkdir(parents=True, exist_ok=True)
+        pq.write_table(self.to_arrow(df), path/'data.parquet')
+
+
+    def exists(self, table):
+        return self.table_dir(table).exists()
+
+
+    @timed('parquet_read')
+    def read(self, table, commodities=None, start=None, end=None, columns=None, filters=None):
+        """
+        Rows of table, filtered on commodity and date range; only matching
+        partitions and row groups are read
+
+        Args:
+            table (str): Table to read
+            commodities (list): [Optional] Commodities to keep
+            start (str): [Optional] First date to keep
+            end (str): [Optional] Last date to keep
+            columns (list): [Optional] Columns to read; defaults to all
+            filters (dict): [Optional] Further column == value filters, e.g. {'state': 'Punjab'}
+        """
+        import pyarrow as pa
+        import pyarrow.dataset as ds
+        path = self.table_dir(table)
+        if not path.exists():
+            return pd.DataFrame(columns=columns or [])
+        if (path/'data.parquet').exists():
+            return pd.read_parquet(path/'data.parquet', columns=columns)
+        schema = pa.schema([('commodity', pa.string()), ('year', pa.int32()), ('month', pa.int32())])
+        dataset = ds.dataset(str(path), format='parquet',
+                             partitioning=ds.partitioning(schema, flavor='hive'))
+        conditions = []
+        if commodities is not None:
+            conditions.append(ds.field('commodity').isin(list(commodities)))
+        # year and month prune partitions; date prunes row groups
+        year, month, date = ds.field('year'), ds.field('month'), ds.field('date')
+        if start is not None:
+            day = pd.to_datetime(start).date()
+            conditions.append((year > day.year) | ((year == day.year) & (month >= day.month)))
+            conditions.append(date >= pa.scalar(day, pa.date32()))
+        if end is not None:
+            day = pd.to_datetime(end).date()
+            conditions.append((year < day.year) | ((year == day.year) & (month <= day.month)))
+            conditions.append(date <= pa.scalar(day, pa.date32()))
+        for col, value in (filters or {}).items():
+            conditions.append(ds.field(col) == value)
+        condition = None
+        for c in conditions:
+            condition = c if condition is None else condition & c
+        read = columns
+        if columns is not None:
+            keys = [k for k in KEYS.get(table, []) if k in dataset.schema.names]
+            read = list(dict.fromkeys(columns + keys))
+        df = dataset.to_table(columns=read, filter=condition).to_pandas()
+        df = df.drop(columns=[c for c in ['year', 'month'] if c in df and c not in (columns or [])])
+        keys = [k for k in KEYS.get(table, []) if k in df]
+        if keys:
+            # appended parts can repeat a key until they're compacted
+            df = df.drop_duplicates(keys, keep='first')
+        return df[columns].reset_index(drop=True) if columns is not None else df.reset_index(drop=True)
+
+
+if __name__ == "__main__":
+    ParquetStore(sys.argv[1] if len(sys.argv) > 1 else 'data/parquet/').compact()
@@ -0,0 +1,814 @@
+"""
+pipeline.py:
+    The stages every scraper is assembled from (see lib/scrapers.py)
+        - fetchers drive the search form and return page source
+        - parsers turn page source into rows; they're plain functions of
+          the source, so they can be timed, tested, or run in a pool apart
+          from any browser
+        - sinks store parsed rows
+
+    Any fetcher works with any parser and sink, so a speed-up to one stage
+    applies to every scrape type. Fetchers can record the pages they serve,
+    and ReplayFetcher plays recordings back, so parsing and writing can be
+    re-run and benchmarked without the site
+
+    Nothing heavy is imported at module load: Selenium is only imported by
+    SeleniumFetcher, urllib by HTTPFetcher, and pandas and SQLAlchemy by the
+    sinks that use them
+
+    FETCHERS
+    SeleniumFetcher (cls): Drives the search form in headless Chrome
+    HTTPFetcher (cls): Submits the search form over plain HTTP, without a browser
+    ReplayFetcher (cls): Serves pages recorded by another fetcher
+
+    PARSERS
+    PageParser (cls): Reads spans, result table rows, and forms from page source
+    PriceTableParser (cls): Price records from a results page
+    ArrivalsParser (cls): Market arrivals from an expanded arrivals page
+
+    SINKS
+    DBSink (cls): Validates and inserts rows, and updates what's derived from them
+    JSONSink (cls): Writes each batch to a json file
+    ParquetSink (cls): Appends each batch to a partitioned Parquet store
+    CallbackSink (cls): Hands each batch to a function, e.g. a shared writer
+"""
+
+import os
+import re
+import json
+import time
+import pathlib
+import datetime
+from html.parser import HTMLParser
+
+from lib.fingerprints import fingerprint
+from lib.metrics import METRICS, timed
+
+URL = os.environ.get('AGMARKNET_URL', 'http://agmarknet.gov.in/')
+WAIT_SCALE = float(os.environ.get('AGMARKNET_WAIT_SCALE', 1))
+CHROME_VERBOSE = os.environ.get('AGMARKNET_CHROME_VERBOSE') == '1'
+FETCHER = os.environ.get('AGMARKNET_FETCHER', 'selenium')
+PAGE_TIMEOUT = float(os.environ.get('AGMARKNET_PAGE_TIMEOUT', 120))
+HEADING_ID = 'cphBody_LabComName'
+TABLE_CLASS = 'tableagmark_new'
+
+
+def wait(seconds):
+    time.sleep(seconds * WAIT_SCALE)
+
+
+def parse_date(text):
+    """Parses agmarknet's '01 Dec 2018' dates without loading pandas; other formats fall back to it"""
+    try:
+        return datetime.datetime.strptime(text, '%d %b %Y')
+    except ValueError:
+        import pandas as pd
+        return pd.to_datetime(text)
+
+
+def chrome_driver_reg(driver_dir):
+    from selenium import webdriver
+    from selenium.webdriver.chrome.options import Options
+    chrome_options = Options()
+    chrome_options.add_argument("--headless")
+    return webdriver.Chrome(executable_path=driver_dir, options=chrome_options)
+
+
+def chrome_driver_lambda(verbose=CHROME_VERBOSE):
+    """Headless Chromium for Lambda. Verbose logging costs startup time and log volume, so it's opt-in"""
+    from selenium import webdriver
+    chrome_options = webdriver.ChromeOptions()
+    chrome_options.add_argument('--headless')
+    chrome_options.add_argument('--no-sandbox')
+    chrome_options.add_argument('--disable-gpu')
+    chrome_options.add_argument('--window-size=1280x1696')
+    chrome_options.add_argument('--user-data-dir=/tmp/user-data')
+    chrome_options.add_argument('--hide-scrollbars')
+    if verbose:
+        chrome_options.add_argument('--enable-logging')
+        chrome_options.add_argument('--log-level=0')
+        chrome_options.add_argument('--v=99')
+    chrome_options.add_argument('--single-process')
+    chrome_options.add_argument('--disable-extensions')
+    chrome_options.add_argument('--disable-dev-shm-usage')
+    chrome_options.add_argument('--data-path=/tmp/data-path')
+    chrome_options.add_argument('--ignore-certificate-errors')
+    chrome_options.add_argument('--homedir=/tmp')
+    chrome_options.add_argument('--disk-cache-dir=/tmp/cache-dir')
+    chrome_options.add_argument('user-agent=Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/61.0.3163.100 Safari/537.36')
+    chrome_options.binary_location = os.getcwd() + "/bin/headless-chromium"
+    return webdriver.Chrome(chrome_options=chrome_options)
+
+
+
+## --------------------------
+## Parsers
+## --------------------------
+
+class PageParser(HTMLParser):
+    """
+    Reads what the scrapers need from page source in one pass: span text by
+    id, rows of span text in the results table, and forms with their fields
+
+    Usage:
+        page = PageParser.read(source)
+        page.spans['cphBody_LabComName']
+        page.rows           # [[cell, ...], ...]
+    """
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.spans = {}
+        self.span_order = []
+        self.rows = []
+        self.forms = []
+        self.tables = 0
+        self.row = None
+        self.span = None
+        self.select = None
+        self.option = None
+
+
+    @classmethod
+    def read(cls, source):
+        page = cls()
+        page.feed(source)
+        page.close()
+        return page
+
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == 'table':
+            # counts tables from the results table inwards
+            if self.tables or TABLE_CLASS in (attrs.get('class') or '').split():
+                self.tables += 1
+        elif tag == 'tr' and self.tables:
+            self.row = []
+        elif tag == 'span':
+            self.span = [attrs.get('id'), '']
+        elif tag == 'form':
+            self.forms.append({'action': attrs.get('action') or '', 'method': (attrs.get('method') or 'get').lower(),
+                               'fields': []})
+        elif tag in ('input', 'select') and self.forms:
+            field = dict(attrs, tag=tag, options=[])
+            field.setdefault('value', '')
+            self.forms[-1]['fields'].append(field)
+            if tag == 'select':
+                self.select = field
+        elif tag == 'option' and self.select is not None:
+            self.option = [attrs.get('value'), '', 'selected' in attrs]
+
+
+    def handle_endtag(self, tag):
+        if tag == 'table' and self.tables:
+            self.tables -= 1
+        elif tag == 'tr' and self.row is not None:
+            if self.row:
+                self.rows.append(self.row)
+            self.row = None
+        elif tag == 'span' and self.span:
+            sid, text = self.span[0], self.span[1].strip()
+            if sid:
+                self.spans[sid] = text
+                self.span_order.append((sid, text))
+            if self.row is not None:
+                self.row.append(text)
+            self.span = None
+        elif tag == 'option' and self.option:
+            value, text, selected = self.option
+            text = text.strip()
+            self.select['options'].append((text if value is None else value, text))
+            if selected or len(self.select['options']) == 1:
+                self.select['value'] = text if value is None else value
+            self.option = None
+        elif tag == 'select':
+            self.select = None
+
+
+    def handle_data(self, data):
+        if self.span is not None:
+            self.span[1] += data
+        if self.option is not None:
+            self.option[1] += data
+
+
+    def form_with(self, field_id):
+        for form in self.forms:
+            if any(f.get('id') == field_id for f in form['fields']):
+                return form
+
+
+    def images(self, src):
+        """(form, field) for image inputs whose src contains src"""
+        return [(form, f) for form in self.forms for f in form['fields']
+                if f.get('type') == 'image' and src in (f.get('src') or '')]
+
+
+def parse_heading(source):
+    match = re.search(r'<span[^>]*id="{}"[^>]*>(.*?)</span>'.format(HEADING_ID), source, re.S)
+    return match.group(1).strip() if match else ''
+
+
+def pager_page(source, pager):
+    """
+    The page a GridView's numbered pager shows as current, or None if the
+    source has no pager posting back to pager. GridView renders the other
+    pages as __doPostBack(pager, 'Page$<n>') links and the current one as
+    a bare span, in the same row
+    """
+    quote = "(?:'|&#39;|&#x27;)"
+    links = list(re.finditer(r"__doPostBack\({0}{1}{0},\s*{0}Page\$\w+{0}\)".format(quote, re.escape(pager)),
+                             source))
+    if not links:
+        return None
+    start = source.rfind('<tr', 0, links[0].start())
+    end = source.find('</tr>', links[-1].end())
+    current = re.findall(r'<span[^>]*>\s*(\d+)\s*</span>', source[start:end if end >= 0 else len(source)])
+    return int(current[0]) if len(current) == 1 else None
+
+
+
+class PriceTableParser(object):
+    """
+    Price records from a results page
+
+    Usage:
+        ptp = PriceTableParser()
+        ptp.parse(source, {'state': 'Punjab'})
+        ptp.fingerprint(source)     # changes whenever the results table does
+    """
+    name = 'price_table'
+
+    @staticmethod
+    def table(source):
+        """Source of the results table alone"""
+        start = source.find('class="{}"'.format(TABLE_CLASS))
+        if start < 0:
+            return ''
+        start = source.rfind('<table', 0, start)
+        end = source.find('</table>', start)
+        return source[start:end + len('</table>') if end >= 0 else len(source)]
+
+
+    def fingerprint(self, source):
+        return fingerprint(self.table(source))
+
+
+    @timed('extract_prices')
+    def parse(self, source, query):
+        records = []
+        for td in PageParser.read(self.table(source)).rows:
+            if len(td) < 9:
+                continue
+            records.append({
+                'commodity': td[2],
+                'date': parse_date(td[8]),
+                'state': query['state'],
+                'district': td[0],
+                'market': td[1],
+                'grade': td[4],
+                'variety': td[3],
+                'max_price': float(td[6]),
+                'min_price': float(td[5]),
+                'modal_price': float(td[7])
+                })
+        return records
+
+
+    def count(self, source):
+        return sum(len(td) >= 9 for td in PageParser.read(self.table(source)).rows)
+
+
+
+class ArrivalsParser(object):
+    """
+    Market arrivals from an arrivals page with every district expanded
+
+    Usage:
+        ArrivalsParser().parse(source, {'commodity': 'Kinnow', 'state': 'Punjab', 'start': '01-Dec-2018'})
+    """
+    name = 'arrivals'
+
+    @timed('extract_quantities')
+    def parse(self, source, query):
+        spans = PageParser.read(source).span_order
+        markets = [text for sid, text in spans if 'MarketName' in sid]
+        quantities = [text for sid, text in spans if 'Lab2Arrival' in sid]
+        return {
+            'commodity': query['commodity'],
+            'date': query['start'],
+            'state': query['state'],
+            'Arrivals': list(zip(markets, quantities))
+            }
+
+
+
+## --------------------------
+## Fetchers
+## --------------------------
+
+class Fetcher(object):
+    """
+    Base for fetchers. A fetcher opens the site, submits a search, and moves
+    through result pages; source() returns the current page. With record
+    set, every page served is also saved for ReplayFetcher
+
+    Args:
+        url (str): [Optional] Site to scrape; defaults to agmarknet
+        record (str): [Optional] Directory to record pages to
+    """
+    name = 'fetcher'
+    errors = (OSError,)
+
+    def __init__(self, url=None, record=None):
+        self.url = url or URL
+        self.record = record
+        self.page = 1
+        self.key = None
+        self.jumps = None
+        # set once a jump lands on the wrong page; jumps stay off for the fetcher's life
+        self.misjumped = False
+
+
+    def search_key(self, scrapetype, commodity, state, start, end):
+        return re.sub(r'[^\w-]+', '-', '_'.join([scrapetype, commodity, state, start, end]))
+
+
+    def start(self):
+        pass
+
+
+    def close(self):
+        pass
+
+
+    def search(self, scrapetype, commodity, state, start, end):
+        self.key = self.search_key(scrapetype, commodity, state, start, end)
+        self.page = 1
+        self.jumps = None
+        self.submit_search(scrapetype, commodity, state, start, end)
+
+
+    def source(self):
+        source = self.read()
+        if self.record:
+            path = pathlib.Path(self.record, self.key, '{}.html'.format(self.page))
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(source, encoding='utf-8')
+        return source
+
+
+    def options(self, field_id):
+        """Labels of a dropdown's options on the current page; empty if there's no such dropdown"""
+        for form in PageParser.read(self.read()).forms:
+            for f in form['fields']:
+                if f.get('id') == field_id:
+                    return [label for value, label in f['options']]
+        return []
+
+
+    def can_jump(self, pager):
+        """
+        Whether the results grid has a numbered pager posting back to pager,
+        showing the page we're on - so a jump can be checked. Sequential
+        moves click Next either way
+        """
+        if self.misjumped:
+            return False
+        if self.jumps is None:
+            self.jumps = self.check_jumps(pager)
+        return self.jumps
+
+
+    def check_jumps(self, pager):
+        return pager_page(self.read(), pager) == self.page
+
+
+    def landed(self, pager, page):
+        return pager_page(self.read(), pager) == page
+
+
+    @timed('page_fetch')
+    def next_page(self):
+        self.click_next()
+        self.page += 1
+
+
+    @timed('page_fetch')
+    def jump_to(self, pager, page):
+        """
+        Posts back for page, and checks the pager shows it. False if it
+        doesn't - the fetcher is then somewhere unknown, and won't jump again
+        """
+        self.postback(pager, 'Page${}'.format(page))
+        if not self.landed(pager, page):
+            self.misjumped = True
+            METRICS.incr('misjumps')
+            return False
+        self.page = page
+        return True
+
+
+
+class SeleniumFetcher(Fetcher):
+    """
+    Drives the search form in headless Chrome
+
+    Args:
+        url (str): [Optional] Site to scrape; defaults to agmarknet
+        serverless (bool): Lambda execution flag - uses the bundled headless Chromium
+        driver_dir (str): Chromedriver path when not serverless
+        record (str): [Optional] Directory to record pages to
+    """
+    name = 'selenium'
+
+    def __init__(self, url=None, serverless=True, driver_dir=None, record=None):
+        super().__init__(url, record)
+        self.serverless = serverless
+        self.driver_dir = driver_dir
+        self.driver = None
+
+
+    @property
+    def errors(self):
+        from selenium.common.exceptions import WebDriverException
+        return (WebDriverException,)
+
+
+    @timed('driver_startup')
+    def start(self):
+        if self.serverless:
+            self.driver = chrome_driver_lambda()
+        else:
+            self.driver = chrome_driver_reg(self.driver_dir)
+        # a hung page raises a TimeoutException rather than blocking forever
+        self.driver.set_page_load_timeout(PAGE_TIMEOUT)
+        self.driver.set_script_timeout(PAGE_TIMEOUT)
+
+
+    def close(self):
+        if self.driver is not None:
+            try:
+                self.driver.quit()
+            except Exception:
+                pass
+            self.driver = None
+
+
+    def open(self):
+        self.driver.get(self.url)
+
+
+    def select(self, element_id, text):
+        from selenium.webdriver.support.ui import Select
+        Select(self.driver.find_element_by_id(element_id)).select_by_visible_text(text)
+
+
+    @timed('populate_dropdowns')
+    def submit_search(self, scrapetype, commodity, state, start, end):
+        from selenium.webdriver.common.keys import Keys
+        self.select('ddlArrivalPrice', scrapetype)
+        self.select('ddlCommodity', commodity)
+        self.select('ddlState', state)
+        wait(3)
+        startdate = self.driver.find_element_by_id('txtDate')
+        startdate.clear()
+        startdate.send_keys(start)
+        endate = self.driver.find_element_by_id('txtDateTo')
+        endate.clear()
+        endate.send_keys(end)
+        wait(3)
+        endate.send_keys(Keys.ENTER)
+        wait(3)
+
+
+    def read(self):
+        return self.driver.page_source
+
+
+    def click_next(self):
+        from selenium.webdriver.common.keys import Keys
+        next_icon = self.driver.find_element_by_xpath('//input[contains(@src,"Next.png")]')
+        next_icon.send_keys(Keys.SPACE)
+        wait(5)
+
+
+    def postback(self, target, argument):
+        self.driver.execute_script('__doPostBack(arguments[0], arguments[1])', target, argument)
+        wait(5)
+
+
+    @timed('unfurl_quantities')
+    def expand_all(self):
+        from selenium.webdriver.common.keys import Keys
+        from selenium.common.exceptions import NoSuchElementException, TimeoutException
+        deadline = time.monotonic() + PAGE_TIMEOUT
+        while True:
+            try:
+                plus_icon = self.driver.find_element_by_xpath('//input[contains(@src,"plus.png")]')
+                plus_icon.send_keys(Keys.SPACE)
+                wait(1)
+            except NoSuchElementException:
+                break
+            if time.monotonic() > deadline:
+                # an icon that doesn't expand would otherwise be clicked forever
+                raise TimeoutException('markets still collapsed after {}s'.format(PAGE_TIMEOUT))
+
+
+
+class HTTPFetcher(Fetcher):
+    """
+    Submits the search form over plain HTTP, without a browser. Forms are
+    resubmitted with all their fields, the way a browser would, and the
+    inline handlers the site's buttons use - setting a field's value, or
+    __doPostBack - are emulated. Much cheaper than a browser per session,
+    so many more can run at once
+
+    Args:
+        url (str): [Optional] Site to scrape; defaults to agmarknet
+        timeout (float): Seconds to wait for each response
+        record (str): [Optional] Directory to record pages to
+    """
+    name = 'http'
+    MAX_EXPANSIONS = 1000
+
+    def __init__(self, url=None, timeout=60, record=None):
+        super().__init__(url, record)
+        self.timeout = timeout
+        self.html = ''
+        self.parsed = None
+        self.location = self.url
+
+
+    def start(self):
+        import urllib.request
+        from http.cookiejar import CookieJar
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(CookieJar()))
+
+
+    def request(self, url, data=None):
+        import urllib.parse
+        if data is not None:
+            data = urllib.parse.urlencode(data).encode('utf-8')
+        with self.opener.open(url, data, timeout=self.timeout) as response:
+            self.location = response.geturl()
+            charset = response.headers.get_content_charset() or 'utf-8'
+            self.html = response.read().decode(charset, errors='replace')
+        self.parsed = None
+
+
+    def parse(self):
+        if self.parsed is None:
+            self.parsed = PageParser.read(self.html)
+        return self.parsed
+
+
+    def submit(self, form, values=None, button=None):
+        """Submits form with its current field values, overridden by values (by field id)"""
+        import urllib.parse
+        values = values or {}
+        data = []
+        for f in form['fields']:
+            name = f.get('name')
+            if not name or f.get('type') in ('submit', 'image', 'button', 'reset'):
+                continue
+            if f.get('type') in ('checkbox', 'radio') and 'checked' not in f:
+                continue
+            data.append((name, values.get(f.get('id'), f['value'])))
+        if button and button.get('name'):
+            if button.get('type') == 'image':
+                data += [(button['name'] + '.x', '0'), (button['name'] + '.y', '0')]
+            else:
+                data.append((button['name'], button['value']))
+        url = urllib.parse.urljoin(self.location, form['action'])
+        if form['method'] == 'post':
+            self.request(url, data)
+        else:
+            self.request(url + '?' + urllib.parse.urlencode(data))
+
+
+    def option(self, form, field_id, text):
+        for f in form['fields']:
+            if f.get('id') == field_id:
+                for value, label in f['options']:
+                    if label == text:
+                        return value
+                raise ValueError('No option {} in {}'.format(text, field_id))
+        raise ValueError('No field {}'.format(field_id))
+
+
+    def open(self):
+        self.request(self.url)
+
+
+    @timed('populate_dropdowns')
+    def submit_search(self, scrapetype, commodity, state, start, end):
+        form = self.parse().form_with('ddlCommodity')
+        if form is None:
+            raise ValueError('No search form at {}'.format(self.location))
+        values = {
+            'ddlArrivalPrice': self.option(form, 'ddlArrivalPrice', scrapetype),
+            'ddlCommodity': self.option(form, 'ddlCommodity', commodity),
+            'ddlState': self.option(form, 'ddlState', state),
+            'txtDate': start,
+            'txtDateTo': end,
+            }
+        button = next((f for f in form['fields'] if f.get('type') == 'submit'), None)
+        self.submit(form, values, button)
+
+
+    def read(self):
+        return self.html
+
+
+    def click(self, src):
+        """Emulates clicking the first image input whose src contains src; False if there isn't one"""
+        images = self.parse().images(src)
+        if not images:
+            return False
+        form, button = images[0]
+        values = dict(re.findall(r"getElementById\('([^']+)'\)\.value\s*=\s*'?([^;'\"]*)'?",
+                                 button.get('onclick') or ''))
+        self.submit(form, values, button)
+        return True
+
+
+    def click_next(self):
+        if not self.click('Next.png'):
+            raise ValueError('No next page after page {}'.format(self.page))
+
+
+    def postback(self, target, argument):
+        form = self.parse().form_with('__EVENTARGUMENT')
+        if form is None:
+            raise ValueError('Results page has no postback form')
+        self.submit(form, {'__EVENTTARGET': target, '__EVENTARGUMENT': argument})
+
+
+    @timed('unfurl_quantities')
+    def expand_all(self):
+        for _ in range(self.MAX_EXPANSIONS):
+            if not self.click('plus.png'):
+                return
+
+
+
+class ReplayFetcher(Fetcher):
+    """
+    Serves pages recorded by another fetcher's record option, so parsing
+    and writing can be re-run without the site
+
+    Args:
+        directory (str): Directory pages were recorded to
+    """
+    name = 'replay'
+    errors = (OSError,)
+
+    def __init__(self, directory='data/pages/'):
+        super().__init__(None, None)
+        self.directory = directory
+
+
+    def open(self):
+        pass
+
+
+    def submit_search(self, scrapetype, commodity, state, start, end):
+        pass
+
+
+    def read(self):
+        return pathlib.Path(self.directory, self.key, '{}.html'.format(self.page)).read_text(encoding='utf-8')
+
+
+    def check_jumps(self, pager):
+        # recordings are kept by page number, so any page can be served
+        return True
+
+
+    def landed(self, pager, page):
+        return True
+
+
+    def click_next(self):
+        pass
+
+
+    def postback(self, target, argument):
+        pass
+
+
+    def expand_all(self):
+        pass
+
+
+
+def make_fetcher(name, url=None, serverless=True, driver_dir=None, record=None):
+    """A fetcher by name - 'selenium', 'http', or 'replay' - or fetcher itself if it's already one"""
+    if isinstance(name, Fetcher):
+        return name
+    if name == 'http':
+        return HTTPFetcher(url, record=record)
+    if name == 'replay':
+        return ReplayFetcher()
+    return SeleniumFetcher(url, serverless, driver_dir, record)
+
+
+
+## --------------------------
+## Sinks
+## --------------------------
+
+class DBSink(object):
+    """
+    Inserts prices or arrivals that pass validation (see lib/validation.py),
+    quarantining the rest. Then it marks their days in the availability
+    index (lib/availability.py), refreshes the latest-market snapshot
+    (lib/snapshot.py), and scores them for anomalies (lib/anomalies.py)
+
+    Args:
+        engine (engine): SQLAlchemy engine
+    """
+    name = 'db'
+
+    def __init__(self, engine):
+        self.engine = engine
+
+
+    def write(self, table, rows, key=None):
+        import lib.helpers as h
+        from lib.validation import BatchValidator
+        from lib.availability import AvailabilityIndex
+        from lib.snapshot import MarketSnapshot
+        from lib.anomalies import AnomalyDetector
+        with METRICS.timer('sink_write', sink=self.name, table=table):
+            rows = BatchValidator(self.engine).filter(table, rows)
+            h.insert_rows(self.engine, table, rows)
+            AvailabilityIndex(self.engine).update(table, rows)
+            MarketSnapshot(self.engine).update(table, rows)
+            AnomalyDetector(self.engine).update(table, rows)
+
+
+
+class JSONSink(object):
+    """
+    Writes each batch to <rootdir>/<table>_<key>.json
+
+    Args:
+        rootdir (str): Output directory
+    """
+    name = 'json'
+
+    def __init__(self, rootdir='data/'):
+        self.rootdir = rootdir
+
+
+    def write(self, table, rows, key):
+        with METRICS.timer('sink_write', sink=self.name, table=table):
+            path = pathlib.Path(self.rootdir)
+            path.mkdir(parents=True, exist_ok=True)
+            with open(path/'{}_{}.json'.format(table, key), 'w') as outfile:
+                json.dump(rows, outfile, default=str)
+
+
+
+class ParquetSink(object):
+    """
+    Appends valid rows to a partitioned Parquet store - see
+    lib/parquet_store.py; invalid rows are dropped. Needs pyarrow
+
+    Args:
+        rootdir (str): Store directory
+    """
+    name = 'parquet'
+
+    def __init__(self, rootdir='data/parquet/'):
+        self.rootdir = rootdir
+        self.store = None
+
+
+    def write(self, table, rows, key):
+        from lib.parquet_store import ParquetStore
+        from lib.validation import BatchValidator
+        if self.store is None:
+            self.store = ParquetStore(self.rootdir)
+        with METRICS.timer('sink_write', sink=self.name, table=table):
+            self.store.append(table, BatchValidator().filter(table, rows))
+
+
+
+class CallbackSink(object):
+    """
+    Hands each batch to func(table, rows)
+
+    Args:
+        func (func): Called with each batch
+    """
+    name = 'callback'
+
+    def __init__(self, func):
+        self.func = func
+
+
+    def write(self, table, rows, key):
+        self.func(table, rows)
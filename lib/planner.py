@@ -0,0 +1,127 @@
+"""
+planner.py:
+    Splits long price scrapes into date-range chunks of roughly equal size.
+    Expected rows per day are estimated per state and month of year from rows
+    already in the DB, so a chunk spans a few days at the height of the
+    season and weeks or months outside it. Each chunk targets a set number
+    of result pages, so a backfill of any length becomes evenly sized jobs
+    that AsyncScrapeRunner can run in parallel
+
+    Arrivals stay daily - the site reports arrivals one day per query
+
+    ChunkPlanner (cls): Plans date-range chunks from historical row density
+"""
+
+import math
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+import lib.helpers as h
+from lib.async_scraper import ScrapeJob
+
+
+class ChunkPlanner(object):
+    """
+    Plans date-range chunks from historical row density
+
+    Args:
+        engine (engine): [Optional] SQLAlchemy engine; defaults to helpers.db_connect()
+        target_pages (int): Result pages to aim for per chunk
+        rows_per_page (int): Rows on a result page
+        lookback_days (int): History used to estimate density
+        max_days (int): Longest chunk, for stretches with little or no history
+        default_rows (float): Rows per day assumed where there's no history at all
+
+    Usage:
+        cp = ChunkPlanner(target_pages=20)
+        cp.chunks('Kinnow', 'Punjab', '2016-01-01', '2018-12-31')   # [(start, end), ...]
+        cp.plan(jobs)                                               # ScrapeJobs, split
+    """
+    def __init__(self, engine=None, target_pages=20, rows_per_page=50, lookback_days=3*365,
+                 max_days=92, default_rows=50):
+        self.engine = engine
+        self.target_pages = target_pages
+        self.rows_per_page = rows_per_page
+        self.lookback_days = lookback_days
+        self.max_days = max_days
+        self.default_rows = default_rows
+        self.densities = {}
+
+
+    def connect(self):
+        if not self.engine:
+            self.engine = h.db_connect()
+
+
+    def load_density(self, commodity):
+        """Mean rows per calendar day, by state and month of year"""
+        if commodity in self.densities:
+            return self.densities[commodity]
+        self.connect()
+        since = pd.to_datetime('today').normalize() - pd.Timedelta(days=self.lookback_days)
+        query = text('select state, date, count(*) as n from prices '
+                     'where commodity = :commodity and date >= :since group by state, date')
+        with self.engine.connect() as conn:
+            counts = pd.read_sql(query, con=conn, params=dict(commodity=commodity, since=str(since.date())))
+        if counts.empty:
+            density = pd.DataFrame()
+        else:
+            counts['date'] = pd.to_datetime(counts['date'])
+            days = pd.date_range(since, pd.to_datetime('today').normalize(), freq='D')
+            daily = counts.pivot_table(index='date', columns='state', values='n', aggfunc='sum')
+            daily = daily.reindex(days).fillna(0)
+            density = daily.groupby(daily.index.month).mean().T
+        self.densities[commodity] = density
+        return density
+
+
+    def daily_rows(self, commodity, state, start, end):
+        """Expected rows for each day from start to end"""
+        days = pd.date_range(start, end, freq='D')
+        density = self.load_density(commodity)
+        if state in density.index:
+            by_month = density.loc[state]
+        elif len(density):
+            by_month = density.median()
+        else:
+            by_month = pd.Series(self.default_rows, index=range(1, 13))
+        return pd.Series(by_month.reindex(days.month).fillna(0).values, index=days)
+
+
+    def chunks(self, commodity, state, start, end):
+        """(start, end) pairs covering start..end, each expected to fill about target_pages"""
+        daily = self.daily_rows(commodity, state, start, end)
+        total = daily.sum()
+        n = max(1, int(math.ceil(total / (self.target_pages * self.rows_per_page))))
+        cum = daily.cumsum().values
+        ends = np.searchsorted(cum, total * np.arange(1, n) / n)
+        ends = sorted(set(ends[ends < len(daily) - 1]) | {len(daily) - 1})
+        chunks, first = [], 0
+        for last in ends:
+            # cap long, sparse stretches, splitting them evenly
+            pieces = int(math.ceil((last - first + 1) / self.max_days))
+            for piece in np.array_split(np.arange(first, last + 1), pieces):
+                chunks.append((str(daily.index[piece[0]].date()), str(daily.index[piece[-1]].date())))
+            first = last + 1
+        return chunks
+
+
+    def split(self, job):
+        if job.datatype == 'arrivals':
+            return job.split_days()
+        if job.pages:
+            return [job]
+        return [ScrapeJob(job.datatype, job.commodity, job.state, start, end)
+                for start, end in self.chunks(job.commodity, job.state, job.start, job.end)]
+
+
+    def plan(self, jobs):
+        planned = []
+        for job in jobs:
+            split = self.split(job)
+            if job.datatype == 'prices':
+                print('Planned {} chunks for {}'.format(len(split), job))
+            planned.extend(split)
+        return planned
@@ -17,6 +17,11 @@ plotters.py:
     TrendProcessor (cls): Processes market price and arrival trends for plotting
     TrendPlotter (cls): Plots market price and arrival trends
     Trends (cls): Wrapper - Pulls, processes, and plots market trends
+
+    SEASON COMPARISON
+    SeasonProcessor (cls): Aligns precomputed season aggregates by day of season
+    SeasonPlotter (cls): Plots the current season against prior seasons
+    SeasonTrends (cls): Wrapper - Pulls, processes, and plots season comparisons
 """
 
 import numpy as np
@@ -30,6 +35,12 @@ import plotly.figure_factory as ff
 from plotly.offline import download_plotlyjs, init_notebook_mode, plot, iplot
 
 import lib.db_puller as db
+from lib.metrics import timed
+from lib.availability import intervals, merge_intervals
+from lib.pushdown import PushdownQueries
+from lib.seasons import Season
+from lib.anomalies import exclude
+from lib import snapshot
 
 
 ## --------------------------
@@ -54,11 +65,12 @@ class DataAvailabilityProcessor(object):
     def restructure(self, f, i):
         # Improve readability
         fss = f[f[self.col]==i]
-        if len(fss) > 1:
+        if len(fss):
             fss['next_date'] = fss['date'].shift(-1)
             fss['data_gap'] = (fss['next_date'] - fss['date']).dt.days 
             ep = fss[fss['data_gap'] > 1]
-            ep['start_point'] = ep['next_date'].shift(1)
+            # the first run starts on the first day
+            ep['start_point'] = ep['next_date'].shift(1).fillna(fss['date'].iloc[0])
             ep = ep[[self.col,'start_point','date']].copy()
             lcr = self.extract_last_record(fss, ep)
             epf = pd.concat([ep, lcr])
@@ -69,7 +81,7 @@ class DataAvailabilityProcessor(object):
     
     
     def extract_last_record(self, fss, ep):
-        lcs = fss[fss['date'] >  ep['date'].max()]
+        lcs = fss[fss['date'] >  ep['date'].max()] if len(ep) else fss
         lcr = lcs[:1]
         lcr['next_date'] = lcs['date'].max()
         lcr.drop('data_gap', axis=1, inplace=True)
@@ -77,6 +89,7 @@ class DataAvailabilityProcessor(object):
         return lcr
     
     
+    @timed('prep_data', processor='DataAvailabilityProcessor')
     def prep_data(self):
         processed_dfs = []
         f = self.df[[self.col,'date']].drop_duplicates().sort_values([self.col,'date'])
@@ -101,34 +114,78 @@ class DataAvailabilityPlotter(DataAvailabilityProcessor):
         col (str): 'state' or 'district' - level of availability
         lm (df): state > district > market mappings
         state (str): [Optional] state to plot district data availability for
+        processed (df): [Optional] Precomputed intervals, e.g. from availability.intervals();
+            df and lm aren't needed when given
+        min_gap (int): Fewest days without data drawn as a gap; shorter gaps are bridged
+        batched (bool): [Optional] Draw each resource's intervals as one WebGL trace rather than
+            a gantt shape per interval; defaults to doing so above BATCH_INTERVALS intervals
     """
-    def __init__(self, datatype, df, lm, col, state=None):
+    BATCH_INTERVALS = 300
+
+    def __init__(self, datatype, df, lm, col, state=None, processed=None, min_gap=1, batched=None):
         self.datatype = datatype
         self.df = df
         self.col = col
         self.lm = lm
         self.state = state
+        self.intervals = processed
+        self.min_gap = min_gap
+        self.batched = batched
         
         
     def process_data(self):
-        processed = self.prep_data()
+        processed = self.prep_data() if self.intervals is None else self.intervals
         if self.state:
             processed = processed[processed['state'] == self.state]
             processed.reset_index(drop=True,inplace=True)
-        self.processed = processed
-
-           
-    def plotter(self):
+        self.processed = merge_intervals(processed, self.min_gap)
+
+
+    def gantt(self, title, colors):
+        return ff.create_gantt(self.processed, 
+                               title=title, 
+                               colors=colors, 
+                               index_col='Resource', group_tasks=True, 
+                               showgrid_x=True, showgrid_y=True)
+
+
+    def batched_gantt(self, title, colors):
+        """
+        Each resource's intervals as thick line segments in a single
+        trace, broken by gaps - one WebGL trace in place of a shape per
+        interval. Returned as a dict, like TrendPlotter's figures, since
+        go.Figure validates and copies every point. Segments run to the day
+        after Finish, so one-day intervals show
+        """
+        processed = self.processed
+        # first task at the top, as in create_gantt
+        tasks = sorted(processed['Task'].unique(), reverse=True)
+        rows = {task: i for i, task in enumerate(tasks)}
+        data = []
+        for resource, g in processed.groupby('Resource'):
+            start = np.datetime_as_string(pd.to_datetime(g['Start']).values.astype('datetime64[D]'))
+            finish = np.datetime_as_string(pd.to_datetime(g['Finish']).values.astype('datetime64[D]') + 1)
+            x = np.stack([start, finish, finish], axis=1).ravel()
+            y = np.empty(len(x), dtype=object)
+            y[0::3] = y[1::3] = g['Task'].map(rows).values
+            data.append(dict(type='scattergl', mode='lines', name=resource, x=x.tolist(), y=y.tolist(),
+                             text=np.repeat(g['Task'].values.astype(str), 3).tolist(), hoverinfo='x+text',
+                             line=dict(color=colors.get(resource), width=10)))
+        layout = dict(title=title, showlegend=False, height=max(600, 20*len(tasks) + 200),
+                      yaxis=dict(tickvals=list(range(len(tasks))), ticktext=tasks, range=[-1, len(tasks)]))
+        return dict(data=data, layout=layout)
+
+
+    def plotter(self, asFigure=False):
         colors = {'Available': '#191970'}
         title='Data Availability: {}'.format(self.datatype)
         if self.state:
             title = title + ' - {}'.format(self.state)
         
-        fig = ff.create_gantt(self.processed, 
-                              title=title, 
-                              colors=colors, 
-                              index_col='Resource', group_tasks=True, 
-                              showgrid_x=True, showgrid_y=True)
+        batched = self.batched
+        if batched is None:
+            batched = len(self.processed) > self.BATCH_INTERVALS
+        fig = self.batched_gantt(title, colors) if batched else self.gantt(title, colors)
         
         left_margin = (self.processed['Task'].str.len().max())*8
         start = str(pd.to_datetime(self.processed['Start'].min()).date())
@@ -151,23 +208,31 @@ class DataAvailabilityPlotter(DataAvailabilityProcessor):
                     ]))
         xaxis = dict(autorange=False, range=[start, end], rangeselector=rangeselector)
         fig['layout'].update(margin=go.Margin(l=left_margin), xaxis=xaxis)
+        if asFigure:
+            return fig
         iplot(fig)
         
     
-    def plot(self):
+    def plot(self, asFigure=False):
         self.process_data()
-        self.plotter()
+        return self.plotter(asFigure)
 
 
 class DataAvailability(object):
     """
     Wrapper - Pulls, processes, and plots data availability. plot() takes datatype, 
-    region level, and state arguments
+    region level, and state arguments. Reads the availability index (see
+    lib/availability.py) unless use_index is False, in which case coverage is
+    derived from raw prices and arrivals - inside the DB with pushdown, see
+    lib/pushdown.py
 
     Args:
         commodity (str): Commodity to see availability of
         start (str): Start date of availability evaluation period; defaults to Oct 2015
         end (str): End date of availability evaluation period; defaults to today
+        use_index (bool): Read the availability index rather than raw history
+        pushdown (bool): Without the index, aggregate in the DB rather than pulling raw rows;
+            ignored when reading a Parquet store
 
     Usage:
         da = DataAvailability()
@@ -176,11 +241,14 @@ class DataAvailability(object):
         da.plot('Arrivals', 'state')
         da.plot('Prices', 'district', 'Haryana')
         da.plot('Arrivals', 'district', 'Himachal Pradesh')
+        da.plot('Prices', 'district', min_gap=7)     # every district, bridging gaps under a week
     """
-    def __init__(self, commodity='Kinnow', start='2015-10-01', end=None):
+    def __init__(self, commodity='Kinnow', start='2015-10-01', end=None, use_index=True, pushdown=True):
         self.commodity = commodity
         self.start = start
         self.end = end
+        self.use_index = use_index
+        self.pushdown = pushdown and not db.PARQUET
         if not self.end:
             self.end = str(pd.to_datetime('today').date())
         self.get_data()
@@ -188,13 +256,26 @@ class DataAvailability(object):
         
     def get_data(self):
         d = db.DBPuller(self.commodity, self.start, self.end)
-        d.get_data()
-        self.prices, self.arrivals, self.lm = d.prices, d.arrivals, d.lm
+        if self.use_index:
+            d.get_availability()
+            self.availability = d.availability
+        elif self.pushdown:
+            self.queries = PushdownQueries(self.commodity, self.start, self.end)
+        else:
+            d.get_data()
+            self.prices, self.arrivals, self.lm = d.prices, d.arrivals, d.lm
         
     
-    def plot(self, datatype, col, state=None):
-        df = self.prices if datatype == 'Prices' else self.arrivals
-        dap = DataAvailabilityPlotter(datatype, df, self.lm, col, state)
+    def plot(self, datatype, col, state=None, min_gap=1, batched=None):
+        if self.use_index:
+            processed = intervals(self.availability, datatype.lower(), col, self.start, self.end)
+            dap = DataAvailabilityPlotter(datatype, None, None, col, state, processed, min_gap, batched)
+        elif self.pushdown:
+            processed = self.queries.availability(datatype.lower(), col)
+            dap = DataAvailabilityPlotter(datatype, None, None, col, state, processed, min_gap, batched)
+        else:
+            df = self.prices if datatype == 'Prices' else self.arrivals
+            dap = DataAvailabilityPlotter(datatype, df, self.lm, col, state, min_gap=min_gap, batched=batched)
         dap.plot()
 
 
@@ -271,6 +352,7 @@ class CurrentMarketProcessor(object):
         lm['r_quantity_l'] = lm['r_quantity_l'].round(2)
         return lm
 
+    @timed('prep_data', processor='CurrentMarketProcessor')
     def prep_data(self):
         self.update_dtypes()
         self.limit_to_recent()
@@ -280,6 +362,23 @@ class CurrentMarketProcessor(object):
         return self.latest_p, self.latest_a
 
 
+    @timed('prep_snapshot', processor='CurrentMarketProcessor')
+    def prep_snapshot(self, snapshot_p, snapshot_a):
+        """
+        As prep_data, from the latest_prices and latest_arrivals snapshot
+        (lib/snapshot.py) rather than raw rows; averages are over
+        snapshot.PERIOD rows, and tcutoff can't be more than snapshot.WINDOW
+        """
+        cutoff = (pd.to_datetime('today') - pd.Timedelta(days=self.tcutoff))
+        lp = snapshot.at_cutoff('prices', snapshot_p, cutoff)
+        la = snapshot.at_cutoff('arrivals', snapshot_a, cutoff)
+        quantity = la.groupby('market')['recent_quantity'].sum()
+        large_markets = list(quantity[quantity > self.qcutoff].index)
+        self.latest_p = lp[lp['market'].isin(large_markets)]
+        self.latest_a = la[la['market'].isin(large_markets)]
+        return self.latest_p, self.latest_a
+
+
 class CurrentMarketPlotter(CurrentMarketProcessor):
     """
     Plots current market conditions
@@ -291,22 +390,25 @@ class CurrentMarketPlotter(CurrentMarketProcessor):
         qcutoff (int): Minimum arrival tonnage for market inclusion
         tcutoff (int): Recency cutoff in days
         period (int): Rolling average window in days
+        processed (tuple): [Optional] Precomputed (latest_p, latest_a), e.g. from
+            PushdownQueries.current_markets(); prices and arrivals aren't needed when given
     """
-    def __init__(self, commodity, prices, arrivals, qcutoff, tcutoff, period):
+    def __init__(self, commodity, prices, arrivals, qcutoff, tcutoff, period, processed=None):
         self.commodity = commodity
         self.prices = prices
         self.arrivals = arrivals
         self.qcutoff = qcutoff
         self.tcutoff = tcutoff
         self.period = period
+        self.processed = processed
         self.process_data()
        
         
     def process_data(self):
-        self.latest_p, self.latest_a = self.prep_data()
+        self.latest_p, self.latest_a = self.prep_data() if self.processed is None else self.processed
         
     
-    def plot_mkt_overview(self, grade='Medium'):
+    def plot_mkt_overview(self, grade='Medium', asFigure=False):
         lp, la = self.latest_p, self.latest_a
         lp = lp[lp['grade'] == grade]
         lp = lp.sort_values('r_modal_price', ascending=False)
@@ -351,6 +453,8 @@ class CurrentMarketPlotter(CurrentMarketProcessor):
 
         fig = go.Figure(data=data, layout=layout)
         fig['layout'].update(margin=go.Margin(b=bottom_margin))
+        if asFigure:
+            return fig
         iplot(fig)
         
         
@@ -367,27 +471,27 @@ class CurrentMarketPlotter(CurrentMarketProcessor):
         
     
     
-    def plot_mkt_overview_alt(self, grade='Medium'):
+    def plot_mkt_overview_alt(self, grade='Medium', asFigure=False):
         lm = self.merge_pq(self.latest_p, self.latest_a, grade)
         lm = self.generate_hover_text(lm)
-        lm.iplot(kind='bubble', x='r_quantity', y='r_modal_price', size='r_quantity',
+        return lm.iplot(kind='bubble', x='r_quantity', y='r_modal_price', size='r_quantity',
           text='text', categories = 'state', 
           colors=['#071e3d','#1f4287','#278ea5','#a7d129'],
           xTitle='Quantity', yTitle='Modal Price', 
                  title='{} <br> Prices vs. Quantities <br> {} Day Averages: Grade - {}'.
-                    format(self.commodity,self.period, grade))
+                    format(self.commodity,self.period, grade), asFigure=asFigure)
     
     
     
-    def plot_price_variation(self, grade='Medium'):
+    def plot_price_variation(self, grade='Medium', asFigure=False):
         lm = self.merge_pq(self.latest_p, self.latest_a, grade)
         lm = self.generate_hover_text(lm)
-        lm.iplot(kind='bubble', x='r_quantity_l', y='r_modal_price', size='r_price_range',
+        return lm.iplot(kind='bubble', x='r_quantity_l', y='r_modal_price', size='r_price_range',
           text='text', categories = 'state', 
           colors=['#071e3d','#1f4287','#278ea5','#a7d129'],
           xTitle='Arrivals <br> (Log Scale)', yTitle='Modal Price', 
                   title='{} <br> Price Variations within Markets <br> {} Day Averages: Grade - {}'.
-                    format(self.commodity,self.period, grade))
+                    format(self.commodity,self.period, grade), asFigure=asFigure)
 
 
 
@@ -401,6 +505,10 @@ class CurrentMarkets(object):
         commodity (str): Commodity to see availability of
         start (str): Start date of availability evaluation period
         end (str): End date of availability evaluation period; defaults to today
+        pushdown (bool): Aggregate in the DB (lib/pushdown.py) rather than pulling raw rows;
+            ignored when reading a Parquet store
+        use_snapshot (bool): Read the latest_prices and latest_arrivals snapshot (lib/snapshot.py)
+            rather than history; plots with a period or tcutoff other than the snapshot's fall back to history
 
     Plot Options:
         overview: Bar - Prices and Arrivals by Market
@@ -414,12 +522,14 @@ class CurrentMarkets(object):
         cm.plot('price_var')
         cm.plot('price_var','Large')
     """
-    def __init__(self, commodity='Kinnow', start=None, end=None):
+    def __init__(self, commodity='Kinnow', start=None, end=None, pushdown=True, use_snapshot=True):
         self.commodity = commodity
         self.start = start
         self.end = end
+        self.pushdown = pushdown and not db.PARQUET
+        self.use_snapshot = use_snapshot and not db.PARQUET
         if not self.start:
-            self.start = str(pd.to_datetime('today') - pd.Timedelta(days=92))
+            self.start = str((pd.to_datetime('today') - pd.Timedelta(days=92)).date())
         if not self.end:
             self.end = str(pd.to_datetime('today').date())
         self.get_data()
@@ -427,12 +537,29 @@ class CurrentMarkets(object):
         
     def get_data(self):
         d = db.DBPuller(self.commodity, self.start, self.end)
-        d.get_data()
-        self.prices, self.arrivals, self.lm = d.prices, d.arrivals, d.lm
+        if self.use_snapshot:
+            d.get_snapshot()
+            self.snapshot_p, self.snapshot_a = d.snapshot_p, d.snapshot_a
+        elif self.pushdown:
+            self.queries = PushdownQueries(self.commodity, self.start, self.end)
+        else:
+            d.get_data()
+            self.prices, self.arrivals, self.lm = d.prices, d.arrivals, d.lm
         
         
     def plot(self, plottype, grade='Medium', qcutoff=3 , tcutoff=7, period=3):
-        cmp = CurrentMarketPlotter(self.commodity, self.prices, self.arrivals, qcutoff, tcutoff, period)
+        if self.use_snapshot and (period != snapshot.PERIOD or tcutoff != snapshot.WINDOW):
+            self.use_snapshot = False
+            self.get_data()
+        if self.use_snapshot:
+            cmp = CurrentMarketProcessor(None, None, qcutoff, tcutoff, period)
+            processed = cmp.prep_snapshot(self.snapshot_p, self.snapshot_a)
+            cmp = CurrentMarketPlotter(self.commodity, None, None, qcutoff, tcutoff, period, processed)
+        elif self.pushdown:
+            processed = self.queries.current_markets(qcutoff, tcutoff, period)
+            cmp = CurrentMarketPlotter(self.commodity, None, None, qcutoff, tcutoff, period, processed)
+        else:
+            cmp = CurrentMarketPlotter(self.commodity, self.prices, self.arrivals, qcutoff, tcutoff, period)
         if plottype == 'overview':
             cmp.plot_mkt_overview(grade)
         elif plottype == 'overview_alt':
@@ -472,6 +599,7 @@ class TrendProcessor(object):
         return p_aggs, a_aggs
     
     
+    @timed('prep_data', processor='TrendProcessor')
     def prep_data(self):
         pg = self.prices[self.prices['grade'] == self.grade]
         if self.market:
@@ -496,22 +624,45 @@ class TrendPlotter(TrendProcessor):
         state (str): State to plot trends for
         market (str): Market to plot trends for
         grade (str): Grade to plot trends for
+        processed (tuple): [Optional] Precomputed (p, a), e.g. from PushdownQueries.trends();
+            prices and arrivals aren't needed when given
+        anomalies (df): [Optional] Flagged rows to mark on a market's chart (see lib/anomalies.py)
     """
-    def __init__(self, commodity, prices, arrivals, state='Combined', market=None, grade='Medium'):
+    def __init__(self, commodity, prices, arrivals, state='Combined', market=None, grade='Medium',
+                 processed=None, anomalies=None):
         self.commodity = commodity
         self.prices = prices
         self.arrivals = arrivals
         self.state = state
         self.market = market
         self.grade = grade
+        self.processed = processed
+        self.anomalies = anomalies
         self.process_data()
         
         
     def process_data(self):
-        self.p, self.a = self.prep_data()
+        self.p, self.a = self.prep_data() if self.processed is None else self.processed
         
     
-    def plotter(self):
+    def anomaly_traces(self):
+        """Markers on a market's flagged prices and arrivals; aggregated charts have no rows to mark"""
+        if self.anomalies is None or not self.market:
+            return []
+        flags = self.anomalies[self.anomalies['market'] == self.market]
+        fp = flags[(flags['datatype'] == 'prices') & (flags['grade'] == self.grade)]
+        fa = flags[flags['datatype'] == 'arrivals']
+        return [go.Scatter(
+                    x=f.date,
+                    y=f['value'],
+                    mode='markers',
+                    name=name,
+                    marker=dict(color='#e84545', size=9, symbol='x'),
+                    text=['score {:.1f}, usual {:.0f}'.format(sc, md) for sc, md in zip(f['score'], f['median'])])
+                for f, name in [(fp, 'Flagged Price'), (fa, 'Flagged Arrivals')] if len(f)]
+
+
+    def plotter(self, asFigure=False):
         p = self.p.sort_values('date')
         a = self.a.sort_values('date')
         
@@ -563,6 +714,7 @@ class TrendPlotter(TrendProcessor):
         )
 
         data = [trace_max, trace_modal, trace_min, trace_fill, trace_arrivals]
+        data += self.anomaly_traces()
 
         if not self.market:
             region = 'All Markets - {}'.format(self.state)
@@ -608,6 +760,8 @@ class TrendPlotter(TrendProcessor):
 
 
         fig = dict(data=data, layout=layout)
+        if asFigure:
+            return fig
         iplot(fig)
 
 
@@ -621,19 +775,27 @@ class Trends(object):
         commodity (str): Commodity to see availability of
         start (str): Start date of availability evaluation period
         end (str): End date of availability evaluation period; defaults to today
+        pushdown (bool): Aggregate in the DB (lib/pushdown.py) rather than pulling raw rows;
+            ignored when reading a Parquet store
+        anomalies (str): [Optional] 'exclude' to leave flagged rows out (see lib/anomalies.py),
+            which pulls raw rows, or 'highlight' to mark them on market charts
 
     Usage:
         t = Trends()
         t.plot()
         t.plot(state='Punjab')
         t.plot(market='Malout')
+        Trends(anomalies='highlight').plot(market='Malout')
     """
-    def __init__(self, commodity='Kinnow', start=None, end=None):
+    def __init__(self, commodity='Kinnow', start=None, end=None, pushdown=True, anomalies=None):
         self.commodity = commodity
         self.start = start
         self.end = end
+        self.anomalies = anomalies
+        self.pushdown = pushdown and not db.PARQUET and anomalies != 'exclude'
+        self.flags = None
         if not self.start:
-            self.start = str(pd.to_datetime('today') - pd.Timedelta(days=92))
+            self.start = str((pd.to_datetime('today') - pd.Timedelta(days=92)).date())
         if not self.end:
             self.end = str(pd.to_datetime('today').date())
         self.get_data()
@@ -641,10 +803,171 @@ class Trends(object):
         
     def get_data(self):
         d = db.DBPuller(self.commodity, self.start, self.end)
+        if self.anomalies:
+            d.get_anomalies()
+            self.flags = d.anomalies
+        if self.pushdown:
+            self.queries = PushdownQueries(self.commodity, self.start, self.end)
+            return
         d.get_data()
         self.prices, self.arrivals, self.lm = d.prices, d.arrivals, d.lm
+        if self.anomalies == 'exclude':
+            self.prices = exclude(self.prices, self.flags, 'prices')
+            self.arrivals = exclude(self.arrivals, self.flags, 'arrivals')
         
         
     def plot(self, state='Combined', market=None, grade='Medium'):
-        tp = TrendPlotter(self.commodity, self.prices, self.arrivals, state, market, grade)
-        tp.plotter()
\ No newline at end of file
+        highlight = self.flags if self.anomalies == 'highlight' else None
+        if self.pushdown:
+            processed = self.queries.trends(state, market, grade)
+            tp = TrendPlotter(self.commodity, None, None, state, market, grade, processed, highlight)
+        else:
+            tp = TrendPlotter(self.commodity, self.prices, self.arrivals, state, market, grade,
+                              anomalies=highlight)
+        tp.plotter()
+
+
+## --------------------------
+## Season Comparison
+## --------------------------
+
+class SeasonProcessor(object):
+    """
+    Aligns precomputed season aggregates by day of season
+
+    Args:
+        aggregates (df): Rows from season_aggregates for one region and grade
+        current (int): Season to compare; earlier seasons form the baseline
+    """
+    def __init__(self, aggregates, current):
+        self.aggregates = aggregates
+        self.current = current
+
+
+    def align(self, datatype, col):
+        df = self.aggregates[self.aggregates['datatype'] == datatype]
+        return df.pivot_table(index='day', columns='season', values=col).sort_index()
+
+
+    def summarise_prior(self, aligned):
+        prior = aligned[[c for c in aligned.columns if c < self.current]]
+        return pd.DataFrame({
+            'prior_mean': prior.mean(axis=1),
+            'prior_min': prior.min(axis=1),
+            'prior_max': prior.max(axis=1)
+            })
+
+
+    @timed('prep_data', processor='SeasonProcessor')
+    def prep_data(self):
+        p = self.align('prices', 'modal_price')
+        a = self.align('arrivals', 'quantity')
+        return p, self.summarise_prior(p), a, self.summarise_prior(a)
+
+
+class SeasonPlotter(SeasonProcessor):
+    """
+    Plots the current season against prior seasons
+
+    Args:
+        commodity (str): Commodity to plot
+        aggregates (df): Rows from season_aggregates for one region and grade
+        current (int): Season to compare
+        region (str): Region label for the title
+        season (Season): Season definition, for axis labels
+    """
+    def __init__(self, commodity, aggregates, current, region, season):
+        self.commodity = commodity
+        self.aggregates = aggregates
+        self.current = current
+        self.region = region
+        self.season = season
+        self.process_data()
+
+
+    def process_data(self):
+        self.p, self.p_prior, self.a, self.a_prior = self.prep_data()
+
+
+    def plotter(self, asFigure=False):
+        p, prior = self.p, self.p_prior
+        data = [
+            go.Scatter(x=prior.index, y=prior['prior_max'], line=dict(color='rgba(0,0,0,0)'),
+                       showlegend=False, hoverinfo='skip'),
+            go.Scatter(x=prior.index, y=prior['prior_min'], fill='tonexty',
+                       fillcolor='rgba(0,100,80,0.1)', line=dict(color='rgba(0,0,0,0)'),
+                       name='Prior Range'),
+            go.Scatter(x=prior.index, y=prior['prior_mean'], name='Prior Average',
+                       line=dict(color='#278ea5', dash='dash'))
+            ]
+        if self.current in p.columns:
+            data.append(go.Scatter(x=p.index, y=p[self.current], connectgaps=False,
+                                   name='{} Season'.format(self.current),
+                                   line=dict(color='#071e3d', width=3)))
+        if self.current in self.a.columns:
+            data.append(go.Bar(x=self.a.index, y=self.a[self.current], name='Arrivals',
+                               yaxis='y2', opacity=0.4, marker=dict(color='#1f4287')))
+
+        start, end = self.season.bounds(self.current)
+        ticks = pd.date_range(start, end, freq='MS')
+        layout = dict(
+            title='{} <br> {} <br> Current Season vs. Prior Seasons'.format(self.commodity, self.region),
+            xaxis=dict(tickvals=list((ticks - start).days), ticktext=list(ticks.strftime('%b')),
+                       title='Day of Season'),
+            yaxis=dict(title='Modal Price per Quintal'),
+            yaxis2=dict(title='Arrivals in Tonnes', overlaying='y', side='right', showgrid=False)
+            )
+        fig = dict(data=data, layout=layout)
+        if asFigure:
+            return fig
+        iplot(fig)
+
+
+class SeasonTrends(object):
+    """
+    Wrapper - Pulls, processes, and plots the current season against prior
+    seasons for a given commodity, region, and grade. Reads precomputed
+    season_aggregates (see lib/seasons.py), so each plot pulls a few hundred
+    rows regardless of how many seasons are compared. plot() takes state,
+    market, grade, and district arguments; a market's state and district
+    tell apart markets of the same name
+
+    Args:
+        commodity (str): Commodity to compare seasons for
+        seasons (int): Number of prior seasons to compare against
+        season (Season): Season definition; defaults to November - March
+
+    Usage:
+        st = SeasonTrends()
+        st.plot()
+        st.plot(state='Punjab')
+        st.plot(market='Malout', grade='Large')
+        st.plot(state='Punjab', market='Malout', district='Muktsar')  # where market names repeat
+    """
+    def __init__(self, commodity='Kinnow', seasons=5, season=None):
+        self.commodity = commodity
+        self.seasons = seasons
+        self.season = season or Season()
+        self.current = self.season.current()
+
+
+    def get_data(self, level, region, grade, state=None, district=None):
+        d = db.DBPuller(self.commodity, None)
+        d.get_season_aggregates(level, region, grade, range(self.current - self.seasons, self.current + 1),
+                                state, district)
+        return d.season_aggregates
+
+
+    def plot(self, state='Combined', market=None, grade='Medium', district=None):
+        if market:
+            region = market
+            aggregates = self.get_data('market', market, grade, None if state == 'Combined' else state, district)
+            places = aggregates[['state', 'district']].drop_duplicates()
+            if len(places) > 1:
+                raise ValueError('{} is a market in more than one place - pass its state and district: {}'
+                                 .format(market, places.to_dict('records')))
+        else:
+            level, region = ('combined', 'Combined') if state == 'Combined' else ('state', state)
+            aggregates = self.get_data(level, region, grade)
+        sp = SeasonPlotter(self.commodity, aggregates, self.current, region, self.season)
+        sp.plotter()
@@ -0,0 +1,176 @@
+"""
+pushdown.py:
+    The aggregations behind the trend, current market, and data availability
+    charts, written as SQL that runs inside the database. Only the rows a chart
+    draws come back - a few hundred at most - rather than the raw history
+    the processors in plotters.py aggregate in pandas. With an embedded
+    backend (AGMARKNET_DB=sqlite:///... or duckdb:///..., see helpers.db_url)
+    the queries run in-process, with no network hop
+
+    Statements stick to window functions so the same SQL runs on postgres,
+    sqlite, and duckdb. Medians are taken from row numbers, since sqlite has
+    no median aggregate
+
+    PushdownQueries (cls): Runs chart aggregations in the database
+"""
+
+import pandas as pd
+from sqlalchemy import text, bindparam
+
+import lib.helpers as h
+from lib.metrics import timed
+
+PRICES = ['min_price', 'modal_price', 'max_price']
+
+# days since 1970-01-01, for finding runs of consecutive days
+DAYNUM = {
+    'sqlite': "cast(julianday(date) - 2440587.5 as integer)",
+    'postgresql': "(date - date '1970-01-01')",
+    'duckdb': "(date - date '1970-01-01')",
+    }
+
+
+def median_sql(cols, partition):
+    """
+    Select list and window columns for medians of cols within partition,
+    as (windows, aggregates); windows go in an inner query, aggregates in
+    an outer query grouped by partition
+    """
+    windows = ['row_number() over (partition by {p} order by case when {c} is null then 1 else 0 end, {c}) '
+               'as rn_{c}, count({c}) over (partition by {p}) as n_{c}'.format(c=c, p=partition)
+               for c in cols]
+    # the middle row, or the two middle rows of an even count
+    aggregates = ['avg(case when 2 * rn_{c} between n_{c} and n_{c} + 2 then {c} end) as {c}'.format(c=c)
+                  for c in cols]
+    return ', '.join(windows), ', '.join(aggregates)
+
+
+
+class PushdownQueries(object):
+    """
+    Runs chart aggregations in the database
+
+    Args:
+        commodity (str or list): Commodity, or list of commodities, to query
+        start (str): Start date
+        end (str): [Optional] End date; defaults to today
+        engine (engine): [Optional] SQLAlchemy engine; defaults to helpers.db_connect()
+
+    Usage:
+        pq = PushdownQueries('Kinnow', '2018-10-01')
+        p, a = pq.trends('Punjab', None, 'Large')
+        latest_p, latest_a = pq.current_markets(qcutoff=3, tcutoff=7, period=3)
+        processed = pq.availability('prices', 'district')
+    """
+    def __init__(self, commodity, start, end=None, engine=None):
+        self.commodities = [commodity] if isinstance(commodity, str) else list(commodity)
+        self.start = start
+        self.end = end or str(pd.to_datetime('today').date())
+        self.engine = engine
+
+
+    def connect(self):
+        if not self.engine:
+            self.engine = h.db_connect()
+
+
+    def where(self, **filters):
+        """Commodity and date range, plus column = :column for each filter given"""
+        clauses = ['commodity in :commodities', 'date between :start and :end']
+        clauses += ['{0} = :{0}'.format(col) for col, value in filters.items() if value is not None]
+        return ' and '.join(clauses)
+
+
+    def query(self, sql, **params):
+        self.connect()
+        stmt = text(sql).bindparams(bindparam('commodities', expanding=True))
+        params = {k: v for k, v in params.items() if v is not None}
+        with self.engine.connect() as conn:
+            df = pd.read_sql(stmt, con=conn, params=dict(commodities=self.commodities, start=self.start,
+                                                         end=self.end, **params))
+        if 'date' in df:
+            df['date'] = pd.to_datetime(df['date'])
+        return df
+
+
+    @timed('pushdown_query', query='trends')
+    def trends(self, state='Combined', market=None, grade='Medium'):
+        """As TrendProcessor.prep_data: a market's rows, or daily medians and totals for a state or all states"""
+        if market:
+            p = self.query('select * from prices where {} order by date'.format(
+                self.where(grade=grade, market=market)), grade=grade, market=market)
+            a = self.query('select * from arrivals where {} order by date'.format(
+                self.where(market=market)), market=market)
+            return p, a
+        state = None if state == 'Combined' else state
+        windows, aggregates = median_sql(PRICES, 'date')
+        p = self.query('select date, {} from (select date, {}, {} from prices where {}) ranked '
+                       'group by date order by date'.format(aggregates, ', '.join(PRICES), windows,
+                                                            self.where(grade=grade, state=state)),
+                       grade=grade, state=state)
+        a = self.query('select date, sum(quantity) as quantity from arrivals where {} group by date '
+                       'order by date'.format(self.where(state=state)), state=state)
+        return p, a
+
+
+    @timed('pushdown_query', query='current_markets')
+    def current_markets(self, qcutoff=3, tcutoff=7, period=3):
+        """
+        As CurrentMarketProcessor.prep_data: the latest rolling averages of
+        each market with more than qcutoff tonnes of arrivals in the last
+        tcutoff days
+        """
+        cutoff = str((pd.to_datetime('today') - pd.Timedelta(days=tcutoff)).date())
+        recent = '{} and date > :cutoff'.format(self.where())
+        large = ('select market from arrivals where {} group by market '
+                 'having sum(quantity) > :qcutoff'.format(recent))
+        rows = 'rows between {} preceding and current row'.format(int(period) - 1)
+        p = self.query("""
+            select * from (
+                select p.*, max_price - min_price as price_range,
+                    avg(modal_price) over w as r_modal_price,
+                    avg(max_price - min_price) over w as r_price_range,
+                    row_number() over (partition by state, district, market, grade
+                                       order by date desc, variety) as latest
+                from prices p
+                where {recent} and market in ({large})
+                window w as (partition by state, district, market, grade order by date {rows})
+                ) rolling
+            where latest = 1""".format(recent=recent, large=large, rows=rows),
+            cutoff=cutoff, qcutoff=qcutoff)
+        a = self.query("""
+            select * from (
+                select a.*, avg(quantity) over w as r_quantity,
+                    row_number() over (partition by state, district, market order by date desc) as latest
+                from arrivals a
+                where {recent} and market in ({large})
+                window w as (partition by state, district, market order by date {rows})
+                ) rolling
+            where latest = 1""".format(recent=recent, large=large, rows=rows),
+            cutoff=cutoff, qcutoff=qcutoff)
+        p[['r_modal_price', 'r_price_range']] = p[['r_modal_price', 'r_price_range']].round()
+        a['r_quantity'] = a['r_quantity'].round(1)
+        return p.drop(columns='latest'), a.drop(columns='latest')
+
+
+    @timed('pushdown_query', query='availability')
+    def availability(self, datatype, col):
+        """
+        As DataAvailabilityProcessor.prep_data: runs of consecutive days with
+        data, per state or district, as the frame DataAvailabilityPlotter draws
+        """
+        self.connect()
+        daynum = DAYNUM.get(self.engine.dialect.name, DAYNUM['postgresql'])
+        df = self.query("""
+            select region as "Task", min(day) as start, max(day) as finish, min(state) as state from (
+                select region, day, state, day - row_number() over (partition by region order by day) as island
+                from (select {col} as region, {daynum} as day, min(state) as state from {table}
+                      where {where} group by {col}, {daynum}) days
+                ) islands
+            group by region, island
+            order by region, start""".format(col=col, daynum=daynum, table=datatype, where=self.where()))
+        epoch = pd.Timestamp('1970-01-01')
+        df['Start'] = epoch + pd.to_timedelta(df.pop('start'), unit='D')
+        df['Finish'] = epoch + pd.to_timedelta(df.pop('finish'), unit='D')
+        df['Resource'] = 'Available'
+        return df[['Task', 'Start', 'Finish', 'Resource', 'state']]
@@ -0,0 +1,124 @@
+"""
+replay.py:
+    Runs the scrapers end to end against a local FixtureServer and reports
+    throughput, so concurrency, page splitting, and retry behaviour can be
+    tuned offline without loading the public site. Results are written to a
+    local sqlite database
+
+    ScraperReplay (cls): Serves synthetic data, scrapes it back, and reports throughput
+"""
+
+import time
+import pathlib
+
+import pandas as pd
+from sqlalchemy import create_engine
+
+import lib.helpers as h
+from lib import pipeline
+from lib.metrics import METRICS
+from lib.synthetic import SyntheticAgmarknet
+from lib.tablecreator import create_tables
+from lib.fixture_server import FixtureServer
+from lib.async_scraper import ScrapeJob, AsyncScrapeRunner
+from lib.resilience import JobSupervisor, RetryPolicy, CircuitBreaker
+
+
+class ScraperReplay(object):
+    """
+    Serves synthetic data, scrapes it back, and reports throughput
+
+    Args:
+        states (int): Number of states to scrape
+        markets (int): Markets per state
+        days (int): Days to scrape, ending today
+        concurrency (int): Browser sessions to run at once
+        split_pages (int): [Optional] Page range size for splitting price jobs
+        latency (float): Seconds added to every server response
+        jitter (float): Extra random latency, up to this many seconds
+        failure_rate (float): Share of requests the server fails
+        short_rate (float): Share of price pages served with a row missing
+        wait_scale (float): Multiplier on the scrapers' fixed waits; 0 removes them
+        dburl (str): SQLAlchemy url scraped rows are written to
+        fetcher (str): 'selenium' (needs chromedriver) or 'http'
+
+    Usage:
+        sr = ScraperReplay(states=4, days=7, concurrency=4, latency=0.3)
+        sr.run()        # {'seconds': .., 'pages_per_minute': .., ...}
+    """
+    def __init__(self, states=2, markets=20, days=3, concurrency=2, split_pages=None,
+                 latency=0, jitter=0, failure_rate=0, wait_scale=0,
+                 dburl='sqlite:///data/replay.sqlite', short_rate=0, fetcher='selenium'):
+        self.states = states
+        self.markets = markets
+        self.days = days
+        self.concurrency = concurrency
+        self.split_pages = split_pages
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.short_rate = short_rate
+        self.wait_scale = wait_scale
+        self.dburl = dburl
+        self.fetcher = fetcher
+
+
+    def setup(self):
+        sa = SyntheticAgmarknet(states=self.states, markets=self.markets, years=1)
+        self.prices, self.arrivals, self.lm = sa.generate()
+        if self.dburl.startswith('sqlite:///'):
+            pathlib.Path(self.dburl[len('sqlite:///'):]).parent.mkdir(parents=True, exist_ok=True)
+        self.engine = create_engine(self.dburl)
+        create_tables(self.engine)
+        with self.engine.begin() as conn:
+            for table in ['prices', 'arrivals', 'location_map', 'date_fingerprints', 'fingerprint_parts',
+                          'availability', 'quarantine', 'latest_prices', 'latest_arrivals', 'scrape_jobs',
+                          'anomaly_state', 'anomalies']:
+                conn.execute('delete from {}'.format(table))
+        h.insert_rows(self.engine, 'location_map', self.lm.to_dict('records'))
+        end = pd.to_datetime('today').normalize()
+        self.start = str((end - pd.Timedelta(days=self.days - 1)).date())
+        self.end = str(end.date())
+        self.jobs = [ScrapeJob(datatype, sa.commodities[0], state, self.start, self.end)
+                     for state in sa.states for datatype in ['prices', 'arrivals']]
+
+
+    def count(self, table):
+        with self.engine.connect() as conn:
+            return conn.execute('select count(*) from {}'.format(table)).scalar()
+
+
+    def run(self):
+        self.setup()
+        pipeline.WAIT_SCALE = self.wait_scale
+        METRICS.reset()
+        with FixtureServer(self.prices, self.arrivals, self.latency, self.jitter,
+                           self.failure_rate, short_rate=self.short_rate) as fs:
+            # job retries back off on the same scaled clock as page waits
+            supervisor = JobSupervisor(policy=RetryPolicy(backoff=30 * self.wait_scale),
+                                       breaker=CircuitBreaker(cooldown=300 * self.wait_scale))
+            runner = AsyncScrapeRunner(self.jobs, self.concurrency, serverless=False,
+                                       split_pages=self.split_pages, url=fs.url, engine=self.engine,
+                                       fetcher=self.fetcher, supervisor=supervisor)
+            start = time.perf_counter()
+            runner.run()
+            elapsed = time.perf_counter() - start
+            stats = dict(fs.stats)
+        report = {
+            'seconds': elapsed,
+            'jobs': len(self.jobs),
+            'failed_jobs': len(runner.failed),
+            'job_retries': METRICS.total('job_retry'),
+            'requests': stats['requests'],
+            'injected_failures': stats['failures'],
+            'injected_short_pages': stats['short_pages'],
+            'page_refetches': METRICS.total('page_refetches'),
+            'pages_served': stats['pages'],
+            'pages_per_minute': stats['pages'] / elapsed * 60,
+            'prices_written': self.count('prices'),
+            'arrivals_written': self.count('arrivals'),
+            'prices_expected': len(self.prices[self.prices['date'] >= self.start]),
+            }
+        report['rows_per_second'] = (report['prices_written'] + report['arrivals_written']) / elapsed
+        self.report = report
+        return report
@@ -0,0 +1,345 @@
+"""
+resilience.py:
+    Keeps a night's scrape doing useful work when the site misbehaves. Every
+    job runs under a JobSupervisor, which:
+
+        - gives up on an attempt after timeout seconds, closing its browser
+          so the stuck call errors out rather than holding a worker
+        - classifies failures: site errors (browser, network, timeouts) are
+          retried with backoff; parse errors get a single retry - a
+          half-loaded page parses the second time, a changed layout never
+          will - and anything else goes straight to the queue
+        - opens a circuit breaker after threshold site errors in a row, so
+          jobs wait out a cooldown instead of hammering a site that's down;
+          one job then probes it before the rest resume
+        - records jobs that still fail in a failed-job queue on disk, which
+          the next run drains first. Jobs that have failed max_runs runs in
+          a row are left there for a person to look at
+
+    Selenium isn't imported; its exceptions are recognised by module
+
+    A job can also be cancelled from outside - e.g. when a queue worker
+    loses its lease (see lib/job_queue.py). Its next failure is then a
+    Cancelled, which isn't retried, counted against the site, or queued
+
+    JobTimeout (cls): An attempt ran past its timeout
+    CircuitOpen (cls): The circuit won't close before the run's window ends
+    Cancelled (cls): The job was cancelled while it ran
+    CircuitBreaker (cls): Pauses jobs while the site is failing
+    RetryPolicy (cls): How often, and after how long, each kind of failure is retried
+    FailedJobQueue (cls): Jobs that failed, kept for the next run
+    JobSupervisor (cls): Runs jobs with timeouts, retries, the breaker, and the queue
+    classify (func): 'site', 'parse', or 'other'
+    call_with_timeout (func): Runs a blocking call with a time limit
+"""
+
+import os
+import json
+import time
+import random
+import pathlib
+import datetime
+import threading
+
+from lib.metrics import METRICS
+
+SITE = 'site'
+PARSE = 'parse'
+OTHER = 'other'
+RETRIES = {SITE: 2, PARSE: 1, OTHER: 0}
+
+
+class JobTimeout(Exception):
+    pass
+
+
+class CircuitOpen(Exception):
+    pass
+
+
+class Cancelled(Exception):
+    pass
+
+
+def classify(e):
+    """'site' for browser, network, and timeout errors, 'parse' for page contents we couldn't read"""
+    if isinstance(e, (JobTimeout, CircuitOpen, OSError)):
+        return SITE
+    if any(c.__module__.startswith('selenium') for c in type(e).__mro__):
+        return SITE
+    if isinstance(e, (ValueError, KeyError, IndexError, AttributeError, TypeError)):
+        return PARSE
+    return OTHER
+
+
+def call_with_timeout(func, timeout, on_timeout=None):
+    """
+    Runs func() in a worker thread and waits up to timeout seconds.
+    A thread can't be killed, so on_timeout should release whatever func
+    is blocked on - e.g. quit its browser - before JobTimeout is raised
+    """
+    if not timeout:
+        return func()
+    result = {}
+
+    def target():
+        try:
+            result['value'] = func()
+        except BaseException as e:
+            result['error'] = e
+
+    worker = threading.Thread(target=target, daemon=True)
+    worker.start()
+    worker.join(timeout)
+    if worker.is_alive():
+        if on_timeout:
+            on_timeout()
+        worker.join(30)
+        raise JobTimeout('timed out after {}s'.format(timeout))
+    if 'error' in result:
+        raise result['error']
+    return result.get('value')
+
+
+
+class CircuitBreaker(object):
+    """
+    Pauses jobs while the site is failing. Shared by every worker thread
+
+    Args:
+        threshold (int): Site errors in a row that open the circuit
+        cooldown (float): Seconds the circuit stays open before a probe is let through
+    """
+    def __init__(self, threshold=5, cooldown=300):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened = None
+        self.probing = False
+        self.lock = threading.Lock()
+
+
+    @property
+    def state(self):
+        if self.opened is None:
+            return 'closed'
+        return 'half-open' if self.probing else 'open'
+
+
+    def acquire(self, deadline=None):
+        """
+        Returns once a job may run. While the circuit is open, blocks until
+        the cooldown ends and lets one job through to probe the site; raises
+        CircuitOpen if that won't happen before deadline (time.monotonic())
+        """
+        while True:
+            with self.lock:
+                if self.opened is None:
+                    return
+                now = time.monotonic()
+                ready = self.opened + self.cooldown
+                if now >= ready and not self.probing:
+                    self.probing = True
+                    return
+            wake = max(ready, now + 1)
+            if deadline is not None and wake > deadline:
+                raise CircuitOpen('site still failing; circuit open until the window ends')
+            time.sleep(min(wake - now, 5))
+
+
+    def success(self):
+        with self.lock:
+            if self.opened is not None:
+                print('Circuit closed')
+            self.failures = 0
+            self.opened = None
+            self.probing = False
+
+
+    def failure(self, kind):
+        with self.lock:
+            if kind != SITE:
+                # a probe that failed on something else says nothing about the site
+                self.probing = False
+                return
+            self.failures += 1
+            if self.probing or (self.opened is None and self.failures >= self.threshold):
+                print('Circuit open for {}s after {} site errors'.format(self.cooldown, self.failures))
+                METRICS.incr('circuit_open')
+                self.opened = time.monotonic()
+                self.probing = False
+
+
+
+class RetryPolicy(object):
+    """
+    How often, and after how long, each kind of failure is retried
+
+    Args:
+        retries (dict): [Optional] Retries per kind, over RETRIES
+        backoff (float): Seconds before the first retry
+        factor (float): Backoff multiplier per retry
+        max_backoff (float): Longest wait between retries
+    """
+    def __init__(self, retries=None, backoff=30, factor=2, max_backoff=600):
+        self.retries = dict(RETRIES, **(retries or {}))
+        self.backoff = backoff
+        self.factor = factor
+        self.max_backoff = max_backoff
+
+
+    def should_retry(self, kind, attempt):
+        return attempt <= self.retries.get(kind, 0)
+
+
+    def delay(self, attempt):
+        """Exponential backoff with jitter, so retrying workers don't return in step"""
+        return min(self.backoff * self.factor ** (attempt - 1), self.max_backoff) * random.uniform(0.75, 1.25)
+
+
+
+class FailedJobQueue(object):
+    """
+    Jobs that failed, kept in a json file for the next run. A job stays in
+    the queue until it succeeds
+
+    Args:
+        path (str): Queue file
+        factory (func): [Optional] Rebuilds a job from its to_dict(); defaults to returning the dict
+        max_runs (int): Runs a job may fail before it's no longer retried
+
+    Usage:
+        q = FailedJobQueue('data/failed_jobs.json', ScrapeJob.from_dict)
+        q.push(job, e, 'site')
+        q.pending()         # jobs to retry, oldest first
+        q.remove(job)
+    """
+    def __init__(self, path='data/failed_jobs.json', factory=None, max_runs=5):
+        self.path = pathlib.Path(path)
+        self.factory = factory or (lambda d: d)
+        self.max_runs = max_runs
+        self.lock = threading.Lock()
+
+
+    def load(self):
+        if not self.path.exists():
+            return {}
+        with open(self.path) as infile:
+            return json.load(infile)
+
+
+    def save(self, entries):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix('.tmp')
+        with open(tmp, 'w') as outfile:
+            json.dump(entries, outfile, indent=1, default=str)
+        os.replace(tmp, self.path)
+
+
+    def push(self, job, error, kind):
+        now = str(datetime.datetime.now().replace(microsecond=0))
+        with self.lock:
+            entries = self.load()
+            entry = entries.get(repr(job), {'job': job.to_dict(), 'runs': 0, 'first_failed': now})
+            entry.update(runs=entry['runs'] + 1, kind=kind, last_failed=now,
+                         error='{}: {}'.format(type(error).__name__, error))
+            entries[repr(job)] = entry
+            self.save(entries)
+        if entry['runs'] >= self.max_runs:
+            print('{} has failed {} runs in a row; no longer retried'.format(job, entry['runs']))
+
+
+    def remove(self, job):
+        with self.lock:
+            entries = self.load()
+            if entries.pop(repr(job), None) is not None:
+                self.save(entries)
+
+
+    def pending(self):
+        entries = sorted(self.load().values(), key=lambda e: e['first_failed'])
+        return [self.factory(e['job']) for e in entries if e['runs'] < self.max_runs]
+
+
+
+class JobSupervisor(object):
+    """
+    Runs jobs with timeouts, classified retries, the circuit breaker, and
+    the failed-job queue
+
+    Args:
+        timeout (float): [Optional] Seconds an attempt may run
+        window (float): [Optional] Seconds from now the run must finish in; jobs that
+            can't start in time go to the queue
+        policy (RetryPolicy): [Optional] Defaults to RetryPolicy()
+        breaker (CircuitBreaker): [Optional] Defaults to CircuitBreaker()
+        queue (FailedJobQueue): [Optional] Where jobs that still fail go; not kept without one
+
+    Usage:
+        sv = JobSupervisor(timeout=3600, queue=FailedJobQueue(factory=ScrapeJob.from_dict))
+        for job in sv.schedule(jobs):
+            sv.run(job, scrape, on_timeout=close_browser)
+    """
+    def __init__(self, timeout=None, window=None, policy=None, breaker=None, queue=None):
+        self.timeout = timeout
+        self.deadline = time.monotonic() + window if window else None
+        self.policy = policy or RetryPolicy()
+        self.breaker = breaker or CircuitBreaker()
+        self.queue = queue
+
+
+    def pending(self):
+        return self.queue.pending() if self.queue else []
+
+
+    def schedule(self, jobs):
+        """Queued jobs from earlier runs, then jobs not already among them"""
+        queued = self.pending()
+        if queued:
+            print('Retrying {} failed jobs from earlier runs'.format(len(queued)))
+        keys = {repr(job) for job in queued}
+        return queued + [job for job in jobs if repr(job) not in keys]
+
+
+    def run(self, job, func, on_timeout=None, cancelled=None):
+        """
+        Runs func(job) until it succeeds, its retries run out, or cancelled
+        (a threading.Event) is set
+
+        Returns:
+            None on success, otherwise the last exception - Cancelled if the job was cancelled
+        """
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                if cancelled is not None and cancelled.is_set():
+                    raise Cancelled('{} cancelled'.format(job))
+                self.breaker.acquire(self.deadline)
+                if self.deadline is not None and time.monotonic() >= self.deadline:
+                    raise CircuitOpen('window over before the job could start')
+                call_with_timeout(lambda: func(job), self.timeout, on_timeout and (lambda: on_timeout(job)))
+            except Exception as e:
+                if cancelled is not None and cancelled.is_set():
+                    # whatever the error, it's the cancellation's doing - e.g. a closed browser
+                    print('{} cancelled ({}: {})'.format(job, type(e).__name__, e))
+                    METRICS.incr('job_cancelled')
+                    return e if isinstance(e, Cancelled) else Cancelled(str(e))
+                kind = classify(e)
+                if not isinstance(e, CircuitOpen):
+                    self.breaker.failure(kind)
+                METRICS.error('job', e, job=repr(job), kind=kind)
+                delay = self.policy.delay(attempt)
+                late = self.deadline is not None and time.monotonic() + delay >= self.deadline
+                if isinstance(e, CircuitOpen) or late or not self.policy.should_retry(kind, attempt):
+                    if self.queue:
+                        self.queue.push(job, e, kind)
+                    return e
+                print('{} failed ({}: {}); retrying in {:.0f}s'.format(job, kind, e, delay))
+                METRICS.incr('job_retry', kind=kind)
+                time.sleep(delay)
+            else:
+                self.breaker.success()
+                if self.queue:
+                    self.queue.remove(job)
+                return None
@@ -1,9 +1,33 @@
 """
 scrapers.py:
-    Scrapes commodity price and arrival data at wholesale agricultural markets 
-    across India from 'http://agmarknet.gov.in/'. Configured to optionally 
+    Scrapes commodity price and arrival data at wholesale agricultural markets
+    across India from 'http://agmarknet.gov.in/'. Configured to optionally
     handle serverless deployment
 
+    Every scraper is a fetcher, a parser, and a sink (see lib/pipeline.py).
+    The fetcher defaults to Selenium; pass fetcher='http' (or set
+    AGMARKNET_FETCHER) to scrape without a browser, or a fetcher instance,
+    e.g. ReplayFetcher, to re-run recorded pages. Rows go to the DB, or to
+    json files without writetodb, unless a sink is given
+
+    Pages and days are written in batches as they're scraped, with progress
+    checkpointed after each committed batch so interrupted jobs resume where
+    they left off. Price rows are fingerprinted per date (see
+    lib/fingerprints.py), so a query's leading dates that are stored and
+    haven't changed - from the same query or any other - skip their pages,
+    and unchanged dates skip their writes
+
+    The site URL defaults to agmarknet, and can be pointed elsewhere - e.g. at
+    lib.fixture_server - with the url argument or AGMARKNET_URL. Fixed page
+    waits are scaled by AGMARKNET_WAIT_SCALE
+
+    Selenium, pandas, and SQLAlchemy are imported where they're first used
+    rather than at module load, keeping Lambda cold starts short (see
+    lambda_function.py). Set AGMARKNET_CHROME_VERBOSE=1 to turn Chromium's
+    verbose logging back on in Lambda
+
+    MandiScraper (cls): Base - wires a fetcher, parser, and sink together
+
     PRICES
     MandiPriceScraper (cls): Scrapes prices over a date range and writes output
 
@@ -12,232 +36,415 @@ scrapers.py:
     MandiQuantityScraper (cls): Wrapper - scrapes, processes, and writes output
 """
 
-import os
-import time
-import json
-import pathlib
-
-from selenium import webdriver
-from selenium.webdriver.support.ui import Select
-from selenium.webdriver.common.keys import Keys
-from selenium.common.exceptions import NoSuchElementException
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
+import datetime
 
 import re
 import math
-import pandas as pd
-from pandas.io.json import json_normalize
-
-from sqlalchemy import *
-from sqlalchemy import create_engine
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
 
 import lib.helpers as h
+from lib import pipeline
+from lib.checkpoint import Checkpoint
+from lib.fingerprints import DateFingerprints, by_date, day, digest
+from lib.metrics import METRICS, timed
+from lib.pipeline import (URL, wait, parse_heading, make_fetcher, PriceTableParser, ArrivalsParser,
+                          DBSink, JSONSink, ParquetSink)
+
+
+def today():
+    return str(datetime.date.today())
+
 
 
-class MandiPriceScraper(object):
+class MandiScraper(object):
     """
-     Scrapes prices over a date range and writes output
+    Base - wires a fetcher, parser, and sink together
 
     Args:
         commodity (str): Commodity to scrape data for
         state (str): State to scrape data for
-        start (str): Start of period to scrape data for
+        start (str): Start of period to scrape data for; defaults to today
         end (str): End of period to scrape data for
         serverless (bool): Lambda execution flag
         writetodb (bool): Flag for inserting into db or saving json
+        url (str): [Optional] Site to scrape; defaults to agmarknet
+        fetcher (str or Fetcher): [Optional] 'selenium', 'http', 'replay', or a fetcher;
+            defaults to AGMARKNET_FETCHER, or selenium
+        sink (Sink): [Optional] Where rows go; defaults to the DB, or without writetodb a
+            Parquet store under ROOTDIR - json if pyarrow isn't installed
     """
-    def __init__(self, commodity, state, start=None, end=None, serverless=True, writetodb=True):
+    SCRAPE_TYPE = None
+    DBTABLE = None
+
+    def __init__(self, commodity, state, start=None, end=None, serverless=True, writetodb=True, url=None,
+                 fetcher=None, sink=None):
         self.commodity = commodity
         self.state = state
         self.start = start
         self.end = end
         self.serverless = serverless
         self.writetodb = writetodb
-        self.URL = 'http://agmarknet.gov.in/'
+        self.URL = url or URL
         self.DRIVER_DIR = '/Users/inayatkhosla/Downloads/chromedriver'
         self.ROOTDIR = 'data/'
-        self.DBTABLE = 'prices'
         if not self.start:
-            self.start = str(pd.to_datetime('today').date())
-            self.end = str(pd.to_datetime('today').date())
-        
-        
-    def setup_driver_reg(self):
-        chrome_options = Options()  
-        chrome_options.add_argument("--headless")
-        self.driver = webdriver.Chrome(executable_path=self.DRIVER_DIR, options=chrome_options)
-        
-    
-    def setup_driver_lambda(self):
-        chrome_options = webdriver.ChromeOptions()
-        chrome_options.add_argument('--headless')
-        chrome_options.add_argument('--no-sandbox')
-        chrome_options.add_argument('--disable-gpu')
-        chrome_options.add_argument('--window-size=1280x1696')
-        chrome_options.add_argument('--user-data-dir=/tmp/user-data')
-        chrome_options.add_argument('--hide-scrollbars')
-        chrome_options.add_argument('--enable-logging')
-        chrome_options.add_argument('--log-level=0')
-        chrome_options.add_argument('--v=99')
-        chrome_options.add_argument('--single-process')
-        chrome_options.add_argument('--data-path=/tmp/data-path')
-        chrome_options.add_argument('--ignore-certificate-errors')
-        chrome_options.add_argument('--homedir=/tmp')
-        chrome_options.add_argument('--disk-cache-dir=/tmp/cache-dir')
-        chrome_options.add_argument('user-agent=Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/61.0.3163.100 Safari/537.36')
-        chrome_options.binary_location = os.getcwd() + "/bin/headless-chromium"
-        self.driver = webdriver.Chrome(chrome_options=chrome_options)
-    
-    
+            self.start = today()
+            self.end = today()
+        self.fetcher = make_fetcher(fetcher or pipeline.FETCHER, self.URL, serverless, self.DRIVER_DIR)
+        self.sink = sink
+        self.engine = None
+
+
+    def query(self):
+        return {'commodity': self.commodity, 'state': self.state, 'start': self.start, 'end': self.end}
+
+
     def setup_driver(self):
-        if self.serverless:
-            self.setup_driver_lambda()
-        else:
-            self.setup_driver_reg()
-    
-    
+        self.fetcher.start()
+
+
     def open_page(self):
-        self.driver.get(self.URL)
-        
-        
-    def select_scrape_type(self):
-        element = Select(self.driver.find_element_by_id('ddlArrivalPrice'))
-        element.select_by_visible_text('Price')
-        
-        
-    def select_commodity(self):
-        element = Select(self.driver.find_element_by_id('ddlCommodity'))
-        element.select_by_visible_text(self.commodity)
-        #self.commodities = [o.text for o in element.options]
-        
-        
-    def select_state(self):
-        element = Select(self.driver.find_element_by_id('ddlState'))
-        element.select_by_visible_text(self.state)
-        
-        
-    def select_daterange(self):
-        startdate = self.driver.find_element_by_id('txtDate')
-        startdate.clear()
-        startdate.send_keys(self.start)
-        endate = self.driver.find_element_by_id('txtDateTo')
-        endate.clear()
-        endate.send_keys(self.end)
-        time.sleep(3)
-        endate.send_keys(Keys.ENTER)
-    
-    
+        self.fetcher.open()
+
+
     def populate_dropdowns(self):
-        self.select_scrape_type()
-        self.select_commodity()
-        self.select_state()
-        time.sleep(3)
-        self.select_daterange()
-        time.sleep(3)
-        
-        
+        self.fetcher.search(self.SCRAPE_TYPE, self.commodity, self.state, self.start, self.end)
+
+
+    def close(self):
+        self.fetcher.close()
+
+
+    def create_engine(self):
+        self.engine = h.db_connect()
+
+
+    def local_sink(self):
+        try:
+            import pyarrow
+        except ImportError:
+            return JSONSink(self.ROOTDIR)
+        return ParquetSink(self.ROOTDIR + 'parquet/')
+
+
+    def get_sink(self):
+        if self.sink is None:
+            self.sink = DBSink(self.engine) if self.writetodb else self.local_sink()
+        return self.sink
+
+
+    def write(self, rows, key):
+        self.get_sink().write(self.DBTABLE, rows, key)
+        print('Written')
+
+
+
+class MandiPriceScraper(MandiScraper):
+    """
+     Scrapes prices over a date range and writes output
+
+    Args:
+        commodity (str): Commodity to scrape data for
+        state (str): State to scrape data for
+        start (str): Start of period to scrape data for
+        end (str): End of period to scrape data for
+        serverless (bool): Lambda execution flag
+        writetodb (bool): Flag for inserting into db or saving json
+        pages (tuple): [Optional] (first, last) page range to scrape; defaults to all pages
+        url (str): [Optional] Site to scrape; defaults to agmarknet
+        fetcher (str or Fetcher): [Optional] See MandiScraper
+        sink (Sink): [Optional] See MandiScraper
+    """
+    SCRAPE_TYPE = 'Price'
+    DBTABLE = 'prices'
+
+    def __init__(self, commodity, state, start=None, end=None, serverless=True, writetodb=True, pages=None,
+                 url=None, fetcher=None, sink=None):
+        super().__init__(commodity, state, start, end, serverless, writetodb, url, fetcher, sink)
+        self.parser = PriceTableParser()
+        self.BATCH_PAGES = 5
+        self.ROWS_PER_PAGE = 50
+        self.MAX_REFETCH = 2
+        self.MAX_FAILURES = 5
+        self.SWEEPS = 2
+        self.PAGER = 'ctl00$cphBody$GridPriceData'
+        self.set_pages(pages)
+
+
+    def set_pages(self, pages):
+        self.pages = pages
+        job = 'prices_{}_{}_{}_{}'.format(self.commodity, self.state, self.start, self.end)
+        if pages:
+            job = job + '_p{}-{}'.format(*pages)
+        self.checkpoint = Checkpoint(job, self.ROOTDIR + 'checkpoints/')
+
+
     def get_pagecount(self):
-        heading = self.driver.find_element_by_id('cphBody_LabComName').text
+        """
+        Reads the total record count, and infers rows per page from the first
+        page rather than assuming the site's current page size
+        """
+        source = self.fetcher.source()
+        heading = parse_heading(source)
+        self.heading = heading
         if 'Total' in heading:
             self.data = 'Yes'
             record_count = int(re.findall(r'\d+\d*', heading.split(' ')[-1])[0])
-            self.page_count = int(math.ceil(record_count/50))
+            self.record_count = record_count
+            self.rows_per_page = self.parser.count(source) or self.ROWS_PER_PAGE
+            self.page_count = int(math.ceil(record_count/self.rows_per_page))
             print('Page Count: {}'.format(self.page_count))
         else:
             self.data = 'No'
             print('No Available Data')
 
-        
-        
-    def extract_prices(self):
-        table_rows = self.driver.find_elements_by_xpath('//table[@class="tableagmark_new"]//tr')
-        for row in table_rows[1:]:
-            td = row.find_elements_by_xpath(".//td/span")
-            if len(td) > 0:
-                record = {
-                    'commodity': td[2].text,
-                    'date': pd.to_datetime(td[8].text),
-                    'state': self.state,
-                    'district': td[0].text,
-                    'market': td[1].text,
-                    'grade': td[4].text,
-                    'variety': td[3].text,
-                    'max_price': pd.to_numeric(td[6].text).astype(float),
-                    'min_price': pd.to_numeric(td[5].text).astype(float),
-                    'modal_price': pd.to_numeric(td[7].text).astype(float)
-                    } 
-            self.prices.append(record)
-    
-    
-    def scrape_prices(self):
-        counter = 1
-        self.prices = []
-        while counter <= self.page_count:
-            print('Scraping {} of {}'.format(counter, self.page_count))
-            self.extract_prices()
-            try:
-                next_icon = self.driver.find_element_by_xpath('//input[contains(@src,"Next.png")]')
-                next_icon.send_keys(Keys.SPACE)
-                counter +=1
-                time.sleep(5)
-            except NoSuchElementException:
-                break
-        self.prices = [i for n, i in enumerate(self.prices) if i not in self.prices[n + 1:]]
-
-                                
-    def write_locally(self):
-        path = pathlib.Path(self.ROOTDIR)
-        path.mkdir(parents=True, exist_ok=True)
-        self.path = path
-        fn = 'prices_{}_{}_{}.json'.format(self.state, self.start, self.end)
-        with open((self.path/fn), 'w') as outfile:
-            json.dump(self.prices, outfile)
-        
-        
-    def write_db(self):
-        engine = h.db_connect()
-        Session = sessionmaker(bind=engine)
-        session = Session()
-        Base = declarative_base(engine)
-        metadata = MetaData(bind=engine)
-        class Prices(Base):
-            __table__ = Table(self.DBTABLE, metadata, autoload=True)
-        for price in self.prices:
-            row = Prices(**price)
+
+
+    def extract_prices(self, source=None):
+        self.source = source or self.fetcher.source()
+        self.prices = self.parser.parse(self.source, self.query())
+
+
+    ## Page cursor
+
+    def goto_page(self, page, reload=False):
+        """
+        Moves the fetcher to page. The next page is a click on Next; other
+        pages are a jump where the grid's numbered pager allows one, and
+        otherwise Next clicks, from page 1 if the page is behind us. A jump
+        that doesn't land on page falls back to Next clicks from page 1
+        """
+        if page == self.fetcher.page and not reload:
+            return
+        if page == self.fetcher.page + 1 and not reload:
+            self.fetcher.next_page()
+            return
+        if self.fetcher.can_jump(self.PAGER):
+            if self.fetcher.jump_to(self.PAGER, page):
+                return
+            print('Pager didn\'t land on page {}; paging with Next'.format(page))
+            self.restart()
+        elif page <= self.fetcher.page:
+            self.restart()
+        while self.fetcher.page < page:
+            self.fetcher.next_page()
+
+
+    def restart(self):
+        """Fresh session back on page 1 of the results, e.g. after a failure"""
+        self.close()
+        self.setup_driver()
+        self.open_page()
+        self.populate_dropdowns()
+
+
+    def expected_rows(self, page):
+        return min(self.rows_per_page, self.record_count - (page - 1)*self.rows_per_page)
+
+
+    def adapt(self, rows):
+        """A page longer than expected means page size was under-read from page 1"""
+        print('Page size is {}, not {}'.format(rows, self.rows_per_page))
+        self.rows_per_page = rows
+        self.page_count = int(math.ceil(self.record_count/rows))
+
+
+    def fetch_page(self, page, source=None):
+        """Parses the current page, re-fetching it while it comes back short"""
+        for attempt in range(self.MAX_REFETCH + 1):
+            if attempt:
+                print('Page {} short: {} of {} rows, re-fetching'.format(page, len(self.prices), expected))
+                METRICS.incr('page_refetches')
+                self.goto_page(page, reload=True)
+                source = None
+            self.extract_prices(source)
+            if len(self.prices) > self.rows_per_page:
+                self.adapt(len(self.prices))
+            expected = self.expected_rows(page)
+            if len(self.prices) >= expected:
+                return self.prices, True
+        METRICS.incr('short_pages')
+        return self.prices, False
+
+
+    ## Change detection
+
+    def load_fingerprints(self):
+        """Stored fingerprints of the query's dates; needs a DB engine"""
+        self.fingerprints = None
+        if self.engine:
+            self.fingerprints = DateFingerprints(self.engine, self.commodity, self.state, self.start, self.end)
+            self.fingerprints.load()
+
+
+    def skip_known(self):
+        """
+        Marks the pages holding the query's leading stored dates done without
+        reading them, once the page where those dates end agrees: its rows of
+        them come first, none has more rows than stored, those with all their
+        rows on it match, and the rest of its rows are of other dates. Only
+        tried where the pager can jump straight to that page
+
+        Returns:
+            True if that leaves nothing pending
+        """
+        dates, rows = self.fingerprints.prefix()
+        if not rows or rows > self.record_count or not self.fetcher.can_jump(self.PAGER):
+            return False
+        page = int(math.ceil(rows/self.rows_per_page))
+        offset = rows - (page - 1)*self.rows_per_page
+        self.goto_page(page)
+        self.extract_prices()
+        if len(self.prices) != self.expected_rows(page):
+            return False
+        known = set(dates)
+        head, tail = self.prices[:offset], self.prices[offset:]
+        if any(day(r['date']) not in known for r in head) or any(day(r['date']) in known for r in tail):
+            return False
+        for date, group in by_date(head).items():
+            stored = self.fingerprints.stored[date]
+            if len(group) > stored[1] or (len(group) == stored[1] and digest(group) != stored):
+                return False
+        self.fingerprints.confirm(dates)
+        skipped = [p for p in self.pending_pages() if p < page or (p == page and not tail)]
+        self.done.update(skipped)
+        METRICS.incr('pages_unchanged', len(skipped))
+        print('{} stored dates unchanged; skipped {} pages'.format(len(dates), len(skipped)))
+        return not self.pending_pages()
+
+
+    def pending_pages(self):
+        first, last = self.pages or (1, self.page_count)
+        return [p for p in range(first, min(last, self.page_count) + 1) if p not in self.done]
+
+
+    def load_progress(self):
+        """
+        Pages committed by an earlier run of the same job, and the
+        fingerprint sums of their rows. A changed record count means results
+        have shifted, so the job starts over
+        """
+        self.done = set()
+        self.failures = 0
+        progress = self.checkpoint.load()
+        if progress and progress.get('record_count') == self.record_count:
+            self.done = set(progress.get('done') or range(1, progress.get('page', 0) + 1))
+            self.rows_per_page = progress.get('rows_per_page', self.rows_per_page)
+            self.page_count = int(math.ceil(self.record_count/self.rows_per_page))
+            print('Resuming, {} pages already written'.format(len(self.done)))
+            if self.fingerprints and 'fingerprints' in progress:
+                self.fingerprints.restore(progress['fingerprints'])
+            elif self.done:
+                # written before sums were checkpointed; the dates can't be fingerprinted
+                self.fingerprints = None
+
+
+    def iter_pages(self, pending):
+        """
+        Generator - yields (page, records, complete) for each pending page.
+        A page that fails is skipped with a fresh session, to be retried on
+        the next sweep
+        """
+        for page in pending:
+            print('Scraping {} of {}'.format(page, self.page_count))
             try:
-                session.add(row)
-            except IntegrityError:
-                print('Integrity Error: Duplicate Record')
+                self.goto_page(page)
+                records, complete = self.fetch_page(page)
+            except self.fetcher.errors + (ValueError,) as e:
+                METRICS.error('page_fetch', e, page=page)
+                self.failures += 1
+                if self.failures > self.MAX_FAILURES:
+                    raise
+                self.restart()
                 continue
-        session.commit()
-        session.close()
-        
-        
-    def write(self):
-        if self.writetodb:
-            self.write_db()
+            METRICS.incr('pages')
+            if complete and self.fingerprints:
+                self.fingerprints.add(records)
+            yield page, records, complete
+
+
+    @timed('dedupe')
+    def dedupe(self, records):
+        return list({tuple(r.items()): r for r in records}.values())
+
+
+    def unseen(self, records):
+        """records, less those of dates wholly in them that match their fingerprints"""
+        same = self.fingerprints.unchanged(records) if self.fingerprints else []
+        if not same:
+            return records
+        METRICS.incr('rows_unchanged', len(same), table=self.DBTABLE)
+        same = {id(r) for r in same}
+        return [r for r in records if id(r) not in same]
+
+
+    def flush(self, records, pages):
+        """
+        Writes a batch, less dates already stored as they are, then records
+        its complete pages; short pages stay pending
+        """
+        self.prices = self.dedupe(self.unseen(records))
+        self.page = max(pages)
+        if self.prices:
+            self.write(self.prices, '{}_{}_{}_{}'.format(self.state, self.start, self.end, self.page))
+        METRICS.incr('rows', len(self.prices), table=self.DBTABLE)
+        self.done.update(page for page, complete in pages.items() if complete)
+        progress = {'fingerprints': self.fingerprints.progress()} if self.fingerprints else {}
+        self.checkpoint.save(done=sorted(self.done), record_count=self.record_count,
+                             rows_per_page=self.rows_per_page, **progress)
+
+
+    def scrape_prices(self):
+        """
+        Scrapes pending pages in sweeps. Pages that failed or came back short
+        are retried on the next sweep; any still pending at the end are left
+        in the checkpoint, so a rerun fetches only those
+        """
+        self.load_fingerprints()
+        self.load_progress()
+        if self.fingerprints and self.skip_known():
+            print('No changes since the last scrape')
+        for sweep in range(self.SWEEPS):
+            pending = self.pending_pages()
+            if not pending:
+                break
+            if sweep:
+                print('Retrying pages {}'.format(pending))
+            batch, pages = [], {}
+            for page, records, complete in self.iter_pages(pending):
+                batch.extend(records)
+                pages[page] = complete
+                if len(pages) == self.BATCH_PAGES:
+                    self.flush(batch, pages)
+                    batch, pages = [], {}
+            if pages:
+                self.flush(batch, pages)
+        pending = self.pending_pages()
+        if pending:
+            METRICS.incr('incomplete_pages', len(pending), table=self.DBTABLE)
+            print('Pages {} incomplete; rerun to retry them'.format(pending))
         else:
-            self.write_locally()
-        print('Written')
+            if self.fingerprints:
+                first, last = self.pages or (1, self.page_count)
+                self.fingerprints.save_part(first, min(last, self.page_count), self.page_count, self.record_count)
+            self.checkpoint.clear()
+
 
-        
     def run(self):
+        if self.writetodb:
+            self.create_engine()
         self.setup_driver()
-        self.open_page()
-        self.populate_dropdowns()
-        self.get_pagecount()
-        if self.data == 'Yes':
-            self.scrape_prices()
-            self.write()
-        self.driver.close()
+        try:
+            self.open_page()
+            self.populate_dropdowns()
+            self.get_pagecount()
+            if self.data == 'Yes':
+                self.scrape_prices()
+        finally:
+            self.close()
 
 
 
-class MandiArrivalScraper(object):
+class MandiArrivalScraper(MandiScraper):
     """
      Scrapes arrivals data
 
@@ -247,124 +454,42 @@ class MandiArrivalScraper(object):
         start (str): Start of period to scrape data for
         end (str): End of period to scrape data for
         serverless (bool): Lambda execution flag
+        url (str): [Optional] Site to scrape; defaults to agmarknet
+        fetcher (str or Fetcher): [Optional] See MandiScraper; a started fetcher can be shared across days
     """
-    def __init__(self, commodity, state, start, end, serverless):
-        self.commodity = commodity
-        self.state = state
-        self.start = start
-        self.end = end
-        self.serverless = serverless
-        self.URL = 'http://agmarknet.gov.in/'
-        self.DRIVER_DIR = '/Users/inayatkhosla/Downloads/chromedriver'
+    SCRAPE_TYPE = 'Arrival'
+    DBTABLE = 'arrivals'
+
+    def __init__(self, commodity, state, start, end, serverless, url=None, fetcher=None):
+        super().__init__(commodity, state, start, end, serverless, False, url, fetcher)
+        self.parser = ArrivalsParser()
+
 
-            
-    def setup_driver_reg(self):
-        chrome_options = Options()  
-        chrome_options.add_argument("--headless")
-        self.driver = webdriver.Chrome(executable_path=self.DRIVER_DIR, options=chrome_options)
-        
-    
-    def setup_driver_lambda(self):
-        chrome_options = webdriver.ChromeOptions()
-        chrome_options.add_argument('--headless')
-        chrome_options.add_argument('--no-sandbox')
-        chrome_options.add_argument('--disable-gpu')
-        chrome_options.add_argument('--window-size=1280x1696')
-        chrome_options.add_argument('--user-data-dir=/tmp/user-data')
-        chrome_options.add_argument('--hide-scrollbars')
-        chrome_options.add_argument('--enable-logging')
-        chrome_options.add_argument('--log-level=0')
-        chrome_options.add_argument('--v=99')
-        chrome_options.add_argument('--single-process')
-        chrome_options.add_argument('--data-path=/tmp/data-path')
-        chrome_options.add_argument('--ignore-certificate-errors')
-        chrome_options.add_argument('--homedir=/tmp')
-        chrome_options.add_argument('--disk-cache-dir=/tmp/cache-dir')
-        chrome_options.add_argument('user-agent=Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/61.0.3163.100 Safari/537.36')
-        chrome_options.binary_location = os.getcwd() + "/bin/headless-chromium"
-        self.driver = webdriver.Chrome(chrome_options=chrome_options)
-    
-    
-    def setup_driver(self):
-        if self.serverless:
-            self.setup_driver_lambda()
-        else:
-            self.setup_driver_reg()
-    
-    
-    def open_page(self):
-        self.driver.get(self.URL)
-        
-        
-    def select_scrape_type(self):
-        element = Select(self.driver.find_element_by_id('ddlArrivalPrice'))
-        element.select_by_visible_text('Arrival')
-        
-        
-    def select_commodity(self):
-        element = Select(self.driver.find_element_by_id('ddlCommodity'))
-        element.select_by_visible_text(self.commodity)
-        #self.commodities = [o.text for o in element.options]
-        
-        
-    def select_state(self):
-        element = Select(self.driver.find_element_by_id('ddlState'))
-        element.select_by_visible_text(self.state)
-        
-        
-    def select_daterange(self):
-        startdate = self.driver.find_element_by_id('txtDate')
-        startdate.clear()
-        startdate.send_keys(self.start)
-        endate = self.driver.find_element_by_id('txtDateTo')
-        endate.clear()
-        endate.send_keys(self.end)
-        time.sleep(3)
-        endate.send_keys(Keys.ENTER)
-    
-    
-    def populate_dropdowns(self):
-        self.select_scrape_type()
-        self.select_commodity()
-        self.select_state()
-        time.sleep(3)
-        self.select_daterange()
-        time.sleep(3)
-        
-        
     def unfurl_quantities(self):
-        while True:
-            try:
-                plus_icon = self.driver.find_element_by_xpath('//input[contains(@src,"plus.png")]')
-                plus_icon.send_keys(Keys.SPACE)
-                time.sleep(1)
-            except NoSuchElementException:
-                break
+        self.fetcher.expand_all()
+
 
-                
-                
     def extract_quantities(self):
-        m = self.driver.find_elements_by_xpath('//span[contains(@id,"MarketName")]')
-        q = self.driver.find_elements_by_xpath('//span[contains(@id,"Lab2Arrival")]')
-        quantities = list(zip([i.text for i in m], [i.text for i in q]))
-        self.arrivals = {
-            'commodity': self.commodity,
-            'date': self.start,
-            'state': self.state,
-            'Arrivals': quantities
-                    }
-                
+        self.arrivals = self.parser.parse(self.fetcher.source(), self.query())
 
-    def run(self):
-        self.setup_driver()
+
+    def fetch(self):
+        """Searches and reads one query on an already started fetcher"""
         self.open_page()
         self.populate_dropdowns()
         self.unfurl_quantities()
         self.extract_quantities()
-        self.driver.close()
 
 
-class MandiQuantityScraper(object):
+    def run(self):
+        self.setup_driver()
+        try:
+            self.fetch()
+        finally:
+            self.close()
+
+
+class MandiQuantityScraper(MandiScraper):
     """
      Wrapper - scrapes, processes, and writes arrival data
 
@@ -375,93 +500,103 @@ class MandiQuantityScraper(object):
         end (str): End of period to scrape data for
         serverless (bool): Lambda execution flag
         writetodb (bool): Flag for inserting into db or saving json
+        url (str): [Optional] Site to scrape; defaults to agmarknet
+        fetcher (str or Fetcher): [Optional] See MandiScraper
+        sink (Sink): [Optional] See MandiScraper
     """
-    def __init__(self, commodity, state, start=None, end=None, serverless=True, writetodb=True):
-        self.commodity = commodity
-        self.state = state
-        self.start = start
-        self.end = end
-        self.serverless = serverless
-        self.writetodb = writetodb
-        self.ROOTDIR = 'data/'
-        self.DBTABLE = 'arrivals'
-        if not self.start:
-            self.start = str(pd.to_datetime('today').date())
-            self.end = str(pd.to_datetime('today').date())
-    
-    
-    def create_engine(self):
-        self.engine = h.db_connect()
-    
-    
+    SCRAPE_TYPE = 'Arrival'
+    DBTABLE = 'arrivals'
+
+    def __init__(self, commodity, state, start=None, end=None, serverless=True, writetodb=True, url=None,
+                 fetcher=None, sink=None):
+        super().__init__(commodity, state, start, end, serverless, writetodb, url, fetcher, sink)
+        self.BATCH_DAYS = 7
+        self.checkpoint = Checkpoint('arrivals_{}_{}_{}_{}'.format(
+            self.commodity, self.state, self.start, self.end), self.ROOTDIR + 'checkpoints/')
+
+
     def get_locationmaps(self):
+        import pandas as pd
         conn = self.engine.connect()
-        self.lm = pd.read_sql('select * from location_map', con=conn)
+        with METRICS.timer('db_query', table='location_map'):
+            self.lm = pd.read_sql('select * from location_map', con=conn)
         conn.close()
-        
-    
+
+
     def get_timeperiods(self):
+        import pandas as pd
         dr = pd.date_range(self.start, self.end, freq='D')
+        progress = self.checkpoint.load()
+        if progress:
+            print('Resuming after {}'.format(progress['date']))
+            dr = dr[dr > pd.to_datetime(progress['date'])]
         self.times = [t.strftime('%d-%b-%Y') for t in dr]
 
-        
-    def scrape(self):
-        daily_arrivals = []
-        for i in self.times:
-            print('Pulling {}'.format(i))
-            mas = MandiArrivalScraper(self.commodity, self.state, i, i, self.serverless)
-            mas.run()
-            daily_arrivals.append(mas.arrivals)
-            time.sleep(3)
+
+    def iter_days(self):
+        """Generator - yields each day's arrivals as it's scraped, with one session for all days"""
+        if not self.times:
+            return
+        self.setup_driver()
+        try:
+            for i in self.times:
+                print('Pulling {}'.format(i))
+                mas = MandiArrivalScraper(self.commodity, self.state, i, i, self.serverless, self.URL,
+                                          self.fetcher)
+                mas.fetch()
+                METRICS.incr('pages')
+                yield mas.arrivals
+                wait(3)
+        finally:
+            self.close()
+
+
+    def flush(self, daily_arrivals):
         self.daily_arrivals = daily_arrivals
-        
-    
+        self.process()
+        self.write(self.arrivals, '{}_{}_{}'.format(self.state, daily_arrivals[0]['date'],
+                                                     daily_arrivals[-1]['date']))
+        METRICS.incr('rows', len(self.arrivals), table=self.DBTABLE)
+        self.checkpoint.save(date=daily_arrivals[-1]['date'])
+
+
+    def scrape(self):
+        batch = []
+        for arrivals in self.iter_days():
+            batch.append(arrivals)
+            if len(batch) == self.BATCH_DAYS:
+                self.flush(batch)
+                batch = []
+        if batch:
+            self.flush(batch)
+        self.checkpoint.clear()
+
+
+    @timed('process_arrivals')
     def process(self):
-        arrivals = json_normalize(self.daily_arrivals, 'Arrivals', ['date', 'state', 'commodity'])
-        arrivals.rename(columns={0: 'market', 1: 'quantity'}, inplace=True)
-        arrivals['date'] = pd.to_datetime(arrivals['date'])
-        arrivals['quantity'] = pd.to_numeric(arrivals['quantity']).astype(float)
-        arrivals.reset_index(drop=True, inplace=True)
-        dmaps = self.lm[['district', 'market']].drop_duplicates().set_index('market')['district'].to_dict()
-        arrivals['district'] = arrivals['market'].map(dmaps)
-        arrivals = arrivals.drop_duplicates()
-        arrivals = arrivals[['commodity','date','state','district','market','quantity']]
-        self.arrivals = arrivals.to_dict('records')
-        
-    
-    def write_locally(self):
-        path = pathlib.Path(self.ROOTDIR)
-        path.mkdir(parents=True, exist_ok=True)
-        self.path = path
-        fn = 'prices_{}_{}_{}.json'.format(self.state, self.start, self.end)
-        with open((self.path/fn), 'w') as outfile:
-            json.dump(self.prices, outfile)
-        
-        
-    def write_db(self):
-        Session = sessionmaker(bind=self.engine)
-        session = Session()
-        Base = declarative_base(self.engine)
-        metadata = MetaData(bind=self.engine)
-        class Arrivals(Base):
-            __table__ = Table(self.DBTABLE, metadata, autoload=True)
-        for arrival in self.arrivals:
-            row = Arrivals(**arrival)
-            try:
-                session.add(row)
-            except IntegrityError:
-                print('Integrity Error: Duplicate Record')
+        """
+        Builds arrival rows straight from each day's (market, quantity)
+        pairs: dates are parsed once per day and quantities converted in one
+        array, with no frame in between
+        """
+        import numpy as np
+        dates, markets, quantities, states, commodities = [], [], [], [], []
+        for day in self.daily_arrivals:
+            n = len(day['Arrivals'])
+            if not n:
                 continue
-        session.commit()
-        session.close()
-        
-        
-    def write(self):
-        if self.writetodb:
-            self.write_db()
-        else:
-            self.write_locally()
-        print('Written')
+            m, q = zip(*day['Arrivals'])
+            markets.extend(m)
+            quantities.extend(q)
+            dates.extend([datetime.datetime.strptime(day['date'], '%d-%b-%Y')] * n)
+            states.extend([day['state']] * n)
+            commodities.extend([day['commodity']] * n)
+        quantities = np.asarray(quantities, dtype=str).astype(float).tolist()
+        dmaps = dict(zip(self.lm['market'], self.lm['district']))
+        districts = [dmaps.get(market) for market in markets]
+        unique = dict.fromkeys(zip(commodities, dates, states, districts, markets, quantities))
+        cols = ['commodity', 'date', 'state', 'district', 'market', 'quantity']
+        self.arrivals = [dict(zip(cols, row)) for row in unique]
 
 
     def run(self):
@@ -469,5 +604,3 @@ class MandiQuantityScraper(object):
         self.get_locationmaps()
         self.get_timeperiods()
         self.scrape()
-        self.process()
-        self.write()
\ No newline at end of file
@@ -0,0 +1,183 @@
+"""
+seasons.py:
+    Season-aligned daily aggregates for comparing the current season with
+    earlier ones. Dates are mapped to (season, day of season) - Kinnow's
+    November to March season starting in 2018 is season 2018, and 1 Nov 2018
+    is its day 0 - and daily medians (prices) and totals (arrivals) are
+    precomputed per state, per market, and across all states into
+    season_aggregates. A market's rows carry its state and district, so
+    markets of the same name elsewhere stay apart
+
+    Past seasons are built once; the nightly update only recomputes the last
+    few days, so "current vs. prior seasons" reads a few hundred
+    precomputed rows instead of scanning seasons of raw data
+
+    Season (cls): Maps dates to seasons and days of season
+    SeasonalBaselines (cls): Builds and updates season_aggregates
+"""
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+import lib.helpers as h
+from lib.metrics import timed
+
+KEYS = ['commodity', 'datatype', 'level', 'state', 'district', 'region', 'grade', 'season', 'day']
+# markets are keyed on their state and district too, as names repeat across them
+LEVELS = [('market', ['state', 'district', 'market']), ('state', ['state']), ('combined', [])]
+
+
+class Season(object):
+    """
+    Maps dates to seasons and days of season
+
+    Args:
+        start_month (int): First month of the season
+        end_month (int): Last month of the season; may wrap past December
+    """
+    def __init__(self, start_month=11, end_month=3):
+        self.start_month = start_month
+        self.end_month = end_month
+        self.wraps = end_month < start_month
+
+
+    def months(self):
+        if self.wraps:
+            return list(range(self.start_month, 13)) + list(range(1, self.end_month + 1))
+        return list(range(self.start_month, self.end_month + 1))
+
+
+    def label(self, dates):
+        """Season each date falls in, named by the year it starts; NaN out of season"""
+        dates = pd.DatetimeIndex(dates)
+        season = dates.year - ((dates.month < self.start_month) if self.wraps else 0)
+        return pd.Series(np.where(dates.month.isin(self.months()), season, np.nan), index=dates)
+
+
+    def bounds(self, season):
+        start = pd.Timestamp(year=season, month=self.start_month, day=1)
+        end_year = season + 1 if self.wraps else season
+        end = pd.Timestamp(year=end_year, month=self.end_month, day=1) + pd.offsets.MonthEnd(0)
+        return start, end
+
+
+    def current(self, today=None):
+        """The season in progress, or the most recent one if between seasons"""
+        today = pd.to_datetime(today or 'today').normalize()
+        season = today.year - (1 if today.month < self.start_month else 0)
+        start, _ = self.bounds(season)
+        return season if start <= today else season - 1
+
+
+    def assign(self, df):
+        """Adds season and day of season columns to df, dropping out of season rows"""
+        df = df.assign(season=self.label(df['date']).values)
+        df = df[df['season'].notnull()]
+        season = df['season'].astype(int)
+        starts = pd.to_datetime(season.astype(str) + '-{:02d}-01'.format(self.start_month))
+        return df.assign(season=season, day=(df['date'] - starts).dt.days)
+
+
+
+class SeasonalBaselines(object):
+    """
+    Builds and updates season_aggregates for a commodity
+
+    Args:
+        commodity (str): Commodity to aggregate
+        season (Season): Season definition; defaults to November - March
+        engine (engine): [Optional] SQLAlchemy engine; defaults to helpers.db_connect()
+
+    Usage:
+        sb = SeasonalBaselines('Kinnow')
+        sb.build(2015)          # once, for past seasons
+        sb.update()             # nightly
+    """
+    def __init__(self, commodity, season=None, engine=None):
+        self.commodity = commodity
+        self.season = season or Season()
+        self.engine = engine
+        self.DBTABLE = 'season_aggregates'
+
+
+    def connect(self):
+        if not self.engine:
+            self.engine = h.db_connect()
+
+
+    def load(self, table, start, end):
+        query = text('select * from {} where commodity = :commodity and date between :start and :end'
+                     .format(table))
+        params = dict(commodity=self.commodity, start=str(start.date()), end=str(end.date()))
+        with self.engine.connect() as conn:
+            df = pd.read_sql(query, con=conn, params=params)
+        df['date'] = pd.to_datetime(df['date'])
+        return df
+
+
+    def label(self, agg, level, region):
+        """Level and region of aggregates, with the state and district they're in; '' above them"""
+        agg = agg.assign(level=level, region=agg[region[-1]] if region else 'Combined')
+        for col in ['state', 'district']:
+            if col not in region:
+                agg[col] = ''
+        return agg
+
+
+    def aggregate_prices(self, prices):
+        cols = ['min_price', 'modal_price', 'max_price']
+        out = []
+        for level, region in LEVELS:
+            agg = prices.groupby(['grade', 'season', 'day', 'date'] + region)[cols].median().reset_index()
+            out.append(self.label(agg, level, region))
+        out = pd.concat(out, sort=False)
+        return out.assign(commodity=self.commodity, datatype='prices', quantity=np.nan)
+
+
+    def aggregate_arrivals(self, arrivals):
+        out = []
+        for level, region in LEVELS:
+            agg = arrivals.groupby(['season', 'day', 'date'] + region)['quantity'].sum().reset_index()
+            out.append(self.label(agg, level, region))
+        out = pd.concat(out, sort=False)
+        return out.assign(commodity=self.commodity, datatype='arrivals', grade='All',
+                          min_price=np.nan, modal_price=np.nan, max_price=np.nan)
+
+
+    @timed('season_aggregate')
+    def aggregate(self, start, end):
+        prices = self.season.assign(self.load('prices', start, end))
+        arrivals = self.season.assign(self.load('arrivals', start, end))
+        frames = []
+        if not prices.empty:
+            frames.append(self.aggregate_prices(prices))
+        if not arrivals.empty:
+            frames.append(self.aggregate_arrivals(arrivals))
+        if not frames:
+            return pd.DataFrame(columns=KEYS)
+        cols = KEYS + ['date', 'min_price', 'modal_price', 'max_price', 'quantity']
+        return pd.concat(frames, sort=False)[cols]
+
+
+    def write(self, aggregates):
+        rows = aggregates.astype(object).where(aggregates.notnull(), None)
+        h.upsert_rows(self.engine, self.DBTABLE, rows.to_dict('records'))
+        print('Written {} season aggregates'.format(len(rows)))
+
+
+    def build(self, first_season=2015, last_season=None):
+        """Aggregates whole seasons, one at a time"""
+        self.connect()
+        last_season = last_season or self.season.current()
+        for season in range(first_season, last_season + 1):
+            print('Aggregating season {}'.format(season))
+            start, end = self.season.bounds(season)
+            self.write(self.aggregate(start, end))
+
+
+    def update(self, lookback=7, today=None):
+        """Re-aggregates the last lookback days, picking up late-arriving rows"""
+        self.connect()
+        end = pd.to_datetime(today or 'today').normalize()
+        self.write(self.aggregate(end - pd.Timedelta(days=lookback), end))
@@ -0,0 +1,186 @@
+"""
+snapshot.py:
+    Latest market conditions, maintained as rows are written. latest_prices
+    holds each (commodity, state, district, market, grade)'s newest row
+    with its PERIOD-row rolling averages, and latest_arrivals each market's
+    newest arrival with its rolling average and the total arrived over the
+    last WINDOW days. CurrentMarkets reads these few hundred rows rather
+    than three months of history
+
+    Each write recomputes the snapshot for the states it touched, from the
+    last WINDOW days before the commodity's newest date. Backfills older
+    than that leave it alone
+
+    CurrentMarketProcessor.prep_data cuts history off at today less tcutoff
+    days, not at the newest date, and its rolling averages and totals only
+    count rows after the cutoff. So each snapshot row also keeps, in
+    recent, the rows its figures come from - a price series' last PERIOD
+    rows, a market's arrivals for every day in the window - and at_cutoff()
+    recomputes the figures from those at read time
+
+    MarketSnapshot (cls): Updates and rebuilds the snapshot tables
+    at_cutoff (func): Snapshot rows as prep_data would compute them at a cutoff
+"""
+
+import json
+
+import pandas as pd
+from sqlalchemy import text, bindparam
+
+import lib.helpers as h
+from lib.metrics import timed
+
+PERIOD = 3
+WINDOW = 7
+TABLES = {'prices': 'latest_prices', 'arrivals': 'latest_arrivals'}
+KEYS = {
+    'prices': ['commodity', 'state', 'district', 'market', 'grade'],
+    'arrivals': ['commodity', 'state', 'district', 'market'],
+    }
+
+
+# columns of each entry in recent, after its date
+RECENT = {'prices': ['modal_price', 'price_range'], 'arrivals': ['quantity']}
+
+
+def rolling_mean(df, keys, col):
+    return df.groupby(keys)[col].transform(lambda x: x.rolling(PERIOD, min_periods=1).mean())
+
+
+def pack(df, keys, columns, last=None):
+    """Each group's rows as a json list of [date, *columns], oldest first; its last rows if last is given"""
+    if last:
+        df = df.groupby(keys).tail(last)
+    entries = pd.Series(list(zip(df['date'].dt.strftime('%Y-%m-%d'), *(df[c] for c in columns))), index=df.index)
+    return entries.groupby([df[k] for k in keys], sort=False).agg(lambda e: json.dumps(list(e)))
+
+
+def unpack(latest, keys, columns):
+    """One row per entry in each snapshot row's recent"""
+    rows = [key + tuple(entry) for key, recent in zip(latest[keys].itertuples(index=False, name=None), latest['recent'])
+            for entry in json.loads(recent)]
+    df = pd.DataFrame(rows, columns=keys + ['date'] + columns).astype({c: float for c in columns})
+    return df.assign(date=pd.to_datetime(df['date']))
+
+
+def at_cutoff(datatype, latest, cutoff):
+    """
+    Snapshot rows newer than cutoff, with rolling averages - and for
+    arrivals the total - over only their recent rows newer than cutoff,
+    as CurrentMarketProcessor.prep_data computes them from history
+    """
+    keys, columns = KEYS[datatype], RECENT[datatype]
+    latest = latest.assign(date=pd.to_datetime(latest['date']))
+    latest = latest[latest['date'] > cutoff]
+    recent = unpack(latest, keys, columns)
+    recent = recent[recent['date'] > cutoff]
+    grouped = recent.groupby(keys)
+    if datatype == 'prices':
+        means = grouped.tail(PERIOD).groupby(keys)[columns].mean().round()
+        figures = means.rename(columns={'modal_price': 'r_modal_price', 'price_range': 'r_price_range'})
+    else:
+        figures = pd.DataFrame({'r_quantity': grouped.tail(PERIOD).groupby(keys)['quantity'].mean().round(1),
+                                'recent_quantity': grouped['quantity'].sum()})
+    latest = latest.drop(columns=list(figures.columns))
+    return latest.merge(figures.reset_index(), on=keys, how='left')
+
+
+
+class MarketSnapshot(object):
+    """
+    Updates and rebuilds the snapshot tables
+
+    Args:
+        engine (engine): [Optional] SQLAlchemy engine; defaults to helpers.db_connect()
+
+    Usage:
+        ms = MarketSnapshot()
+        ms.rebuild('Kinnow')                # once, from raw history
+        ms.update('prices', rows)           # as rows are written
+    """
+    def __init__(self, engine=None):
+        self.engine = engine
+
+
+    def connect(self):
+        if not self.engine:
+            self.engine = h.db_connect()
+
+
+    def query(self, sql, **params):
+        stmt = text(sql)
+        if 'states' in params:
+            stmt = stmt.bindparams(bindparam('states', expanding=True))
+        with self.engine.connect() as conn:
+            return pd.read_sql(stmt, con=conn, params=params)
+
+
+    def since(self, datatype, commodity):
+        """The day before the commodity's snapshot window starts, or None without data"""
+        latest = self.query('select max(date) as latest from {} where commodity = :commodity'.format(datatype),
+                            commodity=commodity)['latest'][0]
+        if latest is None:
+            return None
+        return pd.to_datetime(latest) - pd.Timedelta(days=WINDOW)
+
+
+    def load_recent(self, datatype, commodity, since, states=None):
+        sql = 'select * from {} where commodity = :commodity and date > :since'.format(datatype)
+        params = dict(commodity=commodity, since=str(since.date()))
+        if states is not None:
+            sql += ' and state in :states'
+            params['states'] = list(states)
+        df = self.query(sql, **params)
+        return df.assign(date=pd.to_datetime(df['date']))
+
+
+    def latest(self, datatype, recent):
+        """Rolling averages as CurrentMarketProcessor.get_rolling_means, at each group's newest row"""
+        keys = KEYS[datatype]
+        if datatype == 'prices':
+            df = recent.sort_values(keys + ['date', 'variety'])
+            df['price_range'] = df['max_price'] - df['min_price']
+            df['r_modal_price'] = rolling_mean(df, keys, 'modal_price').round()
+            df['r_price_range'] = rolling_mean(df, keys, 'price_range').round()
+            packed = pack(df, keys, RECENT[datatype], PERIOD)
+        else:
+            df = recent.sort_values(keys + ['date'])
+            df['r_quantity'] = rolling_mean(df, keys, 'quantity').round(1)
+            df['recent_quantity'] = df.groupby(keys)['quantity'].transform('sum')
+            packed = pack(df, keys, RECENT[datatype])
+        df = df.groupby(keys).tail(1)
+        df = df.merge(packed.rename('recent').reset_index(), on=keys, how='left')
+        return df.assign(date=df['date'].dt.date)
+
+
+    def write(self, datatype, latest):
+        h.upsert_rows(self.engine, TABLES[datatype], latest.to_dict('records'))
+
+
+    @timed('update_snapshot')
+    def update(self, datatype, rows):
+        """Recomputes the snapshot of each commodity and state in rows"""
+        if not len(rows):
+            return
+        self.connect()
+        df = pd.DataFrame(rows)
+        for commodity, g in df.groupby('commodity'):
+            # a writer that read before another's rows landed mustn't write after it
+            with h.locked(self.engine, '{}|{}'.format(TABLES[datatype], commodity)):
+                since = self.since(datatype, commodity)
+                if since is None or pd.to_datetime(g['date']).max() <= since:
+                    continue
+                recent = self.load_recent(datatype, commodity, since, g['state'].unique())
+                self.write(datatype, self.latest(datatype, recent))
+
+
+    def rebuild(self, commodity):
+        """Rebuilds a commodity's snapshot from raw prices and arrivals"""
+        self.connect()
+        for datatype in ['prices', 'arrivals']:
+            since = self.since(datatype, commodity)
+            if since is None:
+                continue
+            latest = self.latest(datatype, self.load_recent(datatype, commodity, since))
+            self.write(datatype, latest)
+            print('Snapshot {} {} rows'.format(len(latest), datatype))
@@ -0,0 +1,127 @@
+"""
+synthetic.py:
+    Generates realistic synthetic agmarknet data - prices, arrivals, and
+    location maps - at a configurable scale. Output mirrors the shape of the
+    prices, arrivals, and location_map tables, so it can be fed straight to
+    the processors, scrapers, or a local database
+
+    SyntheticAgmarknet (cls): Generates prices, arrivals, and location maps
+"""
+
+import numpy as np
+import pandas as pd
+
+
+STATES = ['Punjab', 'Haryana', 'Rajasthan', 'Himachal Pradesh', 'Uttar Pradesh',
+          'Gujarat', 'Maharashtra', 'Madhya Pradesh', 'Karnataka', 'Tamil Nadu',
+          'West Bengal', 'Odisha', 'Bihar', 'Kerala', 'Telangana', 'NCT of Delhi']
+COMMODITIES = ['Kinnow', 'Apple', 'Onion', 'Potato', 'Tomato', 'Banana', 'Mango',
+               'Orange', 'Grapes', 'Pomegranate', 'Cauliflower', 'Cabbage']
+GRADES = ['Large', 'Medium', 'Small']
+
+
+class SyntheticAgmarknet(object):
+    """
+    Generates prices, arrivals, and location maps. Markets report on a random
+    subset of season days, prices follow a seasonal curve with noise, and
+    arrivals are log-normally distributed
+
+    Args:
+        commodities (int): Number of commodities
+        states (int): Number of states
+        markets (int): Markets per state
+        years (int): Years of history, ending today
+        season (tuple): [Optional] Months markets trade in, e.g. (11, 12, 1, 2, 3) for
+            Kinnow; defaults to year-round
+        coverage (float): Share of season days each market reports on
+        seed (int): Random seed - same arguments always give the same data
+
+    Usage:
+        sa = SyntheticAgmarknet(commodities=2, states=4, markets=20, years=3)
+        prices, arrivals, lm = sa.generate()
+    """
+    def __init__(self, commodities=1, states=4, markets=20, years=3,
+                 season=None, coverage=0.7, seed=0):
+        self.commodities = COMMODITIES[:commodities]
+        self.states = STATES[:states]
+        self.markets = markets
+        self.years = years
+        self.season = season
+        self.coverage = coverage
+        self.seed = seed
+
+
+    def location_map(self):
+        rows = []
+        for state in self.states:
+            for m in range(self.markets):
+                rows.append({
+                    'state': state,
+                    'district': '{} District {}'.format(state, m // 2),
+                    'market': '{} Market {}'.format(state, m)
+                    })
+        return pd.DataFrame(rows)
+
+
+    def trading_days(self):
+        end = pd.to_datetime('today').normalize()
+        days = pd.date_range(end - pd.DateOffset(years=self.years), end, freq='D')
+        if self.season:
+            days = days[days.month.isin(self.season)]
+        return days
+
+
+    def generate_commodity(self, rng, commodity, lm, days):
+        # Every (market, day) pair, thinned to the coverage rate
+        n_mkts, n_days = len(lm), len(days)
+        mi = np.repeat(np.arange(n_mkts), n_days)
+        di = np.tile(np.arange(n_days), n_mkts)
+        keep = rng.random_sample(len(mi)) < self.coverage
+        mi, di = mi[keep], di[keep]
+
+        base = rng.uniform(1200, 4000)
+        market_level = rng.normal(1, 0.1, n_mkts)
+        seasonal = 1 + 0.2*np.sin(2*np.pi*days.dayofyear.values/365.0)
+        a = pd.DataFrame({
+            'commodity': commodity,
+            'date': days[di],
+            'state': lm['state'].values[mi],
+            'district': lm['district'].values[mi],
+            'market': lm['market'].values[mi],
+            'quantity': np.round(rng.lognormal(1.5, 1, len(mi)), 1)
+            })
+
+        # Each reporting market quotes one or more grades
+        grades = rng.randint(1, len(GRADES) + 1, len(mi))
+        quoted = np.arange(len(GRADES)) < grades[:, None]
+        rep = np.nonzero(quoted)[0]
+        gi = np.argsort(rng.random_sample((len(mi), len(GRADES))), axis=1)[quoted]
+        modal = base * market_level[mi][rep] * seasonal[di][rep] * (1.15 - 0.15*gi)
+        modal = np.round(modal * rng.normal(1, 0.05, len(rep)), -1)
+        p = pd.DataFrame({
+            'commodity': commodity,
+            'date': days[di][rep],
+            'state': lm['state'].values[mi][rep],
+            'district': lm['district'].values[mi][rep],
+            'market': lm['market'].values[mi][rep],
+            'grade': np.array(GRADES)[gi],
+            'variety': 'Other',
+            'max_price': np.round(modal * rng.uniform(1.05, 1.3, len(rep)), -1),
+            'min_price': np.round(modal * rng.uniform(0.7, 0.95, len(rep)), -1),
+            'modal_price': modal
+            })
+        return p, a
+
+
+    def generate(self):
+        rng = np.random.RandomState(self.seed)
+        lm = self.location_map()
+        days = self.trading_days()
+        prices, arrivals = [], []
+        for commodity in self.commodities:
+            p, a = self.generate_commodity(rng, commodity, lm, days)
+            prices.append(p)
+            arrivals.append(a)
+        prices = pd.concat(prices, ignore_index=True)
+        arrivals = pd.concat(arrivals, ignore_index=True)
+        return prices, arrivals, lm
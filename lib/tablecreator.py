@@ -1,14 +1,13 @@
 """
 Defines and creates database tables
+
+Run as a script to create them in the configured database:
+    python -m lib.tablecreator
 """
 
 from sqlalchemy import *
 from sqlalchemy.ext.declarative import declarative_base
-import helpers as h
-
-
-# Connect to Postgres Database
-engine = h.db_connect()
+import lib.helpers as h
 
 
 # Define Schema
@@ -46,8 +45,193 @@ class LocationMap(Base):
     market = Column(String, nullable=False, primary_key=True)
     
 
+class ForecastState(Base):
+    __tablename__ = 'forecast_state'
+    commodity = Column(String, nullable=False, primary_key=True)
+    state = Column(String, nullable=False, primary_key=True)
+    district = Column(String, nullable=False, primary_key=True)
+    market = Column(String, nullable=False, primary_key=True)
+    grade = Column(String, nullable=False, primary_key=True)
+    level = Column(Float)
+    trend = Column(Float)
+    alpha = Column(Float)
+    last_date = Column(Date)
+    last_seen = Column(Date)
+
+
+class Forecasts(Base):
+    __tablename__ = 'forecasts'
+    commodity = Column(String, nullable=False, primary_key=True)
+    state = Column(String, nullable=False, primary_key=True)
+    district = Column(String, nullable=False, primary_key=True)
+    market = Column(String, nullable=False, primary_key=True)
+    grade = Column(String, nullable=False, primary_key=True)
+    date = Column(Date, nullable=False, primary_key=True)
+    horizon = Column(Integer)
+    forecast_price = Column(Float)
+    baseline_price = Column(Float)
+    issued = Column(Date)
+
+
+class SeasonAggregates(Base):
+    __tablename__ = 'season_aggregates'
+    commodity = Column(String, nullable=False, primary_key=True)
+    datatype = Column(String, nullable=False, primary_key=True)
+    level = Column(String, nullable=False, primary_key=True)
+    state = Column(String, nullable=False, primary_key=True)
+    district = Column(String, nullable=False, primary_key=True)
+    region = Column(String, nullable=False, primary_key=True)
+    grade = Column(String, nullable=False, primary_key=True)
+    season = Column(Integer, nullable=False, primary_key=True)
+    day = Column(Integer, nullable=False, primary_key=True)
+    date = Column(Date)
+    min_price = Column(Float)
+    modal_price = Column(Float)
+    max_price = Column(Float)
+    quantity = Column(Float)
+
+
+class DateFingerprints(Base):
+    __tablename__ = 'date_fingerprints'
+    commodity = Column(String, nullable=False, primary_key=True)
+    state = Column(String, nullable=False, primary_key=True)
+    date = Column(Date, nullable=False, primary_key=True)
+    fingerprint = Column(String, nullable=False)
+    row_count = Column(Integer, nullable=False)
+    updated = Column(DateTime)
+
+
+class FingerprintParts(Base):
+    __tablename__ = 'fingerprint_parts'
+    commodity = Column(String, nullable=False, primary_key=True)
+    state = Column(String, nullable=False, primary_key=True)
+    start = Column(String, nullable=False, primary_key=True)
+    end = Column(String, nullable=False, primary_key=True)
+    first_page = Column(Integer, nullable=False, primary_key=True)
+    last_page = Column(Integer, nullable=False)
+    page_count = Column(Integer, nullable=False)
+    record_count = Column(Integer, nullable=False)
+    sums = Column(String, nullable=False)
+    updated = Column(DateTime)
+
+
+class Availability(Base):
+    __tablename__ = 'availability'
+    commodity = Column(String, nullable=False, primary_key=True)
+    datatype = Column(String, nullable=False, primary_key=True)
+    level = Column(String, nullable=False, primary_key=True)
+    region = Column(String, nullable=False, primary_key=True)
+    year = Column(Integer, nullable=False, primary_key=True)
+    state = Column(String)
+    days = Column(String, nullable=False)
+
+
+class Quarantine(Base):
+    __tablename__ = 'quarantine'
+    id = Column(Integer, primary_key=True)
+    datatype = Column(String, nullable=False)
+    commodity = Column(String)
+    date = Column(Date)
+    state = Column(String)
+    market = Column(String)
+    reasons = Column(String, nullable=False)
+    record = Column(String, nullable=False)
+    quarantined = Column(DateTime)
+
+
+class LatestPrices(Base):
+    __tablename__ = 'latest_prices'
+    commodity = Column(String, nullable=False, primary_key=True)
+    state = Column(String, nullable=False, primary_key=True)
+    district = Column(String, nullable=False, primary_key=True)
+    market = Column(String, nullable=False, primary_key=True)
+    grade = Column(String, nullable=False, primary_key=True)
+    date = Column(Date, nullable=False)
+    variety = Column(String)
+    max_price = Column(Float)
+    min_price = Column(Float)
+    modal_price = Column(Float)
+    price_range = Column(Float)
+    r_modal_price = Column(Float)
+    r_price_range = Column(Float)
+    recent = Column(String)
+
+
+class LatestArrivals(Base):
+    __tablename__ = 'latest_arrivals'
+    commodity = Column(String, nullable=False, primary_key=True)
+    state = Column(String, nullable=False, primary_key=True)
+    district = Column(String, nullable=False, primary_key=True)
+    market = Column(String, nullable=False, primary_key=True)
+    date = Column(Date, nullable=False)
+    quantity = Column(Float)
+    r_quantity = Column(Float)
+    recent_quantity = Column(Float)
+    recent = Column(String)
+
+
+class ScrapeJobs(Base):
+    __tablename__ = 'scrape_jobs'
+    id = Column(Integer, primary_key=True)
+    job = Column(String, nullable=False, unique=True)
+    datatype = Column(String, nullable=False)
+    commodity = Column(String, nullable=False)
+    state = Column(String, nullable=False)
+    start_date = Column(Date, nullable=False)
+    end_date = Column(Date, nullable=False)
+    first_page = Column(Integer)
+    last_page = Column(Integer)
+    status = Column(String, nullable=False, index=True)
+    attempts = Column(Integer, nullable=False)
+    worker = Column(String)
+    token = Column(String, index=True)
+    lease_until = Column(DateTime)
+    heartbeat = Column(DateTime)
+    error = Column(String)
+    created = Column(DateTime)
+    finished = Column(DateTime)
+
+
+class AnomalyState(Base):
+    __tablename__ = 'anomaly_state'
+    datatype = Column(String, nullable=False, primary_key=True)
+    commodity = Column(String, nullable=False, primary_key=True)
+    state = Column(String, nullable=False, primary_key=True)
+    district = Column(String, nullable=False, primary_key=True)
+    market = Column(String, nullable=False, primary_key=True)
+    grade = Column(String, nullable=False, primary_key=True)
+    recent = Column(String, nullable=False)
+    median = Column(Float)
+    mad = Column(Float)
+    n = Column(Integer)
+    last_date = Column(Date)
+
+
+class Anomalies(Base):
+    __tablename__ = 'anomalies'
+    datatype = Column(String, nullable=False, primary_key=True)
+    commodity = Column(String, nullable=False, primary_key=True)
+    date = Column(Date, nullable=False, primary_key=True)
+    state = Column(String, nullable=False, primary_key=True)
+    district = Column(String, nullable=False, primary_key=True)
+    market = Column(String, nullable=False, primary_key=True)
+    grade = Column(String, nullable=False, primary_key=True)
+    variety = Column(String, nullable=False, primary_key=True)
+    value = Column(Float)
+    median = Column(Float)
+    score = Column(Float)
+    flagged = Column(DateTime)
+
+
+def create_tables(engine):
+    Base.metadata.create_all(engine)
+
+
 # Create tables 
-Base.metadata.create_all(engine)     
-#Prices.__table__.create(bind=engine, checkfirst=True)
-#Arrivals.__table__.create(bind=engine, checkfirst=True)
-#LocationMap.__table__.create(bind=engine, checkfirst=True)
\ No newline at end of file
+if __name__ == "__main__":
+    # Connect to Postgres Database
+    engine = h.db_connect()
+    create_tables(engine)
+    #Prices.__table__.create(bind=engine, checkfirst=True)
+    #Arrivals.__table__.create(bind=engine, checkfirst=True)
+    #LocationMap.__table__.create(bind=engine, checkfirst=True)
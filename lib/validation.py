@@ -0,0 +1,144 @@
+"""
+validation.py:
+    Data-quality checks run over each scraped batch before it is written.
+    Every check is a vectorised mask over the whole batch; rows failing any
+    check are written to the quarantine table with their reasons, and the
+    rest go through. One bad row no longer fails a state's whole load
+
+    Prices:
+        missing_<key>: a primary key column is null or blank, e.g. a market
+            whose district didn't map
+        nonpositive_price: min, max, or modal price is zero, negative, or missing
+        min_above_max: min price is above max price
+        modal_outside_range: modal price is outside [min, max]
+        absurd_price: max price is above max_price
+        unit_shift: modal price is shift times above or below the batch
+            median for the same commodity, variety, and grade - usually a
+            price reported per kg rather than per quintal
+    Arrivals:
+        missing_<key>: as for prices
+        invalid_quantity: quantity is negative or missing
+        absurd_quantity: quantity is above max_quantity
+
+    BatchValidator (cls): Splits batches into valid rows and quarantined rows
+"""
+
+import json
+
+import numpy as np
+import pandas as pd
+
+import lib.helpers as h
+from lib.metrics import METRICS, timed
+
+KEYS = {
+    'prices': ['commodity', 'date', 'state', 'district', 'market', 'grade', 'variety'],
+    'arrivals': ['commodity', 'date', 'state', 'district', 'market'],
+    }
+
+
+def missing(series):
+    blank = series.astype(str).str.strip() == ''
+    return series.isnull() | blank
+
+
+
+class BatchValidator(object):
+    """
+    Splits batches into valid rows and quarantined rows
+
+    Args:
+        engine (engine): [Optional] SQLAlchemy engine to quarantine to; rows are only dropped without one
+        max_price (float): Highest plausible price, in Rs/quintal
+        max_quantity (float): Highest plausible daily arrival, in tonnes
+        shift (float): Ratio to the batch median beyond which a price is flagged as a unit shift
+        min_group (int): Rows of a commodity, variety, and grade needed before unit shifts are checked
+
+    Usage:
+        bv = BatchValidator(engine)
+        rows = bv.filter('prices', rows)       # valid rows; the rest are quarantined
+    """
+    def __init__(self, engine=None, max_price=1e6, max_quantity=1e5, shift=20, min_group=5):
+        self.engine = engine
+        self.max_price = max_price
+        self.max_quantity = max_quantity
+        self.shift = shift
+        self.min_group = min_group
+        self.DBTABLE = 'quarantine'
+
+
+    def check_keys(self, table, df):
+        return {'missing_' + col: missing(df[col]) if col in df else pd.Series(True, index=df.index)
+                for col in KEYS[table]}
+
+
+    def check_prices(self, df):
+        lo, hi, modal = (pd.to_numeric(df[col], errors='coerce')
+                         for col in ['min_price', 'max_price', 'modal_price'])
+        checks = self.check_keys('prices', df)
+        checks['nonpositive_price'] = ~((lo > 0) & (hi > 0) & (modal > 0))
+        checks['min_above_max'] = lo > hi
+        checks['modal_outside_range'] = (modal < lo) | (modal > hi)
+        checks['absurd_price'] = hi > self.max_price
+        group = [df['commodity'], df['variety'], df['grade']]
+        positive = modal.where(modal > 0)
+        median = positive.groupby(group).transform('median')
+        size = positive.groupby(group).transform('count')
+        ratio = positive / median
+        checks['unit_shift'] = (size >= self.min_group) & ((ratio >= self.shift) | (ratio <= 1 / self.shift))
+        return checks
+
+
+    def check_arrivals(self, df):
+        quantity = pd.to_numeric(df['quantity'], errors='coerce')
+        checks = self.check_keys('arrivals', df)
+        checks['invalid_quantity'] = ~(quantity >= 0)
+        checks['absurd_quantity'] = quantity > self.max_quantity
+        return checks
+
+
+    @timed('validate')
+    def check(self, table, df):
+        """Semicolon-separated reasons per row; empty for valid rows"""
+        checks = self.check_prices(df) if table == 'prices' else self.check_arrivals(df)
+        reasons = pd.Series('', index=df.index)
+        for reason, mask in checks.items():
+            mask = mask.fillna(False).astype(bool)
+            reasons[mask] = reasons[mask] + reason + ';'
+        return reasons.str.rstrip(';')
+
+
+    def quarantine(self, table, rows, reasons):
+        now = pd.Timestamp.now().to_pydatetime()
+        records = [{
+            'datatype': table,
+            'commodity': row.get('commodity'),
+            'date': row.get('date'),
+            'state': row.get('state'),
+            'market': row.get('market'),
+            'reasons': reason,
+            'record': json.dumps(row, default=str),
+            'quarantined': now,
+            } for row, reason in zip(rows, reasons)]
+        for record in records:
+            if pd.isnull(record['date']):
+                record['date'] = None
+        h.insert_rows(self.engine, self.DBTABLE, records)
+
+
+    def filter(self, table, rows):
+        """Valid rows of a batch; invalid rows are quarantined"""
+        if not len(rows):
+            return rows
+        reasons = self.check(table, pd.DataFrame(rows))
+        bad = np.flatnonzero(reasons.values != '')
+        if not len(bad):
+            return rows
+        split = pd.Series([reason for joined in reasons.iloc[bad] for reason in joined.split(';')])
+        for reason, n in split.value_counts().items():
+            METRICS.incr('quarantined', int(n), table=table, reason=reason)
+        print('Quarantined {} of {} {} rows'.format(len(bad), len(rows), table))
+        if self.engine is not None:
+            self.quarantine(table, [rows[i] for i in bad], reasons.iloc[bad])
+        bad = set(bad)
+        return [row for i, row in enumerate(rows) if i not in bad]
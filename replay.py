@@ -0,0 +1,38 @@
+import json
+import argparse
+parser = argparse.ArgumentParser()
+
+from lib.replay import ScraperReplay
+
+
+parser.add_argument("--states", type=int, default=2, help="number of states to scrape")
+parser.add_argument("--markets", type=int, default=20, help="markets per state")
+parser.add_argument("--days", type=int, default=3, help="days to scrape, ending today")
+parser.add_argument("--concurrency", type=int, default=2, help="browser sessions to run at once")
+parser.add_argument("--split-pages", type=int, help="page range size for splitting price jobs")
+parser.add_argument("--latency", type=float, default=0, help="seconds added to each response")
+parser.add_argument("--jitter", type=float, default=0, help="extra random latency in seconds")
+parser.add_argument("--failure-rate", type=float, default=0, help="share of requests to fail")
+parser.add_argument("--short-rate", type=float, default=0,
+                    help="share of price pages served with a row missing")
+parser.add_argument("--wait-scale", type=float, default=0,
+                    help="multiplier on the scrapers' fixed waits; 0 removes them")
+parser.add_argument("--fetcher", default='selenium', choices=['selenium', 'http'],
+                    help="scrape through chromedriver, or over plain http")
+parser.add_argument("--out", help="write the report to this json file")
+
+
+def main():
+    args = parser.parse_args()
+    sr = ScraperReplay(args.states, args.markets, args.days, args.concurrency, args.split_pages,
+                       args.latency, args.jitter, args.failure_rate, args.wait_scale,
+                       short_rate=args.short_rate, fetcher=args.fetcher)
+    report = sr.run()
+    print(json.dumps(report, indent=2))
+    if args.out:
+        with open(args.out, 'w') as outfile:
+            json.dump(report, outfile, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,34 +1,135 @@
 import time
+import logging
 import argparse
 parser = argparse.ArgumentParser()
 
 from lib import scrapers as s
+from lib.async_scraper import ScrapeJob, AsyncScrapeRunner, plan_jobs
+from lib.job_queue import JobQueue, QueueWorker
+from lib.resilience import JobSupervisor, FailedJobQueue
+from lib.planner import ChunkPlanner
+from lib.catalog import Catalog
+from lib.metrics import METRICS, profiled
+from lib.forecast import PriceForecaster
+from lib.seasons import SeasonalBaselines
 
 
 #parser.add_argument("--serverless", help="lambda flag",
 #                    action="store_true")
 parser.add_argument("--start", help="scrape start date")
 parser.add_argument("--end", help="scrape end date")
+parser.add_argument("--concurrency", type=int, default=1,
+                    help="number of browser sessions to run at once")
+parser.add_argument("--split-pages", type=int,
+                    help="split price results with more pages than this across browsers")
+parser.add_argument("--target-pages", type=int,
+                    help="split price date ranges into chunks of about this many pages")
+parser.add_argument("--metrics-file", help="write prometheus-style metrics to this file")
+parser.add_argument("--profile", help="write cProfile stats to this file")
+parser.add_argument("--forecast", action="store_true",
+                    help="update price forecasts once scraping is done")
+parser.add_argument("--seasons", action="store_true",
+                    help="update season-over-season aggregates once scraping is done")
+parser.add_argument("--job-timeout", type=float, default=60,
+                    help="minutes a job may run before its browser is closed and it's retried")
+parser.add_argument("--window", type=float,
+                    help="hours the run must finish in; jobs that can't start in time are queued")
+parser.add_argument("--failed-jobs", default='data/failed_jobs.json',
+                    help="queue of failed jobs; the next run retries them first")
+parser.add_argument("--enqueue", action="store_true",
+                    help="put jobs on the shared scrape_jobs queue for workers instead of scraping")
+parser.add_argument("--worker", action="store_true",
+                    help="run jobs from the shared scrape_jobs queue until it's empty")
+parser.add_argument("--catalog", nargs="?", const='data/catalog.json',
+                    help="scrape every commodity and state in the site's catalog, skipping pairs with no recent data")
 
 
 states = ['Punjab', 'Haryana', 'Rajasthan', 'Himachal Pradesh']
 commodity = 'Kinnow'
 
+def get_catalog(args):
+    if not args.catalog:
+        return None
+    catalog = Catalog(args.catalog)
+    catalog.refresh()
+    return catalog
+
+
+def get_jobs(args, catalog=None):
+    start = args.start or time.strftime('%Y-%m-%d')
+    end = args.end or start
+    pairs = catalog.pairs() if catalog else [(commodity, state) for state in states]
+    return [ScrapeJob(datatype, c, state, start, end)
+            for c, state in pairs for datatype in ['prices', 'arrivals']]
+
+
+def get_supervisor(args):
+    return JobSupervisor(timeout=args.job_timeout * 60,
+                         window=args.window * 3600 if args.window else None,
+                         queue=FailedJobQueue(args.failed_jobs, ScrapeJob.from_dict))
+
+
+def run_concurrent(args, supervisor, catalog=None):
+    planner = ChunkPlanner(target_pages=args.target_pages) if args.target_pages else None
+    runner = AsyncScrapeRunner(get_jobs(args, catalog), args.concurrency, serverless=False,
+                               split_pages=args.split_pages, planner=planner, supervisor=supervisor,
+                               catalog=catalog)
+    runner.run()
+    for job, e in runner.failed:
+        print('{} failed: {}'.format(job, e))
+
+
+def enqueue(args, catalog=None):
+    planner = ChunkPlanner(target_pages=args.target_pages) if args.target_pages else None
+    JobQueue().enqueue(plan_jobs(get_jobs(args, catalog), planner))
+
+
+def run_worker(args):
+    # in-process failures are settled on the shared queue, not the local failed-job file
+    supervisor = JobSupervisor(timeout=args.job_timeout * 60,
+                               window=args.window * 3600 if args.window else None)
+    QueueWorker(JobQueue(), supervisor=supervisor).run()
+
+
+def run_job(job, catalog=None):
+    print(job)
+    job.run(serverless=False, catalog=catalog)
+    time.sleep(5)
+
+
+def run_sequential(args, supervisor, catalog=None):
+    # prices and arrivals are separate jobs, so one failing doesn't skip the other
+    jobs = supervisor.schedule(get_jobs(args, catalog))
+    if catalog:
+        # retried jobs from the failed-job queue are filtered too
+        jobs = catalog.filter(jobs)
+    for job in jobs:
+        e = supervisor.run(job, lambda j: run_job(j, catalog), ScrapeJob.cancel)
+        if e is not None:
+            print('{} failed: {}'.format(job, e))
+
+
 def main():
     args = parser.parse_args()
-    for state in states:
-        print(state)
-        try:
-            mps = s.MandiPriceScraper(commodity, state, args.start, args.end, serverless=False)
-            mps.run()
-            time.sleep(5)
-            mqs = s.MandiQuantityScraper(commodity, state, args.start, args.end, serverless=False)
-            mqs.run()
-            time.sleep(5)
-        except Exception as e: 
-            print(e)
-            #print(state + ' failed, moving on')
-            #continue
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    with profiled(args.profile):
+        supervisor = get_supervisor(args)
+        catalog = None if args.worker else get_catalog(args)
+        if args.enqueue:
+            enqueue(args, catalog)
+        elif args.worker:
+            run_worker(args)
+        elif args.concurrency > 1 or args.target_pages:
+            run_concurrent(args, supervisor, catalog)
+        else:
+            run_sequential(args, supervisor, catalog)
+        if args.forecast:
+            PriceForecaster(commodity).update()
+        if args.seasons:
+            SeasonalBaselines(commodity).update()
+    METRICS.log('run_complete', **METRICS.rates())
+    if args.metrics_file:
+        METRICS.write_prometheus(args.metrics_file)
 
 
 if __name__ == "__main__":
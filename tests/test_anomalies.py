@@ -0,0 +1,77 @@
+"""
+AnomalyDetector statistics: windows are the same whatever order date
+chunks are written in, and reruns leave them alone
+"""
+
+import random
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import lib.helpers as h
+from lib.anomalies import AnomalyDetector
+from lib.synthetic import SyntheticAgmarknet
+from lib.tablecreator import create_tables
+
+
+@pytest.fixture
+def prices():
+    prices, _, _ = SyntheticAgmarknet(states=1, markets=4, years=1, coverage=0.8).generate()
+    prices = prices[prices['date'] > prices['date'].max() - pd.Timedelta(days=90)]
+    return prices.assign(date=prices['date'].dt.date)
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = h.db_connect('sqlite:///{}'.format(tmp_path/'anomalies.sqlite'))
+    create_tables(engine)
+    return engine
+
+
+def chunks(df, days=10):
+    dates = pd.to_datetime(df['date'])
+    return [g.to_dict('records') for _, g in df.groupby(((dates - dates.min()).dt.days // days).values)]
+
+
+def state(engine):
+    df = pd.read_sql('select * from anomaly_state', engine)
+    return df.sort_values(['datatype', 'commodity', 'state', 'district', 'market', 'grade']).reset_index(drop=True)
+
+
+def test_chunk_order_doesnt_change_statistics(engine, prices):
+    ad = AnomalyDetector(engine)
+    batches = chunks(prices)
+    random.Random(0).shuffle(batches)
+    for rows in batches:
+        h.insert_rows(engine, 'prices', rows)
+        ad.update('prices', rows)
+    shuffled = state(engine)
+    ad.rebuild(prices['commodity'].iloc[0])
+    rebuilt = state(engine)
+    assert shuffled['recent'].tolist() == rebuilt['recent'].tolist()
+    assert np.allclose(shuffled['median'], rebuilt['median'])
+    assert np.allclose(shuffled['mad'], rebuilt['mad'])
+    assert (shuffled['n'] == ad.window).all()
+
+
+def test_rerun_leaves_statistics(engine, prices):
+    ad = AnomalyDetector(engine)
+    batches = chunks(prices)
+    for rows in batches:
+        ad.update('prices', rows)
+    before = state(engine)
+    ad.update('prices', batches[-1])
+    ad.update('prices', batches[0])
+    pd.testing.assert_frame_equal(before, state(engine))
+
+
+def test_spike_is_flagged(engine, prices):
+    spike = prices[prices['date'] == prices['date'].max()].head(1)
+    history = prices.drop(spike.index)
+    ad = AnomalyDetector(engine)
+    for rows in chunks(history):
+        ad.update('prices', rows)
+    ad.update('prices', spike.assign(modal_price=spike['modal_price'] * 10).to_dict('records'))
+    flagged = pd.read_sql('select * from anomalies', engine)
+    assert flagged[['market', 'grade']].values.tolist() == spike[['market', 'grade']].values.tolist()
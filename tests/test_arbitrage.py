@@ -0,0 +1,64 @@
+"""
+ArbitrageEngine.rank: an origin market needs a distance, not a recent
+price of its own
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from lib.arbitrage import ArbitrageEngine, MarketDistances
+from lib.synthetic import SyntheticAgmarknet
+
+
+@pytest.fixture
+def frames():
+    prices, arrivals, _ = SyntheticAgmarknet(states=1, markets=5, years=1).generate()
+    today = pd.to_datetime('today').normalize()
+    prices, arrivals = [df.assign(date=df['date'] + (today - df['date'].max())) for df in [prices, arrivals]]
+    # the origin has sent nothing to market lately
+    quiet = prices['market'] == 'Punjab Market 0'
+    forecasts = pd.DataFrame(columns=['market', 'grade', 'horizon', 'forecast_price', 'issued'])
+    return prices[~quiet], arrivals[arrivals['market'] != 'Punjab Market 0'], forecasts
+
+
+@pytest.fixture
+def distances():
+    markets = ['Punjab Market {}'.format(i) for i in range(5)]
+    return MarketDistances(pd.DataFrame({'origin': markets[0], 'destination': markets[1:],
+                                         'km': [10., 20., 30., 40.]}))
+
+
+def test_origin_without_a_recent_price(frames, distances, tmp_path):
+    ae = ArbitrageEngine('Kinnow', distances=distances, frames=frames)
+    ae.ROOTDIR = str(tmp_path)
+    grade = frames[0]['grade'].iloc[0]
+    ranked = ae.rank('Punjab Market 0', grade)
+    assert len(ranked)
+    assert 'Punjab Market 0' not in ranked['market'].tolist()
+    assert np.allclose(ranked['net_price'], (ranked['expected_price'] - ranked['km'] * 0.35).round(), atol=1)
+    assert ae.rank('Nowhere', grade).empty
+
+
+def test_matrix_is_symmetric(distances):
+    km = distances.matrix(['Punjab Market 1', 'Punjab Market 0'], origins=distances.markets())
+    assert km.shape == (5, 2)
+    assert km[0, 0] == km[1, 1] == 10 and km[0, 1] == km[1, 0] == 0
+    assert np.isnan(km[2, 0])
+
+
+def test_version_follows_settings_and_distances(frames, distances, tmp_path):
+    path = tmp_path/'distances.csv'
+    distances.save(path)
+    ae = ArbitrageEngine('Kinnow', distances=MarketDistances.load(path), frames=frames)
+    version = ae.data_version()
+    assert version == ae.data_version()
+    assert str(pd.to_datetime('today').date()) in version
+    assert ArbitrageEngine('Kinnow', distances=MarketDistances.load(path), frames=frames,
+                           elasticity=0.2).data_version() != version
+    MarketDistances(distances.distances.assign(km=distances.distances['km'] * 2)).save(path)
+    os.utime(path, (0, 0))
+    assert ae.data_version() != version
+    assert ae.distances.distances['km'].max() == 80
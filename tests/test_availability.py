@@ -0,0 +1,59 @@
+"""
+AvailabilityIndex: concurrent writers of the same commodity don't lose
+each other's days, and intervals come back as runs of days
+"""
+
+import threading
+
+import pandas as pd
+import pytest
+
+import lib.helpers as h
+from lib.availability import AvailabilityIndex, decode, encode, intervals, merge_intervals
+from lib.tablecreator import create_tables
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = h.db_connect('sqlite:///{}'.format(tmp_path/'availability.sqlite'))
+    create_tables(engine)
+    return engine
+
+
+def rows(days):
+    return [{'commodity': 'Kinnow', 'date': str(day.date()), 'state': 'Punjab', 'district': 'Abohar',
+             'market': 'Abohar'} for day in days]
+
+
+def test_concurrent_updates_keep_every_day(engine):
+    days = pd.date_range('2018-01-01', '2018-12-31')
+    chunks = [days[i::8] for i in range(8)]
+    start = threading.Barrier(len(chunks))
+
+    def write(chunk):
+        ai = AvailabilityIndex(engine)
+        start.wait()
+        for i in range(0, len(chunk), 5):
+            ai.update('prices', rows(chunk[i:i + 5]))
+
+    threads = [threading.Thread(target=write, args=(chunk,)) for chunk in chunks]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    stored = pd.read_sql('select * from availability', engine)
+    assert len(stored) == 3
+    for bitmap in stored['days']:
+        assert decode(bitmap)[:365].all()
+
+
+def test_intervals_and_merging():
+    days = [0, 1, 2, 5, 6, 20]
+    av = pd.DataFrame([{'commodity': 'Kinnow', 'datatype': 'prices', 'level': 'district', 'region': 'Abohar',
+                        'year': 2018, 'state': 'Punjab', 'days': encode(days)}])
+    runs = intervals(av, 'prices', 'district', '2018-01-01', '2018-12-31')
+    assert [(str(s)[:10], str(f)[:10]) for s, f in zip(runs['Start'], runs['Finish'])] == [
+        ('2018-01-01', '2018-01-03'), ('2018-01-06', '2018-01-07'), ('2018-01-21', '2018-01-21')]
+    merged = merge_intervals(runs, min_gap=3)
+    assert [(str(s)[:10], str(f)[:10]) for s, f in zip(merged['Start'], merged['Finish'])] == [
+        ('2018-01-01', '2018-01-07'), ('2018-01-21', '2018-01-21')]
@@ -0,0 +1,27 @@
+"""
+SharedFrames: frames come back as they went in, through shared memory
+or, where there's none, through temp files
+"""
+
+import pandas as pd
+import pytest
+
+from lib import batch
+from lib.batch import SharedFrames
+
+
+@pytest.mark.parametrize('shared', [True, False])
+def test_frames_round_trip(monkeypatch, shared):
+    if not shared:
+        monkeypatch.setattr(batch, 'shared_memory', None)
+    frames = {'prices': pd.DataFrame({'market': ['Abohar', 'Azadpur'], 'modal_price': [1200.0, 1350.0],
+                                      'date': pd.to_datetime(['2025-01-01', '2025-01-02'])}),
+              'empty': pd.DataFrame({'market': pd.Series([], dtype=object)})}
+    sf = SharedFrames(frames)
+    handles = sf.publish()
+    try:
+        for name, df in frames.items():
+            pd.testing.assert_frame_equal(SharedFrames.read(handles[name]), df)
+    finally:
+        sf.close()
+    assert sf.tmpdir is None and not sf.blocks
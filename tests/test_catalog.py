@@ -0,0 +1,65 @@
+"""
+Catalog in concurrent runs against lib.fixture_server: price jobs note
+their page counts, and jobs for empty pairs are skipped, queued ones too
+"""
+
+import pytest
+
+import lib.helpers as h
+from lib import pipeline
+from lib.async_scraper import ScrapeJob, AsyncScrapeRunner
+from lib.catalog import Catalog
+from lib.fixture_server import FixtureServer
+from lib.resilience import JobSupervisor, FailedJobQueue, RetryPolicy
+from lib.tablecreator import create_tables
+
+START, END = '2025-01-01', '2025-01-10'
+
+
+@pytest.fixture
+def engine(monkeypatch, tmp_path):
+    monkeypatch.setattr(pipeline, 'WAIT_SCALE', 0)
+    monkeypatch.chdir(tmp_path)
+    engine = h.db_connect('sqlite:///{}'.format(tmp_path/'catalog.sqlite'))
+    create_tables(engine)
+    return engine
+
+
+def jobs(*states):
+    return [ScrapeJob('prices', 'Kinnow', state, START, END) for state in states]
+
+
+def runner(fs, engine, catalog, jobs, queue=None):
+    supervisor = JobSupervisor(policy=RetryPolicy(backoff=0), queue=queue)
+    return AsyncScrapeRunner(jobs, concurrency=2, serverless=False, url=fs.url, engine=engine,
+                             fetcher='http', supervisor=supervisor, catalog=catalog)
+
+
+def test_concurrent_run_observes_and_filters(engine, tmp_path):
+    catalog = Catalog(tmp_path/'catalog.json', quiet_days=5)
+    queue = FailedJobQueue(tmp_path/'failed_jobs.json', ScrapeJob.from_dict)
+    with FixtureServer(rows_per_page=50) as fs:
+        # Haryana still reports arrivals, so it's listed, but has no prices
+        fs.prices = fs.prices[fs.prices['state'] != 'Haryana']
+        runner(fs, engine, catalog, jobs('Punjab', 'Haryana')).run()
+        pairs = catalog.data['pairs']
+        assert pairs['Kinnow|Punjab']['pages'] > 0
+        assert pairs['Kinnow|Haryana'] == dict(pairs['Kinnow|Haryana'], pages=0, quiet_days=10)
+
+        queue.push(jobs('Haryana')[0], OSError('browser closed'), 'error')
+        rerun = runner(fs, engine, catalog, jobs('Punjab', 'Haryana'), queue)
+        assert [job.state for job in rerun.plan()] == ['Punjab']
+
+
+def test_quiet_days_count_each_day_once(tmp_path):
+    catalog = Catalog(tmp_path/'catalog.json', quiet_days=60)
+    for _ in range(3):
+        catalog.observe('Kinnow', 'Goa', '2025-01-01', '2025-01-30', pages=0)
+    assert catalog.data['pairs']['Kinnow|Goa']['quiet_days'] == 30
+    assert not catalog.empty('Kinnow', 'Goa')
+    catalog.observe('Kinnow', 'Goa', '2025-01-15', '2025-03-01', pages=0)
+    assert catalog.data['pairs']['Kinnow|Goa']['quiet_days'] == 60
+    assert catalog.empty('Kinnow', 'Goa')
+    catalog.observe('Kinnow', 'Goa', '2025-02-10', '2025-02-10', pages=1)
+    assert catalog.data['pairs']['Kinnow|Goa']['quiet_days'] == 20
+    assert not catalog.empty('Kinnow', 'Goa')
@@ -0,0 +1,113 @@
+"""
+Per-date fingerprints against lib.fixture_server: re-scrapes of the same
+dates, whichever query they come from, only write the dates that changed
+"""
+
+import pandas as pd
+import pytest
+
+import lib.helpers as h
+from lib import pipeline
+from lib.async_scraper import ScrapeJob, AsyncScrapeRunner
+from lib.fingerprints import digest
+from lib.metrics import METRICS
+from lib.fixture_server import FixtureServer
+from lib.pipeline import CallbackSink
+from lib.scrapers import MandiPriceScraper
+from lib.tablecreator import create_tables
+
+
+@pytest.fixture
+def engine(monkeypatch, tmp_path):
+    monkeypatch.setattr(pipeline, 'WAIT_SCALE', 0)
+    monkeypatch.chdir(tmp_path)
+    url = 'sqlite:///{}'.format(tmp_path/'fingerprints.sqlite')
+    monkeypatch.setenv('AGMARKNET_DB', url)
+    engine = h.db_connect(url)
+    create_tables(engine)
+    return engine
+
+
+@pytest.fixture
+def fs():
+    with FixtureServer(rows_per_page=20) as fs:
+        yield fs
+
+
+def scrape(fs, start, end, sink=None):
+    rows = []
+    mps = MandiPriceScraper('Kinnow', 'Punjab', start, end, serverless=False, writetodb=True, url=fs.url,
+                            fetcher='http', sink=sink or CallbackSink(lambda table, batch: rows.extend(batch)))
+    mps.run()
+    return rows
+
+
+def dates(rows):
+    return sorted({str(r['date'])[:10] for r in rows})
+
+
+def stored(engine):
+    return pd.read_sql('select * from date_fingerprints', engine)
+
+
+def test_digest_ignores_order():
+    rows = [{'commodity': 'Kinnow', 'date': '2025-01-01', 'state': 'Punjab', 'district': 'Abohar',
+             'market': 'Abohar', 'grade': 'FAQ', 'variety': 'Kinnow', 'min_price': p, 'max_price': p + 100,
+             'modal_price': p + 50} for p in [900, 1000, 1100]]
+    assert digest(rows) == digest(rows[::-1])
+    assert digest(rows) != digest(rows[:2])
+
+
+def test_same_window_is_unchanged(engine, fs):
+    first = scrape(fs, '2025-01-01', '2025-01-10')
+    assert dates(first) == [str(d.date()) for d in pd.date_range('2025-01-01', '2025-01-10')]
+    assert scrape(fs, '2025-01-01', '2025-01-10') == []
+    assert len(stored(engine)) == 10
+
+
+def test_trailing_window_reads_only_new_dates(engine, fs):
+    scrape(fs, '2025-01-01', '2025-01-10')
+    METRICS.reset()
+    shifted = scrape(fs, '2025-01-02', '2025-01-11')
+    assert dates(shifted) == ['2025-01-11']
+    # the page where the stored dates end, and the new date's pages
+    assert METRICS.total('pages') <= 3
+    # one fingerprint per date, however many windows covered it
+    assert len(stored(engine)) == 11
+    assert scrape(fs, '2025-01-03', '2025-01-11') == []
+
+
+def test_late_report_is_written(engine, fs):
+    scrape(fs, '2025-01-01', '2025-01-10')
+    rows = fs.prices[(fs.prices['date'] == '2025-01-05') & (fs.prices['commodity'] == 'Kinnow') &
+                     (fs.prices['state'] == 'Punjab')]
+    fs.prices = pd.concat([fs.prices, rows.head(1).assign(market='Late Market')])
+    shifted = scrape(fs, '2025-01-02', '2025-01-11')
+    assert 'Late Market' in {r['market'] for r in shifted}
+    assert '2025-01-11' in dates(shifted)
+
+
+def test_split_job_stores_its_dates(engine, fs):
+    job = ScrapeJob('prices', 'Kinnow', 'Punjab', '2025-01-01', '2025-01-10')
+    AsyncScrapeRunner([job], concurrency=2, serverless=False, split_pages=4, url=fs.url, engine=engine,
+                      fetcher='http').run()
+    assert len(stored(engine)) == 10
+    assert pd.read_sql('select * from fingerprint_parts', engine).empty
+    assert scrape(fs, '2025-01-01', '2025-01-10') == []
+
+
+def test_resumed_job_stores_its_dates(engine, fs):
+    class Failing(CallbackSink):
+        def write(self, table, rows, key):
+            if self.batches:
+                raise OSError('connection reset')
+            self.batches += 1
+
+    sink = Failing(None)
+    sink.batches = 0
+    with pytest.raises(OSError):
+        scrape(fs, '2025-01-01', '2025-01-10', sink)
+    assert stored(engine).empty
+    resumed = scrape(fs, '2025-01-01', '2025-01-10')
+    assert resumed and len(stored(engine)) == 10
+    assert scrape(fs, '2025-01-01', '2025-01-10') == []
@@ -0,0 +1,79 @@
+"""
+JobQueue and QueueWorker on sqlite: enqueueing, expired last attempts,
+and a worker losing its lease mid-job
+"""
+
+import threading
+
+import pandas as pd
+import pytest
+from sqlalchemy import text
+
+import lib.helpers as h
+from lib.async_scraper import ScrapeJob
+from lib.job_queue import JobQueue, QueueWorker, DONE, FAILED, QUEUED, RUNNING
+from lib.resilience import JobSupervisor, RetryPolicy
+from lib.tablecreator import create_tables
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = h.db_connect('sqlite:///{}'.format(tmp_path/'queue.sqlite'))
+    create_tables(engine)
+    return engine
+
+
+def jobs(n=3):
+    return [ScrapeJob('prices', 'Kinnow', 'Punjab', str(day.date()), str(day.date()))
+            for day in pd.date_range('2018-12-01', periods=n)]
+
+
+def statuses(engine):
+    with engine.connect() as conn:
+        return dict(conn.execute(text('select job, status from scrape_jobs')).fetchall())
+
+
+def test_enqueue_counts_and_requeues(engine):
+    jq = JobQueue(engine)
+    assert jq.enqueue(jobs()) == 3
+    assert jq.enqueue(jobs()) == 0
+    claim = jq.claim('w')
+    jq.complete(claim)
+    assert statuses(engine)[repr(claim[2])] == DONE
+    assert jq.enqueue(jobs(), requeue=False) == 0
+    assert jq.enqueue(jobs()) == 1
+    assert set(statuses(engine).values()) == {QUEUED}
+
+
+def test_last_attempt_expires_to_failed(engine):
+    jq = JobQueue(engine, lease=-1, max_attempts=1)
+    jq.enqueue(jobs(1))
+    assert jq.claim('w') is not None
+    assert list(statuses(engine).values()) == [RUNNING]
+    assert jq.claim('w') is None
+    assert list(statuses(engine).values()) == [FAILED]
+
+
+def test_lost_lease_isnt_retried(engine, monkeypatch):
+    cancelled = threading.Event()
+    runs = []
+
+    def run(job, serverless, url, fetcher):
+        runs.append(job)
+        # another worker takes the job over; the heartbeat finds out and cancels
+        with engine.begin() as conn:
+            conn.execute(text("update scrape_jobs set token = 'thief'"))
+        cancelled.wait(5)
+        raise OSError('browser closed')
+
+    monkeypatch.setattr(ScrapeJob, 'run', run)
+    monkeypatch.setattr(ScrapeJob, 'cancel', lambda job: cancelled.set())
+    jq = JobQueue(engine, lease=0.3)
+    jq.enqueue(jobs(1))
+    supervisor = JobSupervisor(policy=RetryPolicy(backoff=0))
+    worker = QueueWorker(jq, 'w', supervisor=supervisor)
+    worker.run_claim(jq.claim('w'))
+    assert len(runs) == 1
+    assert supervisor.breaker.failures == 0
+    assert list(statuses(engine).values()) == [RUNNING]
+    assert worker.completed == 0
@@ -0,0 +1,32 @@
+"""
+Metrics timers: an error raised through nested timed stages is counted
+once, and every stage is still timed
+"""
+
+import pytest
+
+from lib.metrics import Metrics
+
+
+def test_nested_timers_count_an_error_once():
+    metrics = Metrics()
+    with pytest.raises(ValueError):
+        with metrics.timer('job'):
+            with metrics.timer('page'):
+                with metrics.timer('parse'):
+                    raise ValueError('bad table')
+    assert metrics.total('errors') == 1
+    assert list(metrics.counters) == [('errors', (('error', 'ValueError'), ('stage', 'parse')))]
+    assert sorted(stage for stage, _ in metrics.timings) == ['job', 'page', 'parse']
+
+
+def test_caught_errors_are_counted():
+    metrics = Metrics()
+    with metrics.timer('job'):
+        for _ in range(2):
+            try:
+                with metrics.timer('page'):
+                    raise ValueError('short page')
+            except ValueError:
+                pass
+    assert metrics.total('errors') == 2
@@ -0,0 +1,75 @@
+"""
+Page moves against lib.fixture_server: jumps are only taken through a
+numbered pager that shows where the grid landed, and fall back to Next
+"""
+
+import pytest
+
+from lib import pipeline
+import lib.fixture_server as fixture_server
+from lib.fixture_server import FixtureServer, PAGER
+from lib.pipeline import CallbackSink, pager_page
+from lib.scrapers import MandiPriceScraper
+
+START, END = '2025-01-01', '2025-01-20'
+
+
+@pytest.fixture(autouse=True)
+def no_waits(monkeypatch, tmp_path):
+    monkeypatch.setattr(pipeline, 'WAIT_SCALE', 0)
+    monkeypatch.chdir(tmp_path)
+
+
+def scrape(fs, pages=None):
+    rows = []
+    mps = MandiPriceScraper('Kinnow', 'Punjab', START, END, serverless=False, writetodb=False, url=fs.url,
+                            fetcher='http', pages=pages, sink=CallbackSink(lambda table, batch: rows.extend(batch)))
+    mps.run()
+    return rows, mps.fetcher
+
+
+def expected(fs, first, last):
+    df = fs.select(fs.prices, {'Tx_Commodity': 'Kinnow', 'Tx_State': 'Punjab', 'Tx_FromDate': START, 'Tx_ToDate': END})
+    df = df.sort_values(['date', 'district', 'market', 'grade'])
+    return df.iloc[(first - 1)*fs.rows_per_page:last*fs.rows_per_page]
+
+
+def keys(rows):
+    return sorted((str(r['date'])[:10], r['district'], r['market'], r['grade']) for r in rows)
+
+
+def test_pager_page():
+    link = '<td><a href="javascript:__doPostBack(&#39;{}&#39;,&#39;Page$4&#39;)">4</a></td>'.format(PAGER)
+    assert pager_page('<tr><td><span>3</span></td>{}</tr>'.format(link), PAGER) == 3
+    assert pager_page('<tr>{}</tr>'.format(link), PAGER) is None
+    assert pager_page("<script>function __doPostBack(t, a) {}</script>", PAGER) is None
+
+
+def test_sequential_pages_click_next():
+    with FixtureServer(rows_per_page=20) as fs:
+        rows, fetcher = scrape(fs)
+        assert keys(rows) == keys(expected(fs, 1, 100).to_dict('records'))
+    assert fetcher.jumps is None
+
+
+@pytest.mark.parametrize('numbered', [True, False])
+def test_page_range(numbered):
+    with FixtureServer(rows_per_page=20, numbered_pager=numbered) as fs:
+        rows, fetcher = scrape(fs, pages=(5, 8))
+        assert keys(rows) == keys(expected(fs, 5, 8).to_dict('records'))
+    assert fetcher.jumps is numbered
+
+
+def test_misjump_falls_back_to_next(monkeypatch):
+    serve = FixtureServer.prices_page
+
+    def ignore_postbacks(self, query):
+        if str(query.get('page', '')).startswith('Page$'):
+            query = dict(query, page='1')
+        return serve(self, query)
+
+    monkeypatch.setattr(fixture_server.FixtureServer, 'prices_page', ignore_postbacks)
+    with FixtureServer(rows_per_page=20) as fs:
+        rows, fetcher = scrape(fs, pages=(5, 8))
+        assert keys(rows) == keys(expected(fs, 5, 8).to_dict('records'))
+    assert fetcher.misjumped
@@ -0,0 +1,96 @@
+"""
+PushdownQueries on sqlite against the pandas processors they stand in for,
+on the same synthetic history
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import lib.helpers as h
+from lib.plotters import (CurrentMarketProcessor, CurrentMarkets, DataAvailabilityProcessor, TrendProcessor,
+                          Trends)
+from lib.pushdown import PushdownQueries
+from lib.synthetic import SyntheticAgmarknet
+from lib.tablecreator import create_tables
+
+PRICES = ['min_price', 'modal_price', 'max_price']
+
+
+@pytest.fixture(scope='module')
+def history():
+    prices, arrivals, lm = SyntheticAgmarknet(states=2, markets=12, years=1, coverage=0.6).generate()
+    today = pd.to_datetime('today').normalize()
+    prices, arrivals = [df.assign(date=df['date'] + (today - df['date'].max())) for df in [prices, arrivals]]
+    # a gap, so availability has more than one run per region
+    gap = (prices['date'] > today - pd.Timedelta(days=200)) & (prices['date'] < today - pd.Timedelta(days=180))
+    return prices[~gap].reset_index(drop=True), arrivals, lm
+
+
+@pytest.fixture(scope='module')
+def queries(history, tmp_path_factory):
+    prices, arrivals, lm = history
+    engine = h.db_connect('sqlite:///{}'.format(tmp_path_factory.mktemp('pushdown')/'pushdown.sqlite'))
+    create_tables(engine)
+    for table, df in [('prices', prices), ('arrivals', arrivals)]:
+        h.insert_rows(engine, table, df.assign(date=df['date'].dt.date).to_dict('records'))
+    start = str(prices['date'].min().date())
+    return PushdownQueries(prices['commodity'].iloc[0], start, engine=engine)
+
+
+def frame(df, keys):
+    return df.sort_values(keys).reset_index(drop=True)
+
+
+@pytest.mark.parametrize('where', ['Combined', 'state', 'market'])
+def test_trends(history, queries, where):
+    prices, arrivals, _ = history
+    grade = prices['grade'].iloc[0]
+    state = prices['state'].iloc[0] if where != 'Combined' else 'Combined'
+    market = prices['market'].iloc[0] if where == 'market' else None
+    hp, ha = TrendProcessor(prices, arrivals, state, market, grade).prep_data()
+    qp, qa = queries.trends(state, market, grade)
+    assert len(qp) == len(hp) and len(qa) == len(ha)
+    hp, qp = frame(hp, ['date'] + PRICES), frame(qp, ['date'] + PRICES)
+    assert (qp['date'] == hp['date']).all()
+    assert np.allclose(qp[PRICES].astype(float), hp[PRICES].astype(float))
+    ha, qa = frame(ha, ['date', 'quantity']), frame(qa, ['date', 'quantity'])
+    assert (qa['date'] == ha['date']).all()
+    assert np.allclose(qa['quantity'], ha['quantity'])
+
+
+@pytest.mark.parametrize('tcutoff, period', [(7, 3), (14, 5)])
+def test_current_markets(history, queries, tcutoff, period):
+    prices, arrivals, _ = history
+    hp, ha = CurrentMarketProcessor(prices.copy(), arrivals.copy(), 3, tcutoff, period).prep_data()
+    qp, qa = queries.current_markets(3, tcutoff, period)
+    keys = ['state', 'district', 'market', 'grade']
+    p = qp.merge(hp, on=keys, suffixes=('', '_pandas'))
+    assert len(p) == len(qp) == len(hp)
+    assert (p['date'] == p['date_pandas']).all()
+    assert np.allclose(p['r_modal_price'], p['r_modal_price_pandas'])
+    assert np.allclose(p['r_price_range'], p['r_price_range_pandas'])
+    a = qa.merge(ha, on=keys[:-1], suffixes=('', '_pandas'))
+    assert len(a) == len(qa) == len(ha)
+    assert np.allclose(a['r_quantity'], a['r_quantity_pandas'])
+
+
+@pytest.mark.parametrize('datatype, col', [('prices', 'state'), ('prices', 'district'), ('arrivals', 'district')])
+def test_availability(history, queries, datatype, col):
+    prices, arrivals, lm = history
+    df = prices if datatype == 'prices' else arrivals
+    processed = DataAvailabilityProcessor(df, col, lm).prep_data()
+    queried = queries.availability(datatype, col)
+    runs = lambda d: sorted(zip(d['Task'], pd.to_datetime(d['Start']), pd.to_datetime(d['Finish'])))
+    assert runs(queried) == runs(processed)
+    assert len(runs(queried)) > df[col].nunique()
+    if col == 'district':
+        states = lambda d: sorted(zip(d['Task'], d['state']))
+        assert states(queried) == states(processed)
+
+
+@pytest.mark.parametrize('view, kwargs', [(CurrentMarkets, {'use_snapshot': False}), (Trends, {})])
+def test_default_start_is_a_date(view, kwargs):
+    # a time part would make sqlite's string comparison drop the first day
+    start = view('Kinnow', **kwargs).queries.start
+    assert start == str((pd.to_datetime('today') - pd.Timedelta(days=92)).date())
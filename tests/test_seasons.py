@@ -0,0 +1,58 @@
+"""
+SeasonalBaselines on sqlite: markets of the same name in different states
+and districts keep series of their own
+"""
+
+import datetime
+
+import pandas as pd
+import pytest
+
+import lib.helpers as h
+from lib.plotters import SeasonTrends
+from lib.seasons import Season, SeasonalBaselines
+from lib.tablecreator import create_tables
+
+PLACES = [('Punjab', 'Muktsar', 'Malout', 1000.), ('Rajasthan', 'Sri Ganganagar', 'Malout', 3000.),
+          ('Punjab', 'Fazilka', 'Abohar', 2000.)]
+
+
+@pytest.fixture
+def engine(monkeypatch, tmp_path):
+    url = 'sqlite:///{}'.format(tmp_path/'seasons.sqlite')
+    monkeypatch.setenv('AGMARKNET_DB', url)
+    engine = h.db_connect(url)
+    create_tables(engine)
+    days = [datetime.date(2024, 11, 1) + datetime.timedelta(days=i) for i in range(5)]
+    prices = [{'commodity': 'Kinnow', 'date': d, 'state': state, 'district': district, 'market': market,
+               'grade': 'Medium', 'variety': 'Kinnow', 'min_price': price - 100, 'max_price': price + 100,
+               'modal_price': price} for d in days for state, district, market, price in PLACES]
+    arrivals = [{'commodity': 'Kinnow', 'date': d, 'state': state, 'district': district, 'market': market,
+                 'quantity': price / 100} for d in days for state, district, market, price in PLACES]
+    h.insert_rows(engine, 'prices', prices)
+    h.insert_rows(engine, 'arrivals', arrivals)
+    SeasonalBaselines('Kinnow', engine=engine).build(2024, 2024)
+    return engine
+
+
+def test_markets_keyed_on_state_and_district(engine):
+    df = pd.read_sql("select * from season_aggregates where level = 'market' and region = 'Malout' "
+                     "and datatype = 'prices'", engine)
+    assert len(df) == 10
+    series = df.groupby(['state', 'district'])['modal_price']
+    assert series.min().to_dict() == series.max().to_dict() == {('Punjab', 'Muktsar'): 1000.,
+                                                                ('Rajasthan', 'Sri Ganganagar'): 3000.}
+    states = pd.read_sql("select * from season_aggregates where level = 'state' and datatype = 'arrivals'",
+                         engine)
+    assert set(zip(states['state'], states['district'], states['region'])) == {
+        ('Punjab', '', 'Punjab'), ('Rajasthan', '', 'Rajasthan')}
+
+
+def test_plot_asks_which_market(engine):
+    st = SeasonTrends(seasons=1, season=Season())
+    st.current = 2024
+    with pytest.raises(ValueError):
+        st.plot(market='Malout')
+    aggregates = st.get_data('market', 'Malout', 'Medium', 'Rajasthan')
+    assert set(aggregates['modal_price'].dropna()) == {3000.}
+    assert set(aggregates['quantity'].dropna()) == {30.}
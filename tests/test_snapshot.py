@@ -0,0 +1,66 @@
+"""
+CurrentMarketProcessor.prep_snapshot against prep_data on the same
+history: same markets, same rolling averages and totals, at the cutoffs
+the snapshot holds
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import lib.helpers as h
+from lib import snapshot
+from lib.plotters import CurrentMarketProcessor
+from lib.snapshot import MarketSnapshot
+from lib.synthetic import SyntheticAgmarknet
+from lib.tablecreator import create_tables
+
+PRICE_KEYS = ['state', 'district', 'market', 'grade']
+ARRIVAL_KEYS = ['state', 'district', 'market']
+
+
+def history(lag_p, lag_a):
+    """Twenty days of synthetic prices and arrivals ending lag_p and lag_a days before today"""
+    prices, arrivals, _ = SyntheticAgmarknet(states=2, markets=15, years=1, coverage=0.7).generate()
+    today = pd.to_datetime('today').normalize()
+    frames = []
+    for df, lag in [(prices, lag_p), (arrivals, lag_a)]:
+        df = df.assign(date=df['date'] + (today - pd.Timedelta(days=lag) - df['date'].max()))
+        frames.append(df[df['date'] > df['date'].max() - pd.Timedelta(days=20)].reset_index(drop=True))
+    return frames
+
+
+def snapshot_tables(tmp_path, prices, arrivals):
+    """The snapshot after writing each day's rows per state, as the nightly scrape does"""
+    engine = h.db_connect('sqlite:///{}'.format(tmp_path/'snapshot.sqlite'))
+    create_tables(engine)
+    ms = MarketSnapshot(engine)
+    for table, df in [('prices', prices), ('arrivals', arrivals)]:
+        for _, g in df.assign(date=df['date'].dt.date).groupby(['date', 'state']):
+            rows = g.to_dict('records')
+            h.insert_rows(engine, table, rows)
+            ms.update(table, rows)
+    return (pd.read_sql('select * from latest_prices', engine),
+            pd.read_sql('select * from latest_arrivals', engine))
+
+
+@pytest.mark.parametrize('lag_p, lag_a', [(0, 0), (0, 1), (3, 4)])
+@pytest.mark.parametrize('tcutoff', [3, snapshot.WINDOW])
+def test_snapshot_matches_history(tmp_path, lag_p, lag_a, tcutoff):
+    prices, arrivals = history(lag_p, lag_a)
+    latest_p, latest_a = snapshot_tables(tmp_path, prices, arrivals)
+    hp, ha = CurrentMarketProcessor(prices.copy(), arrivals.copy(), 3, tcutoff, snapshot.PERIOD).prep_data()
+    sp, sa = CurrentMarketProcessor(None, None, 3, tcutoff, snapshot.PERIOD).prep_snapshot(latest_p, latest_a)
+
+    assert sorted(sp['market'].unique()) == sorted(hp['market'].unique())
+    p = sp.merge(hp, on=PRICE_KEYS, suffixes=('', '_history'))
+    assert len(p) == len(sp) == len(hp)
+    assert np.allclose(p['r_modal_price'], p['r_modal_price_history'])
+    assert np.allclose(p['r_price_range'], p['r_price_range_history'])
+
+    a = sa.merge(ha, on=ARRIVAL_KEYS, suffixes=('', '_history'))
+    assert len(a) == len(sa) == len(ha)
+    assert np.allclose(a['r_quantity'], a['r_quantity_history'])
+    recent = arrivals[arrivals['date'] > pd.to_datetime('today') - pd.Timedelta(days=tcutoff)]
+    totals = recent.groupby(ARRIVAL_KEYS)['quantity'].sum()
+    assert np.allclose(a.set_index(ARRIVAL_KEYS)['recent_quantity'], totals.reindex(a.set_index(ARRIVAL_KEYS).index))